@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+YoloHome AI - Benchmark độ trễ của predict.py
+=============================================
+Đo p50/p95/p99 (ms) cho từng giai đoạn của một lần dự đoán:
+
+    interpreter          khởi động trình thông dịch (chỉ chế độ cold)
+    imports              import predict.py và các thư viện của nó
+    load_model           load_or_create_model / ModelCache.get
+    get_sensor_data      get_latest_sensor_data (dữ liệu giả lập, có thể thêm độ trễ)
+    feature_assembly     build_horizon_features
+    model_predict        model.predict trên ma trận đặc trưng
+    tree_confidence      predict_with_spread (dự đoán từng cây + độ tin cậy)
+    json_serialization   format_prediction + json.dumps
+
+Hai chế độ:
+    cold   mỗi lần đo là một tiến trình Python mới (giống spawn mỗi chu kỳ)
+    warm   một tiến trình, mô hình đã tải sẵn (giống predict.py --serve)
+
+Ví dụ:
+    python benchmark_predict.py --mode both --iterations 20 --trees 100
+    python benchmark_predict.py --format npz --save-baseline bench_baseline.json
+    python benchmark_predict.py --baseline bench_baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STAGES = [
+    'interpreter', 'imports', 'load_model', 'get_sensor_data', 'feature_assembly',
+    'model_predict', 'tree_confidence', 'json_serialization'
+]
+
+class FixtureSensorSource:
+    """
+    Nguồn dữ liệu thay thế PostgreSQL cho benchmark: trả về các lần đọc cố định,
+    có thể giả lập độ trễ mạng/truy vấn.
+    """
+
+    def __init__(self, n_sensors=1, latency_ms=0.0):
+        self.latency_ms = latency_ms
+        now = datetime(2025, 5, 6, 13, 0)
+        self.readings = {
+            sensor_id: [(now - timedelta(minutes=i), 28.0 + 0.1 * sensor_id + 0.05 * i) for i in range(4)]
+            for sensor_id in range(1, n_sensors + 1)
+        }
+
+    def _wait(self):
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000.0)
+
+    def get_default_sensor_id(self):
+        return 1
+
+    def fetch_latest_readings(self, sensor_id=None, limit=3):
+        self._wait()
+        return self.readings[sensor_id or 1][:limit]
+
+    def fetch_latest_readings_all(self, limit=3):
+        self._wait()
+        return {sensor_id: rows[:limit] for sensor_id, rows in self.readings.items()}
+
+def build_synthetic_model(model_dir, n_trees=100, n_rows=5000, model_format='pkl'):
+    """
+    Huấn luyện một Random Forest giả lập trên đặc trưng lịch của predict.py
+    và lưu vào model_dir (temp_model.pkl, thêm temp_model.npz nếu model_format='npz').
+    """
+    import joblib
+    import numpy as np
+    import pandas as pd
+    from sklearn.ensemble import RandomForestRegressor
+    sys.path.insert(0, SCRIPT_DIR)
+    from predict import FEATURE_NAMES
+
+    rng = np.random.RandomState(42)
+    times = pd.date_range('2025-01-01', periods=n_rows, freq='15min')
+    hours = times.hour.values
+    X = pd.DataFrame({
+        'hour': hours,
+        'day_of_week': times.dayofweek.values,
+        'time_morning': ((hours >= 5) & (hours < 12)).astype(int),
+        'time_afternoon': ((hours >= 12) & (hours < 17)).astype(int),
+        'time_evening': ((hours >= 17) & (hours < 21)).astype(int),
+        'time_night': ((hours >= 21) | (hours < 5)).astype(int)
+    })[FEATURE_NAMES]
+    y = 27 + 4 * np.sin((hours - 6) * np.pi / 12) + rng.normal(0, 0.5, n_rows)
+
+    model = RandomForestRegressor(n_estimators=n_trees, max_depth=10, random_state=42, n_jobs=-1)
+    model.fit(X, y)
+
+    os.makedirs(model_dir, exist_ok=True)
+    joblib.dump(model, os.path.join(model_dir, 'temp_model.pkl'))
+    if model_format == 'npz':
+        sys.path.insert(0, os.path.join(SCRIPT_DIR, 'training'))
+        from model_trainer import export_forest_arrays
+        export_forest_arrays(model, os.path.join(model_dir, 'temp_model.npz'), FEATURE_NAMES)
+    return model_dir
+
+def run_stages(predict, model, source):
+    """Đo các giai đoạn sau khi đã có mô hình; trả về dictionary ms theo giai đoạn"""
+    timings = {}
+
+    start = time.perf_counter()
+    sensor_data = predict.get_latest_sensor_data(source=source)
+    timings['get_sensor_data'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    future_times, X = predict.build_horizon_features(sensor_data['current_time'], predict.TIME_POINTS)
+    timings['feature_assembly'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    if hasattr(model, 'estimators_'):
+        # Mô hình scikit-learn được huấn luyện với tên cột
+        import pandas as pd
+        model.predict(pd.DataFrame(X, columns=predict.FEATURE_NAMES))
+    else:
+        model.predict(X)
+    timings['model_predict'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    predictions, confidences = predict.predict_with_spread(model, X)
+    timings['tree_confidence'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    json.dumps(predict.format_prediction(sensor_data, future_times, predictions, confidences))
+    timings['json_serialization'] = (time.perf_counter() - start) * 1000
+
+    return timings
+
+def child_main(args):
+    """Một lần đo trong tiến trình mới (chế độ cold); in timings dạng JSON"""
+    import warnings
+    warnings.filterwarnings('ignore')
+
+    start = time.perf_counter()
+    sys.path.insert(0, SCRIPT_DIR)
+    import predict
+    imports_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    model = predict.load_model_file(predict.find_model_file(args.model_dir))
+    load_ms = (time.perf_counter() - start) * 1000
+
+    source = FixtureSensorSource(latency_ms=args.db_latency_ms)
+    timings = {'imports': imports_ms, 'load_model': load_ms}
+    timings.update(run_stages(predict, model, source))
+    print(json.dumps(timings))
+    return 0
+
+def bench_cold(args):
+    samples = []
+    command = [sys.executable, os.path.abspath(__file__), '--child',
+               '--model-dir', args.model_dir, '--db-latency-ms', str(args.db_latency_ms)]
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        output = subprocess.run(command, capture_output=True, text=True, check=True)
+        total_ms = (time.perf_counter() - start) * 1000
+        timings = json.loads(output.stdout.strip().splitlines()[-1])
+        # Phần còn lại của thời gian tiến trình: khởi động trình thông dịch và thoát
+        timings['interpreter'] = max(total_ms - sum(timings.values()), 0.0)
+        timings['total'] = total_ms
+        samples.append(timings)
+    return samples
+
+def bench_warm(args):
+    import warnings
+    warnings.filterwarnings('ignore')
+    sys.path.insert(0, SCRIPT_DIR)
+    import predict
+
+    cache = predict.ModelCache(model_dir=args.model_dir)
+    cache.get()
+    source = FixtureSensorSource(latency_ms=args.db_latency_ms)
+
+    samples = []
+    for _ in range(args.warmup + args.iterations):
+        start_total = time.perf_counter()
+        start = time.perf_counter()
+        model = cache.get()
+        timings = {'load_model': (time.perf_counter() - start) * 1000}
+        timings.update(run_stages(predict, model, source))
+        timings['total'] = (time.perf_counter() - start_total) * 1000
+        samples.append(timings)
+    return samples[args.warmup:]
+
+def percentile(values, q):
+    """Percentile theo nội suy tuyến tính (giống numpy.percentile mặc định)"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def summarize(samples):
+    summary = {}
+    for stage in STAGES + ['total']:
+        values = [sample[stage] for sample in samples if stage in sample]
+        if values:
+            summary[stage] = {
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99)
+            }
+    return summary
+
+def print_summary(mode, summary, baseline=None):
+    print(f"\n[{mode}] độ trễ theo giai đoạn (ms)")
+    header = f"{'giai đoạn':<20}{'p50':>10}{'p95':>10}{'p99':>10}"
+    if baseline:
+        header += f"{'p50 cũ':>10}{'thay đổi':>10}"
+    print(header)
+    for stage, stats in summary.items():
+        line = f"{stage:<20}{stats['p50']:>10.2f}{stats['p95']:>10.2f}{stats['p99']:>10.2f}"
+        old = (baseline or {}).get(stage)
+        if old:
+            change = (stats['p50'] - old['p50']) / old['p50'] * 100 if old['p50'] else 0.0
+            line += f"{old['p50']:>10.2f}{change:>+9.1f}%"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description='YoloHome AI - Benchmark độ trễ predict.py')
+    parser.add_argument('--mode', choices=['cold', 'warm', 'both'], default='both',
+                      help='Đo tiến trình mới mỗi lần (cold), tiến trình thường trú (warm) hoặc cả hai')
+    parser.add_argument('--iterations', type=int, default=20,
+                      help='Số lần đo mỗi chế độ')
+    parser.add_argument('--warmup', type=int, default=3,
+                      help='Số lần chạy bỏ qua trước khi đo ở chế độ warm')
+    parser.add_argument('--trees', type=int, default=100,
+                      help='Số cây của mô hình giả lập')
+    parser.add_argument('--format', choices=['pkl', 'npz'], default='pkl',
+                      help='Định dạng mô hình được predict.py tải')
+    parser.add_argument('--model-dir', type=str, default=None,
+                      help='Thư mục mô hình có sẵn (mặc định: tạo mô hình giả lập tạm thời)')
+    parser.add_argument('--db-latency-ms', type=float, default=0.0,
+                      help='Độ trễ giả lập cho mỗi truy vấn dữ liệu cảm biến')
+    parser.add_argument('--output', type=str, default=None,
+                      help='Ghi kết quả (JSON) ra file')
+    parser.add_argument('--baseline', type=str, default=None,
+                      help='So sánh với file kết quả đã lưu trước đó')
+    parser.add_argument('--save-baseline', type=str, default=None,
+                      help='Lưu kết quả lần chạy này làm baseline')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child_main(args)
+
+    with tempfile.TemporaryDirectory(prefix='yolohome_bench_') as tmp_dir:
+        if args.model_dir is None:
+            print(f"Tạo mô hình giả lập {args.trees} cây ({args.format})...")
+            args.model_dir = build_synthetic_model(tmp_dir, n_trees=args.trees, model_format=args.format)
+
+        results = {
+            'config': {
+                'iterations': args.iterations,
+                'trees': args.trees,
+                'format': args.format,
+                'db_latency_ms': args.db_latency_ms,
+                'python': sys.version.split()[0]
+            }
+        }
+        baseline = None
+        if args.baseline and os.path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        modes = ['cold', 'warm'] if args.mode == 'both' else [args.mode]
+        for mode in modes:
+            samples = bench_cold(args) if mode == 'cold' else bench_warm(args)
+            results[mode] = summarize(samples)
+            print_summary(mode, results[mode], (baseline or {}).get(mode))
+
+    for path in [args.output, args.save_baseline]:
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            print(f"\nĐã lưu kết quả benchmark vào {path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf‑8 -*-
+"""
+Benchmark collapse_runs: vòng lặp groupby cũ so với bản vector hoá một lượt
+và bản theo luồng (chunk).
+
+Ví dụ:
+    python benchmark_run_length_filter.py --rows 10000000 --sensors 2000
+    python benchmark_run_length_filter.py --rows 50000000 --sensors 5000 --skip-legacy
+"""
+
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from run_length_filter import collapse_runs, collapse_runs_stream
+
+def legacy_collapse_runs(df, min_run=3, id_col="sensor_id", value_col="value",
+                         ts_col="timestamp", tol=1e-9):
+    """
+    Bản cũ (vòng lặp theo từng sensor), giữ lại để so sánh. Chỉ sửa cờ đầu run
+    (NaN > tol là False nên fillna(True) cũ không có tác dụng) để kết quả so sánh được.
+    """
+    if df.empty:
+        return df
+    df = df.sort_values([id_col, ts_col]).reset_index(drop=True)
+    keep = pd.Series(False, index=df.index)
+    for _, group in df.groupby(id_col):
+        idx = group.index
+        diff = group[value_col].diff().abs()
+        changed = (diff > tol) | diff.isna()
+        run_id = changed.cumsum()
+        run_len = group.groupby(run_id)[value_col].transform("size")
+        keep_group = (run_len < min_run) | changed
+        keep.loc[idx] = keep_group
+    return df.loc[keep].copy()
+
+def make_readings(n_rows, n_sensors, seed=42):
+    """Dữ liệu DHT20 giả lập: mỗi sensor một chuỗi 1 phút/lần, giá trị làm tròn 0.1 nên có nhiều run"""
+    rng = np.random.RandomState(seed)
+    per_sensor = n_rows // n_sensors
+    sensor_id = np.repeat(np.arange(n_sensors, dtype=np.int32), per_sensor)
+    step = np.tile(np.arange(per_sensor, dtype=np.int64), n_sensors)
+    timestamp = np.datetime64('2024-01-01T00:00') + step.astype('timedelta64[m]')
+    value = np.round(25 + np.cumsum(rng.choice([-0.1, 0.0, 0.0, 0.0, 0.1], len(step))), 1)
+    df = pd.DataFrame({'sensor_id': sensor_id, 'timestamp': timestamp, 'value': value})
+    # Xáo trộn để collapse_runs phải sắp xếp như dữ liệu thật
+    return df.sample(frac=1.0, random_state=seed).reset_index(drop=True)
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark collapse_runs')
+    parser.add_argument('--rows', type=int, default=10_000_000, help='Tổng số bản ghi')
+    parser.add_argument('--sensors', type=int, default=2000, help='Số sensor')
+    parser.add_argument('--min-run', type=int, default=3, help='Độ dài run tối thiểu')
+    parser.add_argument('--chunksize', type=int, default=1_000_000, help='Số hàng mỗi chunk (bản theo luồng)')
+    parser.add_argument('--skip-legacy', action='store_true', help='Bỏ qua bản cũ (chậm)')
+    args = parser.parse_args()
+
+    print(f"Tạo {args.rows} bản ghi cho {args.sensors} sensor...")
+    df = make_readings(args.rows, args.sensors)
+
+    vec_time, vec_result = timed(collapse_runs, df, min_run=args.min_run)
+    print(f"vector hoá      {vec_time:>8.2f} s   giữ {len(vec_result)} / {len(df)} bản ghi")
+
+    # Dữ liệu đã sắp xếp sẵn (ví dụ ORDER BY sensor_id, recorded_time): bỏ qua bước sắp xếp
+    ordered = df.sort_values(['sensor_id', 'timestamp'], kind='stable')
+    sorted_time, _ = timed(collapse_runs, ordered, min_run=args.min_run)
+    print(f"đã sắp xếp sẵn  {sorted_time:>8.2f} s")
+
+    # Bản theo luồng trên dữ liệu đã sắp xếp (như đọc chunk từ file đã sắp xếp)
+    chunks = (ordered.iloc[i:i + args.chunksize] for i in range(0, len(ordered), args.chunksize))
+    stream_time, parts = timed(lambda: list(collapse_runs_stream(chunks, min_run=args.min_run)))
+    n_stream = sum(len(part) for part in parts)
+    print(f"theo luồng      {stream_time:>8.2f} s   giữ {n_stream} bản ghi (chunk {args.chunksize})")
+    if n_stream != len(vec_result):
+        print("CẢNH BÁO: bản theo luồng cho kết quả khác bản vector hoá")
+
+    if not args.skip_legacy:
+        legacy_time, legacy_result = timed(legacy_collapse_runs, df, min_run=args.min_run)
+        same = legacy_result.equals(vec_result)
+        print(f"vòng lặp cũ     {legacy_time:>8.2f} s   giữ {len(legacy_result)} bản ghi "
+              f"({'kết quả giống nhau' if same else 'KẾT QUẢ KHÁC'})")
+        print(f"Nhanh hơn {legacy_time / vec_time:.1f} lần")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
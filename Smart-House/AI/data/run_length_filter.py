@@ -4,11 +4,67 @@
 Run‑length deduplication:
 giữ 1 bản ghi đầu tiên cho mỗi chuỗi >= min_run giá trị liên tiếp giống nhau
 (áp dụng độc lập trên từng sensor_id).
+
+collapse_runs         một lượt vector hoá trên toàn bộ mảng đã sắp xếp theo
+                      (sensor_id, timestamp); ranh giới sensor tự ngắt run
+collapse_runs_stream  xử lý từng chunk (đã sắp xếp), mang trạng thái run đang
+                      dở sang chunk sau
 """
 
+from typing import Iterable, Iterator, Optional
+
 import pandas as pd
 import numpy as np
 
+def sort_key(values: pd.Series) -> np.ndarray:
+    """
+    Khoá sắp xếp cho np.lexsort: mảng số/datetime dùng trực tiếp (NaN/NaT xếp
+    cuối), kiểu khác đổi sang mã số nguyên giữ đúng thứ tự như sort_values.
+    """
+    array = values.to_numpy()
+    if array.dtype.kind in 'iufmMb':
+        return array
+    codes, uniques = pd.factorize(values, sort=True)
+    return np.where(codes < 0, len(uniques), codes)
+
+def sort_order(ids: pd.Series, timestamps: pd.Series) -> np.ndarray:
+    """
+    Thứ tự sắp xếp ổn định theo (id, timestamp).
+
+    Khi timestamp là số nguyên/datetime không có NaT, gộp thành một khoá int64
+    (mã id * khoảng thời gian + thời gian) và argsort một lần - nhanh hơn
+    np.lexsort nhiều lần; bỏ qua sắp xếp nếu dữ liệu đã đúng thứ tự.
+    """
+    ts = timestamps.to_numpy()
+    if ts.dtype.kind in 'mM' and not np.isnat(ts).any():
+        ts = ts.view(np.int64)
+    if ts.dtype.kind in 'iu' and len(ts):
+        id_codes, uniques = pd.factorize(ids, sort=True)
+        id_codes = np.where(id_codes < 0, len(uniques), id_codes).astype(np.int64)
+        ts_min = int(ts.min())
+        span = int(ts.max()) - ts_min + 1
+        if (len(uniques) + 1) * span < 2 ** 62:
+            key = id_codes * span + (ts.astype(np.int64) - ts_min)
+            if (key[1:] >= key[:-1]).all():
+                return np.arange(len(key))
+            return np.argsort(key, kind='stable')
+    return np.lexsort((sort_key(timestamps), sort_key(ids)))
+
+def run_starts(
+    ids: np.ndarray,
+    values: np.ndarray,
+    tol: float,
+) -> np.ndarray:
+    """
+    Cờ bắt đầu run cho từng hàng (mảng đã sắp xếp): đổi sensor hoặc
+    |giá trị - giá trị trước| > tol (NaN luôn bắt đầu run mới).
+    """
+    changed = np.ones(len(values), dtype=bool)
+    if len(values) > 1:
+        same_value = np.abs(np.diff(values)) <= tol
+        changed[1:] = (ids[1:] != ids[:-1]) | ~same_value
+    return changed
+
 def collapse_runs(
     df: pd.DataFrame,
     min_run: int = 3,
@@ -20,24 +76,138 @@ def collapse_runs(
     if df.empty:
         return df
 
-    # Sắp xếp trong từng id theo timestamp
-    df = df.sort_values([id_col, ts_col]).reset_index(drop=True)
+    # Sắp xếp trong từng id theo timestamp (sắp xếp ổn định)
+    order = sort_order(df[id_col], df[ts_col])
+    ids = df[id_col].to_numpy()[order]
+    values = df[value_col].to_numpy(dtype=np.float64)[order]
+
+    # phát hiện điểm Giá trị đổi (với tol) hoặc đổi sensor
+    changed = run_starts(ids, values, tol)
+
+    # chiều dài run của từng hàng
+    starts = np.flatnonzero(changed)
+    run_len = np.diff(np.append(starts, len(values)))
+    row_run_len = np.repeat(run_len, run_len)
+
+    # Giữ lại:
+    #  ‑ mọi bản ghi nếu run_len < min_run
+    #  ‑ chỉ bản ghi đầu (changed==True) nếu run_len >= min_run
+    keep = np.flatnonzero((row_run_len < min_run) | changed)
+
+    result = df.take(order[keep])
+    # Index giống bản cũ: vị trí trong frame đã sắp xếp
+    result.index = pd.RangeIndex(len(df))[keep]
+    return result
+
+class RunState:
+    """Run đang dở ở cuối chunk: sensor, giá trị cuối, độ dài và các hàng chưa quyết định"""
 
-    keep = pd.Series(False, index=df.index)
+    def __init__(self, sensor_id, value: float, length: int, pending: pd.DataFrame):
+        self.sensor_id = sensor_id
+        self.value = value
+        self.length = length
+        # Các hàng của run chưa xuất (chỉ khi length < min_run); rỗng khi hàng đầu đã xuất
+        self.pending = pending
 
-    for _, group in df.groupby(id_col):
-        idx = group.index
-        # phát hiện điểm Giá trị đổi (với tol)
-        changed = (group[value_col].diff().abs() > tol).fillna(True)
-        run_id = changed.cumsum()
+def collapse_chunk(
+    chunk: pd.DataFrame,
+    state: Optional[RunState],
+    min_run: int,
+    id_col: str,
+    value_col: str,
+    tol: float,
+    final: bool = False,
+):
+    """
+    Xử lý một chunk đã sắp xếp theo (id, timestamp) nối tiếp state.
 
-        # tính chiều dài từng run
-        run_len = group.groupby(run_id)[value_col].transform("size")
+    Returns:
+        (các hàng được giữ, state mới) - run cuối chunk chỉ được quyết định
+        khi final=True hoặc ở chunk sau
+    """
+    n = len(chunk)
+    if n == 0:
+        if final and state is not None:
+            return state.pending, None
+        return chunk, state
 
-        # Giữ lại:
-        #  ‑ mọi bản ghi nếu run_len < min_run
-        #  ‑ chỉ bản ghi đầu (changed==True) nếu run_len >= min_run
-        keep_group = (run_len < min_run) | changed
-        keep.loc[idx] = keep_group
+    ids = chunk[id_col].to_numpy()
+    values = chunk[value_col].to_numpy(dtype=np.float64)
+    changed = run_starts(ids, values, tol)
+    continuation = (
+        state is not None
+        and ids[0] == state.sensor_id
+        and abs(values[0] - state.value) <= tol
+    )
+    changed[0] = not continuation
+
+    starts = np.flatnonzero(changed)
+    if continuation:
+        starts = np.insert(starts, 0, 0)
+    run_len = np.diff(np.append(starts, n))
+    total_len = run_len.copy()
+    if continuation:
+        total_len[0] += state.length
+    row_total = np.repeat(total_len, run_len)
+
+    keep = (row_total < min_run) | changed
+    last_start = starts[-1]
+    if not final:
+        # Run cuối có thể còn tiếp ở chunk sau: chưa quyết định
+        keep[last_start:] = False
+
+    parts = []
+    # Hàng chờ từ chunk trước thuộc run đầu tiên (nếu là run nối tiếp)
+    if state is not None:
+        if not continuation:
+            parts.append(state.pending)
+        elif final or len(starts) > 1:
+            if total_len[0] < min_run:
+                parts.append(state.pending)
+            else:
+                parts.append(state.pending.iloc[:1])
+    parts.append(chunk.iloc[np.flatnonzero(keep)])
+
+    new_state = None
+    if not final:
+        open_len = int(total_len[-1])
+        open_rows = chunk.iloc[last_start:]
+        carried = continuation and len(starts) == 1
+        if carried:
+            # Cả chunk nối tiếp run cũ: gộp hàng chờ cũ và mới
+            pending = pd.concat([state.pending, open_rows]) if open_len < min_run else state.pending.iloc[:0]
+            if open_len >= min_run and len(state.pending):
+                parts.append(state.pending.iloc[:1])
+        elif open_len < min_run:
+            pending = open_rows
+        else:
+            # Run đã đủ dài: xuất hàng đầu ngay, không cần giữ hàng nào
+            parts.append(open_rows.iloc[:1])
+            pending = open_rows.iloc[:0]
+        new_state = RunState(ids[-1], values[-1], open_len, pending)
+
+    parts = [part for part in parts if len(part)]
+    result = pd.concat(parts) if len(parts) > 1 else (parts[0] if parts else chunk.iloc[:0])
+    return result, new_state
+
+def collapse_runs_stream(
+    chunks: Iterable[pd.DataFrame],
+    min_run: int = 3,
+    id_col: str = "sensor_id",
+    value_col: str = "value",
+    tol: float = 1e-9,
+) -> Iterator[pd.DataFrame]:
+    """
+    Phiên bản theo luồng của collapse_runs cho dữ liệu lớn hơn bộ nhớ.
 
-    return df.loc[keep].copy()
\ No newline at end of file
+    Các chunk phải nối tiếp nhau theo thứ tự (id, timestamp) toàn cục, ví dụ
+    pd.read_csv(..., chunksize=...) trên file đã sắp xếp. Trạng thái run đang dở
+    (tối đa min_run - 1 hàng chờ) được mang sang chunk sau; index gốc được giữ.
+    """
+    state = None
+    for chunk in chunks:
+        result, state = collapse_chunk(chunk, state, min_run, id_col, value_col, tol)
+        if len(result):
+            yield result
+    if state is not None and len(state.pending):
+        yield state.pending
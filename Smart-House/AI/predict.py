@@ -3,237 +3,1165 @@
 YoloHome AI - Temperature Prediction Script
 Sử dụng mô hình đã được huấn luyện từ dữ liệu data_from_export2.csv
 để dự đoán nhiệt độ cho giờ tiếp theo
+
+Chế độ chạy:
+    python predict.py                    # chạy một lần, in JSON ra stdout
+    python predict.py --serve            # tiến trình thường trú, JSON-lines qua stdin/stdout
+    python predict.py --socket /tmp/p.sock  # tiến trình thường trú qua Unix socket
+    python predict.py --all-sensors      # dự đoán cho mọi cảm biến nhiệt độ trong một lần
 """
 
 import os
 import sys
 import json
-import pandas as pd
+import argparse
+import socketserver
+import zipfile
+import threading
+import time
+import hashlib
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
 import numpy as np
+try:
+    import resource
+except ImportError:  # Windows không có module resource
+    resource = None
 from datetime import datetime, timedelta
-import joblib
 import psycopg2
-from psycopg2 import sql
-from sklearn.ensemble import RandomForestRegressor
+import psycopg2.extensions
+# pandas, joblib và scikit-learn chỉ được import khi thật sự cần (tải .pkl
+# hoặc huấn luyện lại) để giảm thời gian khởi động khi dùng mô hình .npz
 
-def get_latest_sensor_data():
-    """Lấy dữ liệu cảm biến mới nhất từ PostgreSQL"""
-    try:
-        # Thông số kết nối database - cập nhật theo thông tin thực tế của bạn
-        db_params = {
-            'user': 'postgres',
-            'password': 'tuan',
-            'host': 'localhost',
-            'port': '5432',
-            'database': 'yolohome1'
-        }
-        
-        conn = psycopg2.connect(**db_params)
+# Các mốc dự đoán (phút tiếp theo) và thứ tự cột đặc trưng của mô hình
+TIME_POINTS = [15, 30, 45, 60]
+FEATURE_NAMES = ['hour', 'day_of_week', 'time_morning', 'time_afternoon', 'time_evening', 'time_night']
+
+# Đặc trưng của mô hình dự báo trực tiếp nhiều mốc (training/train.py --multi-horizon),
+# phải trùng với MULTI_HORIZON_FEATURES trong training/data_processor.py
+MULTI_HORIZON_FEATURES = [
+    'temperature', 'temp_lag_1', 'temp_lag_2', 'temp_lag_3',
+    'temp_diff_1', 'temp_diff_2'
+] + FEATURE_NAMES
+
+# Số lần đọc gần nhất cần lấy cho mỗi cảm biến (hiện tại + 3 giá trị trễ)
+HISTORY_ROWS = 4
+
+# Đường dẫn đến thư mục dữ liệu
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+MODEL_DIR = os.path.join(DATA_DIR, 'models')
+SAMPLE_CSV_PATH = os.path.join(DATA_DIR, 'raw', 'temperature_data_from_export2.csv')
+
+# Thông số kết nối database - đọc từ biến môi trường giống backend (config/.env)
+DB_PARAMS = {
+    'user': os.environ.get('DB_USER', 'postgres'),
+    'password': os.environ.get('DB_PASSWORD', 'tuan'),
+    'host': os.environ.get('DB_HOST', 'localhost'),
+    'port': os.environ.get('DB_PORT', '5432'),
+    'database': os.environ.get('DB_NAME', 'yolohome1')
+}
+
+# Truy vấn lấy các lần đọc mới nhất của một cảm biến ($1 = sensor_id, $2 = số dòng);
+# chạy bằng index (sensor_id, recorded_time DESC) thì không cần sắp xếp cả bảng
+LATEST_READINGS_SQL = """
+SELECT recorded_time, svalue
+FROM sensor_data
+WHERE sensor_id = $1
+ORDER BY recorded_time DESC
+LIMIT $2
+"""
+
+# Các lần đọc mới nhất của mọi cảm biến nhiệt độ trong một truy vấn ($1 = số dòng
+# mỗi cảm biến). LATERAL + LIMIT dùng index theo từng cảm biến thay vì đánh số
+# lại toàn bộ bảng như ROW_NUMBER() OVER (PARTITION BY sensor_id ...)
+LATEST_READINGS_ALL_SQL = """
+SELECT s.sensor_id, r.recorded_time, r.svalue
+FROM sensor s
+CROSS JOIN LATERAL (
+    SELECT sd.recorded_time, sd.svalue
+    FROM sensor_data sd
+    WHERE sd.sensor_id = s.sensor_id
+    ORDER BY sd.recorded_time DESC
+    LIMIT $1
+) r
+WHERE s.sensor_type = 'temperature'
+ORDER BY s.sensor_id, r.recorded_time DESC
+"""
+
+SENSOR_TIME_INDEX = 'idx_sensor_data_sensor_time'
+SENSOR_TIME_INDEX_SQL = (
+    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {SENSOR_TIME_INDEX} "
+    "ON sensor_data (sensor_id, recorded_time DESC)"
+)
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """Kết nối psycopg2 ghi nhớ các prepared statement đã tạo trên phiên này"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+class SensorDataSource:
+    """
+    Truy cập dữ liệu cảm biến qua pool kết nối dùng lại giữa các lần dự đoán.
+
+    Truy vấn lần đọc mới nhất được PREPARE phía server một lần cho mỗi kết nối,
+    sau đó chỉ cần EXECUTE với sensor_id.
+    """
+
+    def __init__(self, db_params=None, minconn=1, maxconn=4):
+        self.db_params = dict(db_params or DB_PARAMS)
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._pool = None
+        self._lock = threading.Lock()
+        self._default_sensor_id = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    from psycopg2.pool import ThreadedConnectionPool
+                    self._pool = ThreadedConnectionPool(
+                        self.minconn, self.maxconn,
+                        connection_factory=PreparedConnection,
+                        **self.db_params
+                    )
+        return self._pool
+
+    @contextmanager
+    def connection(self):
+        """Mượn một kết nối từ pool; kết nối hỏng sẽ bị đóng thay vì trả lại pool"""
+        pool = self._get_pool()
+        conn = pool.getconn()
+        broken = False
+        try:
+            # Chỉ đọc dữ liệu nên không cần giữ transaction mở giữa các lần dùng
+            if not conn.autocommit:
+                conn.autocommit = True
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            pool.putconn(conn, close=broken or conn.closed != 0)
+
+    def _execute_prepared(self, conn, name, statement, params):
         cursor = conn.cursor()
-        
-        # Truy vấn lấy dữ liệu nhiệt độ mới nhất
-        query = """
-        SELECT sd.recorded_time, sd.svalue
-        FROM sensor_data sd
-        JOIN sensor s ON sd.sensor_id = s.sensor_id
-        WHERE s.sensor_type = 'temperature'
-        ORDER BY sd.recorded_time DESC
-        LIMIT 3
+        try:
+            if name not in conn.prepared:
+                cursor.execute(f"PREPARE {name} AS {statement}")
+                conn.prepared.add(name)
+            placeholders = ', '.join(['%s'] * len(params))
+            cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def get_default_sensor_id(self):
+        """sensor_id của cảm biến nhiệt độ đầu tiên (được nhớ lại sau lần tra cứu đầu)"""
+        if self._default_sensor_id is None:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT sensor_id FROM sensor WHERE sensor_type = 'temperature' "
+                    "ORDER BY sensor_id LIMIT 1"
+                )
+                row = cursor.fetchone()
+                cursor.close()
+            if row is None:
+                raise ValueError("Không tìm thấy cảm biến nhiệt độ")
+            self._default_sensor_id = row[0]
+        return self._default_sensor_id
+
+    def fetch_latest_readings(self, sensor_id=None, limit=3):
+        """
+        Lấy các lần đọc mới nhất của một cảm biến.
+
+        Returns:
+            Danh sách (recorded_time, svalue), mới nhất trước
+        """
+        if sensor_id is None:
+            sensor_id = self.get_default_sensor_id()
+        with self.connection() as conn:
+            return self._execute_prepared(conn, 'latest_readings', LATEST_READINGS_SQL, (sensor_id, limit))
+
+    def fetch_latest_readings_all(self, limit=3):
+        """
+        Lấy các lần đọc mới nhất của mọi cảm biến nhiệt độ bằng một truy vấn.
+
+        Returns:
+            Dictionary sensor_id -> danh sách (recorded_time, svalue), mới nhất trước
+        """
+        with self.connection() as conn:
+            rows = self._execute_prepared(conn, 'latest_readings_all', LATEST_READINGS_ALL_SQL, (limit,))
+
+        readings = {}
+        for sensor_id, recorded_time, svalue in rows:
+            readings.setdefault(sensor_id, []).append((recorded_time, svalue))
+        return readings
+
+    def ensure_index(self, create=False):
+        """
+        Kiểm tra index (sensor_id, recorded_time DESC) trên sensor_data.
+
+        Args:
+            create: Tạo index (CONCURRENTLY) nếu chưa có; mặc định chỉ in khuyến nghị
+
+        Returns:
+            True nếu index đã tồn tại (hoặc vừa được tạo)
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT indexdef FROM pg_indexes WHERE tablename = 'sensor_data'")
+            definitions = [row[0] for row in cursor.fetchall()]
+            if any('(sensor_id, recorded_time DESC)' in definition for definition in definitions):
+                cursor.close()
+                return True
+
+            if not create:
+                cursor.close()
+                print(f"Khuyến nghị tạo index cho truy vấn dự đoán: {SENSOR_TIME_INDEX_SQL}", file=sys.stderr)
+                return False
+
+            print(f"Đang tạo index {SENSOR_TIME_INDEX}...", file=sys.stderr)
+            cursor.execute(SENSOR_TIME_INDEX_SQL)
+            cursor.close()
+            return True
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.closeall()
+            self._pool = None
+
+# Nguồn dữ liệu dùng chung trong một tiến trình (pool được tạo khi cần)
+_sensor_data_source = None
+
+def get_sensor_data_source():
+    global _sensor_data_source
+    if _sensor_data_source is None:
+        _sensor_data_source = SensorDataSource()
+    return _sensor_data_source
+
+def get_latest_sensor_data(sensor_id=None, source=None):
+    """
+    Lấy dữ liệu cảm biến mới nhất từ PostgreSQL.
+
+    Args:
+        sensor_id: Cảm biến cần lấy; mặc định là cảm biến nhiệt độ đầu tiên
+        source: SensorDataSource; mặc định dùng pool chung của tiến trình
+
+    Ném ngoại lệ khi lỗi kết nối hoặc không có dữ liệu; người gọi
+    chịu trách nhiệm chuyển lỗi thành JSON trả về.
+    """
+    source = source or get_sensor_data_source()
+    return sensor_snapshot(source.fetch_latest_readings(sensor_id, limit=HISTORY_ROWS))
+
+def sensor_snapshot(rows):
+    """
+    Chuyển các dòng (recorded_time, svalue) mới nhất của một cảm biến
+    thành dictionary đặc trưng hiện tại.
+    """
+    # Xử lý dữ liệu
+    if not rows or len(rows) < 1:
+        raise ValueError("Không đủ dữ liệu lịch sử")
+
+    # Lấy giá trị nhiệt độ mới nhất
+    current_temperature = float(rows[0][1])
+    current_time = rows[0][0]
+
+    # Tạo thời gian hiện tại
+    if isinstance(current_time, str):
+        current_time = datetime.fromisoformat(current_time.replace('Z', '+00:00'))
+
+    # Thời gian trong ngày
+    hour = current_time.hour
+
+    # Tạo thời gian trong ngày
+    if 5 <= hour < 12:
+        time_of_day = [1, 0, 0, 0]  # sáng
+    elif 12 <= hour < 17:
+        time_of_day = [0, 1, 0, 0]  # trưa
+    elif 17 <= hour < 21:
+        time_of_day = [0, 0, 1, 0]  # chiều
+    else:
+        time_of_day = [0, 0, 0, 1]  # tối
+
+    return {
+        'current_time': current_time,
+        'current_temperature': current_temperature,
+        'rows_fetched': len(rows),
+        # Nhiệt độ các lần đọc gần nhất, mới nhất trước (cho đặc trưng trễ)
+        'recent_temperatures': [float(row[1]) for row in rows],
+        'hour': hour,
+        'day_of_week': current_time.weekday(),
+        'time_morning': time_of_day[0],
+        'time_afternoon': time_of_day[1],
+        'time_evening': time_of_day[2],
+        'time_night': time_of_day[3]
+    }
+
+class CompiledForest:
+    """
+    Rừng cây ở dạng bảng nút (xuất bởi model_trainer.export_forest_arrays).
+
+    Duyệt mọi cây cho cả lô dữ liệu cùng lúc chỉ với NumPy, không cần
+    scikit-learn. Các mảng có thể là np.memmap để nhiều tiến trình dùng chung.
+    """
+
+    def __init__(self, arrays):
+        self.roots = np.asarray(arrays['roots'])
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.value = arrays['value']
+        self.max_depth = int(arrays['max_depth'])
+        self.feature_names = [str(name) for name in arrays['feature_names']]
+        horizons = arrays['horizons'] if 'horizons' in arrays else []
+        self.horizons = [int(h) for h in horizons] or None
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def predict_trees(self, X):
         """
-        
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        
-        # Xử lý dữ liệu
-        if not rows or len(rows) < 1:
-            print(json.dumps({
-                "error": "Không đủ dữ liệu lịch sử",
-                "temperature": 0,
-                "confidence": 0
-            }))
+        Dự đoán của từng cây.
+
+        Args:
+            X: Mảng (n_rows, n_features)
+
+        Returns:
+            Mảng (n_trees, n_rows) nếu mô hình một đầu ra,
+            ngược lại (n_trees, n_rows, n_outputs)
+        """
+        # Ép về float32 giống scikit-learn trước khi so sánh với ngưỡng
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(X.shape[0])[np.newaxis, :]
+        nodes = np.repeat(self.roots[:, np.newaxis], X.shape[0], axis=1)
+
+        for _ in range(self.max_depth):
+            left = self.left[nodes]
+            is_leaf = left < 0
+            if is_leaf.all():
+                break
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(is_leaf, nodes, np.where(go_left, left, self.right[nodes]))
+
+        values = self.value[nodes]
+        return values[..., 0] if values.shape[-1] == 1 else values
+
+    def predict(self, X):
+        """Dự đoán trung bình của rừng (tương đương RandomForestRegressor.predict)"""
+        return self.predict_trees(X).mean(axis=0)
+
+def load_npz_mmap(path):
+    """
+    Mở file .npz không nén và memory-map từng mảng thay vì đọc vào RAM.
+
+    np.load bỏ qua mmap_mode với .npz, nên ở đây tự tìm vị trí dữ liệu của
+    từng thành phần .npy trong file zip rồi tạo np.memmap tương ứng.
+    Thành phần bị nén (hoặc mảng kiểu object) sẽ được đọc bình thường.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+
+            # Local file header: 30 byte cố định + tên file + trường extra
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = np.frombuffer(f.read(4), dtype='<u2')
+            f.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject:
+                raise ValueError(f"Không thể memory-map mảng object: {name}")
+            if shape == ():
+                arrays[name] = np.frombuffer(f.read(dtype.itemsize), dtype=dtype)[0]
+                continue
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                     order='F' if fortran_order else 'C')
+    return arrays
+
+def load_compiled_forest(path, check_features=True):
+    """Tải mô hình dạng bảng nút từ file .npz (memory-mapped)"""
+    forest = CompiledForest(load_npz_mmap(path))
+    expected = MULTI_HORIZON_FEATURES if forest.horizons else FEATURE_NAMES
+    if check_features and forest.feature_names and not set(forest.feature_names) <= set(expected):
+        raise ValueError(f"Đặc trưng của mô hình {forest.feature_names} không khớp với {expected}")
+    return forest
+
+def find_model_file(model_dir=MODEL_DIR):
+    """
+    Tìm file mô hình cần tải trong model_dir.
+
+    Ưu tiên temp_model.npz (bảng nút, không cần scikit-learn) nếu file này
+    không cũ hơn temp_model.pkl. Trả về None nếu chưa có mô hình nào.
+    """
+    model_path = os.path.join(model_dir, 'temp_model.pkl')
+    arrays_path = os.path.join(model_dir, 'temp_model.npz')
+
+    if os.path.exists(arrays_path) and (
+            not os.path.exists(model_path)
+            or os.path.getmtime(arrays_path) >= os.path.getmtime(model_path)):
+        return arrays_path
+    if os.path.exists(model_path):
+        return model_path
+    return None
+
+def load_model_file(path, check_features=True):
+    """
+    Tải mô hình từ file .npz (bảng nút) hoặc .pkl (scikit-learn).
+
+    check_features=False bỏ qua kiểm tra đặc trưng của bảng nút với các đặc
+    trưng mà predict.py tạo được (training/train.py dùng khi kiểm tra mô hình).
+    """
+    # Thông báo tiến trình ghi ra stderr để stdout chỉ chứa JSON kết quả
+    if path.endswith('.npz'):
+        print("Đang tải mô hình dạng bảng nút...", file=sys.stderr)
+        return load_compiled_forest(path, check_features)
+
+    import joblib
+    print("Đang tải mô hình đã huấn luyện...", file=sys.stderr)
+    model = joblib.load(path)
+    if not is_averaging_forest(model):
+        # Không có bảng nút .npz (ví dụ gradient boosting): phục vụ qua model.predict
+        print(f"Mô hình {type(model).__name__} không có dạng bảng nút, dùng model.predict", file=sys.stderr)
+    return model
+
+def train_model_from_csv(model_dir=MODEL_DIR, csv_path=SAMPLE_CSV_PATH):
+    """
+    Huấn luyện mô hình Random Forest mới từ tệp CSV mẫu và lưu vào model_dir.
+
+    File .pkl được ghi ra file tạm rồi os.replace để tiến trình khác
+    không bao giờ đọc phải file ghi dở.
+    """
+    import joblib
+    import pandas as pd
+    from sklearn.ensemble import RandomForestRegressor
+
+    print("Tạo mô hình mới từ tệp CSV mẫu...", file=sys.stderr)
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(f"Không tìm thấy tệp dữ liệu: {csv_path}")
+
+    # Đọc dữ liệu
+    df = pd.read_csv(csv_path)
+
+    # Xử lý dữ liệu
+    if 'recorded_time' in df.columns:
+        df['recorded_time'] = pd.to_datetime(df['recorded_time'])
+        df['hour'] = df['recorded_time'].dt.hour
+        df['day_of_week'] = df['recorded_time'].dt.dayofweek
+
+        # Tạo các đặc trưng thời gian trong ngày
+        df['time_morning'] = ((df['hour'] >= 5) & (df['hour'] < 12)).astype(int)
+        df['time_afternoon'] = ((df['hour'] >= 12) & (df['hour'] < 17)).astype(int)
+        df['time_evening'] = ((df['hour'] >= 17) & (df['hour'] < 21)).astype(int)
+        df['time_night'] = ((df['hour'] >= 21) | (df['hour'] < 5)).astype(int)
+
+    # Tạo đặc trưng
+    X = df[FEATURE_NAMES]
+    y = df['temperature']
+
+    # Tạo mô hình Random Forest
+    model = RandomForestRegressor(n_estimators=100, max_depth=10, random_state=42)
+    model.fit(X, y)
+
+    # Tạo thư mục models nếu chưa tồn tại
+    os.makedirs(model_dir, exist_ok=True)
+
+    # Lưu mô hình
+    model_path = os.path.join(model_dir, 'temp_model.pkl')
+    tmp_path = f"{model_path}.{os.getpid()}.tmp"
+    joblib.dump(model, tmp_path)
+    os.replace(tmp_path, model_path)
+
+    return model
+
+def load_or_create_model():
+    """Tải mô hình đã huấn luyện hoặc tạo mô hình mới từ tệp CSV mẫu (đồng bộ)"""
+    try:
+        model_path = find_model_file()
+        if model_path:
+            return load_model_file(model_path)
+        return train_model_from_csv()
+
+    except Exception as e:
+        print(f"Lỗi khi tạo/tải mô hình: {str(e)}", file=sys.stderr)
+        raise
+
+class HourlyMeanModel:
+    """
+    Mô hình dự phòng rất nhẹ: nhiệt độ trung bình theo giờ trong ngày từ CSV mẫu.
+
+    Chỉ dùng trong lúc mô hình chính đang được huấn luyện nền; độ tin cậy
+    luôn bằng 0 để backend không tự bật quạt dựa trên dự đoán này.
+    """
+
+    def __init__(self, csv_path=SAMPLE_CSV_PATH):
+        self.hourly_mean = np.zeros(24)
+        if not os.path.exists(csv_path):
+            return
+
+        import pandas as pd
+        try:
+            data = pd.read_csv(csv_path, usecols=['recorded_time', 'temperature'])
+        except ValueError as e:
+            print(f"Không đọc được dữ liệu mẫu cho mô hình dự phòng: {str(e)}", file=sys.stderr)
+            return
+        hours = pd.to_datetime(data['recorded_time'], errors='coerce').dt.hour
+        temperatures = pd.to_numeric(data['temperature'], errors='coerce')
+        valid = hours.notna() & temperatures.notna()
+        if not valid.any():
+            return
+
+        temperatures = temperatures[valid]
+        means = temperatures.groupby(hours[valid].astype(int)).mean()
+        self.hourly_mean = means.reindex(range(24), fill_value=temperatures.mean()).to_numpy(dtype=np.float64)
+
+    def predict(self, X):
+        hours = np.asarray(X)[:, FEATURE_NAMES.index('hour')].astype(int) % 24
+        return self.hourly_mean[hours]
+
+class ModelCache:
+    """
+    Bộ nhớ đệm mô hình cho tiến trình thường trú.
+
+    - Chỉ tải lại khi file mô hình thay đổi (đường dẫn, mtime, kích thước).
+    - Khi chưa có mô hình: huấn luyện ở luồng nền, trong lúc đó trả về
+      HourlyMeanModel; mô hình mới được thay vào bằng một phép gán duy nhất.
+    - Nếu tải lại thất bại (ví dụ file đang được ghi dở), giữ mô hình cũ.
+    """
+
+    def __init__(self, model_dir=MODEL_DIR, csv_path=SAMPLE_CSV_PATH):
+        self.model_dir = model_dir
+        self.csv_path = csv_path
+        self._lock = threading.Lock()
+        # (mô hình, chữ ký file) luôn được thay cùng nhau trong một phép gán
+        self._current = (None, None)
+        # Chưa có mô hình: dựng sẵn mô hình dự phòng lúc khởi động để yêu cầu
+        # đầu tiên không phải đọc CSV
+        self._fallback = HourlyMeanModel(csv_path) if find_model_file(model_dir) is None else None
+        self._training_thread = None
+        self._hash = (None, None)
+
+    def _file_signature(self):
+        path = find_model_file(self.model_dir)
+        if path is None:
             return None
-            
-        # Lấy giá trị nhiệt độ mới nhất
-        current_temperature = float(rows[0][1])
-        current_time = rows[0][0]
-        
-        # Tạo thời gian hiện tại
-        if isinstance(current_time, str):
-            current_time = datetime.fromisoformat(current_time.replace('Z', '+00:00'))
-        
-        # Thời gian trong ngày
-        hour = current_time.hour
-        
-        # Tạo thời gian trong ngày
-        if 5 <= hour < 12:
-            time_of_day = [1, 0, 0, 0]  # sáng
-        elif 12 <= hour < 17:
-            time_of_day = [0, 1, 0, 0]  # trưa
-        elif 17 <= hour < 21:
-            time_of_day = [0, 0, 1, 0]  # chiều
-        else:
-            time_of_day = [0, 0, 0, 1]  # tối
-        
-        cursor.close()
-        conn.close()
-        
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (path, stat.st_mtime_ns, stat.st_size)
+
+    def get(self):
+        """Trả về mô hình hiện hành, không bao giờ chờ huấn luyện"""
+        return self.get_with_version()[0]
+
+    def get_with_version(self):
+        """
+        Trả về (mô hình, phiên bản). Phiên bản là chuỗi dựng từ chữ ký file
+        mô hình, hoặc None khi đang dùng mô hình dự phòng.
+        """
+        signature = self._file_signature()
+        if signature is not None and signature != self._current[1]:
+            with self._lock:
+                if signature != self._current[1]:
+                    try:
+                        self._current = (load_model_file(signature[0]), signature)
+                    except Exception as e:
+                        print(f"Lỗi khi tải lại mô hình, giữ mô hình cũ: {str(e)}", file=sys.stderr)
+
+        model, signature = self._current
+        if model is not None:
+            path, mtime_ns, size = signature or (self.model_dir, 0, 0)
+            return model, f"{os.path.basename(path)}@{mtime_ns}:{size}"
+
+        self._start_background_training()
+        if self._fallback is None:
+            self._fallback = HourlyMeanModel(self.csv_path)
+        return self._fallback, None
+
+    def model_info(self):
+        """Phiên bản và mã băm SHA-256 (rút gọn) của file mô hình đang dùng"""
+        model, signature = self._current
+        if signature is None:
+            return {'model_version': None, 'model_hash': None}
+
+        path, mtime_ns, size = signature
+        if self._hash[0] != signature:
+            digest = hashlib.sha256()
+            try:
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(chunk)
+                self._hash = (signature, digest.hexdigest()[:16])
+            except OSError:
+                self._hash = (signature, None)
         return {
-            'current_time': current_time,
-            'current_temperature': current_temperature,
-            'hour': hour,
-            'day_of_week': current_time.weekday(),
-            'time_morning': time_of_day[0],
-            'time_afternoon': time_of_day[1],
-            'time_evening': time_of_day[2],
-            'time_night': time_of_day[3]
+            'model_version': f"{os.path.basename(path)}@{mtime_ns}:{size}",
+            'model_hash': self._hash[1]
         }
-        
-    except Exception as e:
-        print(json.dumps({
-            "error": str(e),
-            "temperature": 0,
-            "confidence": 0
-        }))
+
+    def _start_background_training(self):
+        with self._lock:
+            if self._training_thread is not None and self._training_thread.is_alive():
+                return
+            self._training_thread = threading.Thread(target=self._train, name='model-training', daemon=True)
+            self._training_thread.start()
+
+    def _train(self):
+        try:
+            model = train_model_from_csv(self.model_dir, self.csv_path)
+        except Exception as e:
+            print(f"Lỗi khi tạo/tải mô hình: {str(e)}", file=sys.stderr)
+            return
+        with self._lock:
+            # Thay mô hình một lần duy nhất, ghi nhận chữ ký file vừa lưu
+            self._current = (model, self._file_signature())
+
+    def wait_for_training(self, timeout=None):
+        """Chờ luồng huấn luyện nền (nếu có) kết thúc"""
+        thread = self._training_thread
+        if thread is not None:
+            thread.join(timeout)
+
+def build_horizon_features(current_time, time_points=TIME_POINTS):
+    """
+    Tạo ma trận đặc trưng cho mọi mốc thời gian tương lai trong một lần.
+
+    Args:
+        current_time: Thời điểm của lần đọc cảm biến mới nhất
+        time_points: Danh sách số phút tiếp theo cần dự đoán
+
+    Returns:
+        (future_times, X) với X là mảng float32 kích thước (len(time_points), len(FEATURE_NAMES))
+    """
+    future_times = [current_time + timedelta(minutes=minutes_ahead) for minutes_ahead in time_points]
+    hours = np.array([t.hour for t in future_times])
+
+    X = np.empty((len(future_times), len(FEATURE_NAMES)), dtype=np.float32)
+    X[:, 0] = hours
+    X[:, 1] = [t.weekday() for t in future_times]
+    # Thời gian trong ngày: sáng / trưa / chiều / tối
+    X[:, 2] = (hours >= 5) & (hours < 12)
+    X[:, 3] = (hours >= 12) & (hours < 17)
+    X[:, 4] = (hours >= 17) & (hours < 21)
+    X[:, 5] = (hours >= 21) | (hours < 5)
+    return future_times, X
+
+def peak_rss_mb():
+    """RSS cực đại của tiến trình (MB), None nếu hệ điều hành không hỗ trợ"""
+    if resource is None:
         return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về byte
+    return round(usage / (1024 * 1024) if sys.platform == 'darwin' else usage / 1024, 2)
 
-def load_or_create_model():
-    """Tải mô hình đã huấn luyện hoặc tạo mô hình mới từ tệp CSV mẫu"""
+class PredictionMetrics:
+    """Thời gian (ms) từng giai đoạn và thông tin tài nguyên của một lần dự đoán"""
+
+    def __init__(self):
+        self.timings = {}
+        self.info = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def as_dict(self):
+        data = {'timings': {name: round(ms, 3) for name, ms in self.timings.items()}}
+        data.update(self.info)
+        data['peak_rss_mb'] = peak_rss_mb()
+        return data
+
+def measure(metrics, name):
+    """Đo giai đoạn name nếu đang thu thập metrics, ngược lại không làm gì"""
+    return metrics.stage(name) if metrics is not None else nullcontext()
+
+class MetricsSink:
+    """
+    Nơi xuất metrics: gắn vào JSON kết quả (khóa "metrics") và/hoặc
+    ghi thêm một dòng JSON vào file riêng.
+    """
+
+    def __init__(self, inline=False, path=None):
+        self.inline = inline
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, result, metrics, inline=False):
+        data = metrics.as_dict()
+        if inline or self.inline:
+            result['metrics'] = data
+        if self.path:
+            record = dict(data, timestamp=datetime.now().isoformat(),
+                          cached=bool(result.get('cached')), error=result.get('error'))
+            with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + '\n')
+
+# Cấu hình xuất metrics của tiến trình (đặt qua --metrics / --metrics-file)
+metrics_sink = MetricsSink()
+
+class PredictionMemo:
+    """
+    Bộ nhớ đệm kết quả dự đoán có TTL và giới hạn kích thước (loại bỏ LRU).
+
+    Khóa là (sensor_id, thời điểm đọc mới nhất, phiên bản mô hình): nếu cảm
+    biến chưa có dữ liệu mới và mô hình không đổi thì dự đoán cũng không đổi.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, result = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return dict(result)
+
+    def put(self, key, result):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), dict(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Bộ nhớ đệm kết quả dùng chung trong một tiến trình thường trú
+prediction_memo = PredictionMemo()
+
+def memo_key(sensor_id, sensor_data, model_version):
+    return (sensor_id, sensor_data['current_time'].isoformat(), model_version)
+
+def model_horizons(model):
+    """Các mốc (phút) của mô hình dự báo trực tiếp nhiều mốc, None với mô hình một đầu ra"""
+    if isinstance(model, CompiledForest):
+        return model.horizons
+    return getattr(model, 'forecast_horizons_', None)
+
+def model_feature_names(model):
+    """Thứ tự cột đặc trưng mà mô hình mong đợi"""
+    if isinstance(model, CompiledForest) and model.feature_names:
+        return model.feature_names
+    names = getattr(model, 'feature_names_in_', None)
+    if names is not None:
+        return [str(name) for name in names]
+    return MULTI_HORIZON_FEATURES if model_horizons(model) else FEATURE_NAMES
+
+def build_lag_features(snapshot, feature_names):
+    """
+    Một hàng đặc trưng (chưa scale) cho mô hình nhiều mốc từ các lần đọc gần nhất,
+    tính giống SensorDataProcessor.preprocess_data.
+    """
+    temps = snapshot['recent_temperatures']
+    if len(temps) < HISTORY_ROWS:
+        raise ValueError("Không đủ dữ liệu lịch sử")
+
+    features = {name: snapshot[name] for name in FEATURE_NAMES}
+    features['temperature'] = temps[0]
+    for lag in [1, 2, 3]:
+        features[f'temp_lag_{lag}'] = temps[lag]
+    features['temp_diff_1'] = temps[0] - temps[1]
+    features['temp_diff_2'] = (temps[0] - temps[1]) - (temps[1] - temps[2])
+
+    return np.array([[features[name] for name in feature_names]], dtype=np.float32)
+
+def build_forecast_features(model, snapshot):
+    """
+    Tạo ma trận đặc trưng cho một cảm biến tùy theo loại mô hình.
+
+    - Mô hình một đầu ra: một hàng đặc trưng thời gian cho mỗi mốc TIME_POINTS.
+    - Mô hình nhiều mốc: một hàng duy nhất, mô hình trả về cả vector dự báo.
+
+    Returns:
+        (time_points, future_times, X)
+    """
+    horizons = model_horizons(model)
+    if not horizons:
+        future_times, X = build_horizon_features(snapshot['current_time'], TIME_POINTS)
+        return TIME_POINTS, future_times, X
+
+    future_times = [snapshot['current_time'] + timedelta(minutes=h) for h in horizons]
+    return horizons, future_times, build_lag_features(snapshot, model_feature_names(model))
+
+def is_averaging_forest(model):
+    """Mô hình scikit-learn có dự đoán là trung bình các cây trong estimators_"""
+    if 'sklearn' not in sys.modules:
+        return False
+    from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor
+    return isinstance(model, (RandomForestRegressor, ExtraTreesRegressor))
+
+def predict_with_spread(model, X):
+    """
+    Dự đoán và tính độ tin cậy cho cả lô đặc trưng.
+
+    Với Random Forest / Extra Trees, mỗi cây chỉ được gọi một lần trên toàn bộ
+    ma trận X; giá trị dự đoán là trung bình các cây (đúng như predict của rừng)
+    và độ tin cậy được tính từ độ phân tán giữa các cây. Mô hình khác (một
+    cây, gradient boosting...) dùng model.predict với độ tin cậy cố định.
+
+    Returns:
+        (predictions, confidences) - hai mảng có độ dài len(X); với mô hình
+        nhiều mốc mỗi mảng có dạng (len(X), số mốc)
+    """
+    if isinstance(model, HourlyMeanModel):
+        # Mô hình dự phòng: độ tin cậy bằng 0
+        return model.predict(X), np.zeros(len(X))
+    elif isinstance(model, CompiledForest):
+        # Mảng (n_trees, n_rows[, n_outputs]) tính hoàn toàn bằng NumPy
+        tree_predictions = model.predict_trees(X)
+    elif is_averaging_forest(model):
+        # Mảng (n_trees, n_rows[, n_outputs]) chứa dự đoán của từng cây
+        tree_predictions = np.stack([tree.predict(X, check_input=False) for tree in model.estimators_])
+    else:
+        # Một cây, gradient boosting (estimators_ là mảng 2 chiều các stage,
+        # trung bình của chúng không phải dự đoán)...: không có độ phân tán giữa các cây
+        import pandas as pd
+        predictions = model.predict(pd.DataFrame(X, columns=model_feature_names(model)))
+        return predictions, np.ones(np.shape(predictions))
+
+    predictions = tree_predictions.mean(axis=0)
+    spread = tree_predictions.max(axis=0) - tree_predictions.min(axis=0)
+    confidences = 1.0 - (tree_predictions.std(axis=0) / (spread + 1e-10))
+    return predictions, confidences
+
+def error_result(message):
+    """Kết quả lỗi theo đúng schema mà backend Node.js đang đọc"""
+    return {
+        "error": str(message),
+        "temperature": 0,
+        "confidence": 0
+    }
+
+def format_prediction(sensor_data, future_times, predictions, confidences, time_points=TIME_POINTS):
+    """Đóng gói kết quả dự đoán của một cảm biến theo schema mà backend đang đọc"""
+    hour_predictions = []
+    for minutes_ahead, future_time, prediction, confidence in zip(
+            time_points, future_times, np.ravel(predictions), np.ravel(confidences)):
+        hour_predictions.append({
+            "minutes_ahead": minutes_ahead,
+            "temperature": float(prediction),
+            "confidence": float(confidence),
+            "predicted_time": future_time.isoformat()
+        })
+
+    # Trả về kết quả dự đoán
+    return {
+        "current_time": sensor_data['current_time'].isoformat(),
+        "current_temperature": sensor_data['current_temperature'],
+        "hour_predictions": hour_predictions,
+        # Nhiệt độ dự đoán cao nhất và độ tin cậy tương ứng
+        "max_temperature": max([p["temperature"] for p in hour_predictions]),
+        "max_confidence": [p["confidence"] for p in hour_predictions][
+            [p["temperature"] for p in hour_predictions].index(max([p["temperature"] for p in hour_predictions]))
+        ]
+    }
+
+def make_prediction(model, sensor_id=None, model_version=None, memo=None, metrics=None):
+    """
+    Dự đoán nhiệt độ cho giờ tiếp theo với mô hình đã được tải sẵn.
+
+    Args:
+        model: Mô hình Random Forest đã huấn luyện
+        sensor_id: Cảm biến cần dự đoán (mặc định: cảm biến nhiệt độ đầu tiên)
+        model_version: Phiên bản mô hình; None thì không dùng bộ nhớ đệm kết quả
+        memo: PredictionMemo; kết quả lấy từ bộ nhớ đệm có thêm "cached": true
+        metrics: PredictionMetrics để ghi thời gian từng giai đoạn (tùy chọn)
+
+    Returns:
+        Dictionary kết quả (cùng schema với output của predict_temperature)
+    """
     try:
-        # Đường dẫn đến thư mục dữ liệu
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        data_dir = os.path.join(current_dir, 'data')
-        model_dir = os.path.join(data_dir, 'models')
-        model_path = os.path.join(model_dir, 'temp_model.pkl')
-        
-        # Kiểm tra nếu mô hình đã tồn tại
-        if os.path.exists(model_path):
-            print("Đang tải mô hình đã huấn luyện...")
-            return joblib.load(model_path)
-        
-        # Nếu không, tạo mô hình mới từ tệp CSV mẫu
-        print("Tạo mô hình mới từ tệp CSV mẫu...")
-        csv_path = os.path.join(data_dir, 'raw', 'temperature_data_from_export2.csv')
-        
-        if not os.path.exists(csv_path):
-            raise FileNotFoundError(f"Không tìm thấy tệp dữ liệu: {csv_path}")
-        
-        # Đọc dữ liệu
-        df = pd.read_csv(csv_path)
-        
-        # Xử lý dữ liệu
-        if 'recorded_time' in df.columns:
-            df['recorded_time'] = pd.to_datetime(df['recorded_time'])
-            df['hour'] = df['recorded_time'].dt.hour
-            df['day_of_week'] = df['recorded_time'].dt.dayofweek
-            
-            # Tạo các đặc trưng thời gian trong ngày
-            df['time_morning'] = ((df['hour'] >= 5) & (df['hour'] < 12)).astype(int)
-            df['time_afternoon'] = ((df['hour'] >= 12) & (df['hour'] < 17)).astype(int)
-            df['time_evening'] = ((df['hour'] >= 17) & (df['hour'] < 21)).astype(int)
-            df['time_night'] = ((df['hour'] >= 21) | (df['hour'] < 5)).astype(int)
-        
-        # Tạo đặc trưng
-        features = ['hour', 'day_of_week', 'time_morning', 'time_afternoon', 'time_evening', 'time_night']
-        X = df[features]
-        y = df['temperature']
-        
-        # Tạo mô hình Random Forest
-        model = RandomForestRegressor(n_estimators=100, max_depth=10, random_state=42)
-        model.fit(X, y)
-        
-        # Tạo thư mục models nếu chưa tồn tại
-        os.makedirs(model_dir, exist_ok=True)
-        
-        # Lưu mô hình
-        joblib.dump(model, model_path)
-        
-        return model
-        
+        # Lấy dữ liệu cảm biến mới nhất
+        use_memo = memo is not None and model_version is not None
+        with measure(metrics, 'get_sensor_data'):
+            if use_memo and sensor_id is None:
+                # Dùng sensor_id thật làm khóa để trùng với khóa của chế độ lô
+                sensor_id = get_sensor_data_source().get_default_sensor_id()
+            sensor_data = get_latest_sensor_data(sensor_id)
+        if metrics is not None:
+            metrics.info['rows_fetched'] = sensor_data['rows_fetched']
+
+        if use_memo:
+            key = memo_key(sensor_id, sensor_data, model_version)
+            cached = memo.get(key)
+            if cached is not None:
+                cached['cached'] = True
+                return cached
+
+        # Dự đoán cho giờ tiếp theo: mọi mốc thời gian nằm trong một ma trận
+        # đặc trưng duy nhất (hoặc một hàng với mô hình nhiều mốc)
+        with measure(metrics, 'feature_assembly'):
+            time_points, future_times, X = build_forecast_features(model, sensor_data)
+        with measure(metrics, 'inference'):
+            predictions, confidences = predict_with_spread(model, X)
+
+        with measure(metrics, 'format_result'):
+            result = format_prediction(sensor_data, future_times, predictions, confidences, time_points)
+        if use_memo:
+            memo.put(key, result)
+        return result
+
     except Exception as e:
-        print(f"Lỗi khi tạo/tải mô hình: {str(e)}")
-        raise
+        return error_result(e)
+
+def make_batch_prediction(model, source=None, model_version=None, memo=None, metrics=None):
+    """
+    Dự đoán cho mọi cảm biến nhiệt độ: một truy vấn gom nhóm, một ma trận
+    đặc trưng chung và một lần gọi mô hình cho cả lô. Cảm biến có kết quả
+    trong memo (không có dữ liệu mới) không được đưa vào ma trận.
 
-def predict_temperature():
+    Returns:
+        {"predictions": [...]} - mỗi phần tử cùng schema với make_prediction,
+        kèm thêm "sensor_id"; cảm biến lỗi dữ liệu trả về error_result riêng
+    """
     try:
-        # Tải mô hình
-        model = load_or_create_model()
-        
-        # Lấy dữ liệu cảm biến mới nhất
-        sensor_data = get_latest_sensor_data()
-        if not sensor_data:
-            return
-        
-        # Dự đoán cho giờ tiếp theo với khoảng thời gian 15 phút
-        time_points = [15, 30, 45, 60]  # phút tiếp theo
-        hour_predictions = []
-        
-        # Thời gian hiện tại
-        current_time = sensor_data['current_time']
-        if isinstance(current_time, str):
-            current_time = datetime.fromisoformat(current_time.replace('Z', '+00:00'))
-        
-        for minutes_ahead in time_points:
-            # Điều chỉnh đặc trưng cho thời gian tương lai
-            future_time = current_time + timedelta(minutes=minutes_ahead)
-            future_hour = future_time.hour
-            
-            # Cập nhật đặc trưng thời gian trong ngày cho thời gian tương lai
-            if 5 <= future_hour < 12:
-                future_time_of_day = [1, 0, 0, 0]  # sáng
-            elif 12 <= future_hour < 17:
-                future_time_of_day = [0, 1, 0, 0]  # trưa
-            elif 17 <= future_hour < 21:
-                future_time_of_day = [0, 0, 1, 0]  # chiều
-            else:
-                future_time_of_day = [0, 0, 0, 1]  # tối
-            
-            # Tạo đặc trưng cho dự đoán
-            features = {
-                'hour': future_hour,
-                'day_of_week': future_time.weekday(),
-                'time_morning': future_time_of_day[0],
-                'time_afternoon': future_time_of_day[1],
-                'time_evening': future_time_of_day[2],
-                'time_night': future_time_of_day[3]
-            }
-            
-            future_df = pd.DataFrame([features])
-            
-            # Dự đoán cho mốc thời gian này
-            future_prediction = model.predict(future_df)[0]
-            
-            # Tính độ tin cậy (đối với Random Forest, lấy độ lệch chuẩn của các cây)
-            future_predictions_trees = [tree.predict(future_df)[0] for tree in model.estimators_]
-            future_confidence = 1.0 - (np.std(future_predictions_trees) / (max(future_predictions_trees) - min(future_predictions_trees) + 1e-10))
-            
-            # Thêm vào dự đoán cho giờ tiếp theo
-            hour_predictions.append({
-                "minutes_ahead": minutes_ahead,
-                "temperature": float(future_prediction),
-                "confidence": float(future_confidence),
-                "predicted_time": future_time.isoformat()
-            })
-        
-        # Trả về kết quả dự đoán
-        result = {
-            "current_time": current_time.isoformat(),
-            "current_temperature": sensor_data['current_temperature'],
-            "hour_predictions": hour_predictions,
-            # Nhiệt độ dự đoán cao nhất và độ tin cậy tương ứng
-            "max_temperature": max([p["temperature"] for p in hour_predictions]),
-            "max_confidence": [p["confidence"] for p in hour_predictions][
-                [p["temperature"] for p in hour_predictions].index(max([p["temperature"] for p in hour_predictions]))
-            ]
-        }
-        
-        print(json.dumps(result))
-        
+        source = source or get_sensor_data_source()
+        with measure(metrics, 'get_sensor_data'):
+            readings = source.fetch_latest_readings_all(limit=HISTORY_ROWS)
+        if metrics is not None:
+            metrics.info['rows_fetched'] = sum(len(rows) for rows in readings.values())
+
+        use_memo = memo is not None and model_version is not None
+        results = {}
+        snapshots = []
+        feature_blocks = []
+        for sensor_id, rows in readings.items():
+            try:
+                snapshot = sensor_snapshot(rows)
+            except Exception as e:
+                results[sensor_id] = error_result(e)
+                continue
+            if use_memo:
+                cached = memo.get(memo_key(sensor_id, snapshot, model_version))
+                if cached is not None:
+                    cached['cached'] = True
+                    results[sensor_id] = cached
+                    continue
+            try:
+                with measure(metrics, 'feature_assembly'):
+                    time_points, future_times, X = build_forecast_features(model, snapshot)
+            except Exception as e:
+                results[sensor_id] = error_result(e)
+                continue
+            snapshots.append((sensor_id, snapshot, time_points, future_times, len(X)))
+            feature_blocks.append(X)
+
+        if feature_blocks:
+            with measure(metrics, 'inference'):
+                predictions, confidences = predict_with_spread(model, np.vstack(feature_blocks))
+            start = 0
+            for sensor_id, snapshot, time_points, future_times, n_rows in snapshots:
+                block = slice(start, start + n_rows)
+                start += n_rows
+                with measure(metrics, 'format_result'):
+                    results[sensor_id] = format_prediction(
+                        snapshot, future_times, predictions[block], confidences[block], time_points
+                    )
+                if use_memo:
+                    memo.put(memo_key(sensor_id, snapshot, model_version), results[sensor_id])
+
+        batch = []
+        for sensor_id in readings:
+            result = results[sensor_id]
+            result['sensor_id'] = sensor_id
+            batch.append(result)
+        return {"predictions": batch}
+
     except Exception as e:
-        print(json.dumps({
-            "error": str(e),
-            "temperature": 0,
-            "confidence": 0
-        }))
+        return error_result(e)
+
+def run_prediction(cache, action='predict', sensor_id=None, include_metrics=False):
+    """
+    Lấy mô hình từ cache và dự đoán cho một cảm biến ("predict") hoặc mọi
+    cảm biến ("predict_all"), thu thập metrics nếu được yêu cầu.
+
+    Args:
+        include_metrics: Gắn khối "metrics" vào kết quả dù metrics_sink không bật inline
+    """
+    collect = include_metrics or metrics_sink.inline or metrics_sink.path
+    metrics = PredictionMetrics() if collect else None
+
+    with measure(metrics, 'load_model'):
+        model, version = cache.get_with_version()
+
+    if action == 'predict_all':
+        result = make_batch_prediction(model, model_version=version, memo=prediction_memo, metrics=metrics)
+    else:
+        result = make_prediction(model, sensor_id, version, prediction_memo, metrics)
+
+    if metrics is not None:
+        metrics.info.update(cache.model_info())
+        metrics_sink.emit(result, metrics, inline=include_metrics)
+    return result
+
+def predict_temperature(sensor_id=None):
+    """
+    Chạy một lần: tải mô hình, dự đoán và in JSON ra stdout.
+
+    Nếu chưa có mô hình, kết quả được trả ngay bằng mô hình dự phòng;
+    tiến trình chỉ chờ huấn luyện nền xong sau khi đã in kết quả.
+    """
+    cache = ModelCache()
+    print(json.dumps(run_prediction(cache, 'predict', sensor_id)), flush=True)
+    cache.wait_for_training()
+
+def predict_all_sensors():
+    """Chạy một lần ở chế độ lô cho mọi cảm biến nhiệt độ và in JSON ra stdout"""
+    cache = ModelCache()
+    print(json.dumps(run_prediction(cache, 'predict_all')), flush=True)
+    cache.wait_for_training()
+
+def handle_request(cache, line):
+    """
+    Xử lý một yêu cầu JSON-lines của chế độ thường trú.
+
+    Yêu cầu có dạng {"id": 1, "action": "predict", "sensor_id": 3}; "action"
+    mặc định là "predict", ngoài ra hỗ trợ "predict_all" (mọi cảm biến nhiệt độ)
+    và "ping". "sensor_id" là tùy chọn; "metrics": true gắn thêm thời gian
+    từng giai đoạn vào kết quả. Trường "id" (nếu có) được trả lại
+    để phía Node.js ghép cặp yêu cầu và phản hồi.
+
+    Returns:
+        Chuỗi JSON một dòng (không kèm ký tự xuống dòng)
+    """
+    try:
+        request = json.loads(line) if line.strip() else {}
+        if not isinstance(request, dict):
+            raise ValueError("Yêu cầu phải là một JSON object")
+    except ValueError as e:
+        return json.dumps(error_result(f"Yêu cầu không hợp lệ: {e}"))
+
+    action = request.get('action', 'predict')
+    if action in ('predict', 'predict_all'):
+        result = run_prediction(cache, action, request.get('sensor_id'), bool(request.get('metrics')))
+    elif action == 'ping':
+        result = {"status": "ok"}
+    else:
+        result = error_result(f"Không hỗ trợ action: {action}")
+
+    if 'id' in request:
+        result['id'] = request['id']
+    return json.dumps(result)
+
+def serve_stdio(cache, stream_in=None, stream_out=None):
+    """Vòng lặp thường trú: mỗi dòng stdin là một yêu cầu, mỗi dòng stdout là một phản hồi"""
+    stream_in = stream_in or sys.stdin
+    stream_out = stream_out or sys.stdout
+
+    for line in stream_in:
+        if not line.strip():
+            continue
+        stream_out.write(handle_request(cache, line) + '\n')
+        stream_out.flush()
+
+def serve_socket(cache, socket_path):
+    """Phục vụ JSON-lines qua Unix socket, mô hình được dùng chung cho mọi kết nối"""
+    class PredictionHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for raw_line in self.rfile:
+                line = raw_line.decode('utf-8')
+                if not line.strip():
+                    continue
+                self.wfile.write((handle_request(cache, line) + '\n').encode('utf-8'))
+                self.wfile.flush()
+
+    # Xóa socket cũ còn sót lại từ lần chạy trước
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    with socketserver.UnixStreamServer(socket_path, PredictionHandler) as server:
+        print(f"Đang phục vụ dự đoán qua Unix socket {socket_path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        finally:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='YoloHome AI - Dự đoán nhiệt độ')
+    parser.add_argument('--serve', action='store_true',
+                      help='Chạy thường trú, nhận yêu cầu JSON-lines qua stdin/stdout')
+    parser.add_argument('--socket', type=str, default=None,
+                      help='Chạy thường trú qua Unix socket tại đường dẫn chỉ định')
+    parser.add_argument('--sensor-id', type=int, default=None,
+                      help='Cảm biến cần dự đoán (mặc định: cảm biến nhiệt độ đầu tiên)')
+    parser.add_argument('--all-sensors', action='store_true',
+                      help='Dự đoán cho mọi cảm biến nhiệt độ trong một lần gọi mô hình')
+    parser.add_argument('--memo-ttl', type=float, default=3600,
+                      help='Thời gian sống (giây) của kết quả dự đoán trong bộ nhớ đệm')
+    parser.add_argument('--memo-size', type=int, default=1024,
+                      help='Số kết quả dự đoán tối đa trong bộ nhớ đệm (0 để tắt)')
+    parser.add_argument('--metrics', action='store_true',
+                      help='Gắn thời gian từng giai đoạn, phiên bản mô hình, RSS vào JSON kết quả')
+    parser.add_argument('--metrics-file', type=str, default=None,
+                      help='Ghi metrics của mỗi lần dự đoán (JSON-lines) vào file riêng')
+    parser.add_argument('--check-index', action='store_true',
+                      help='Kiểm tra index (sensor_id, recorded_time DESC) rồi thoát')
+    parser.add_argument('--create-index', action='store_true',
+                      help='Tạo index (sensor_id, recorded_time DESC) nếu chưa có rồi thoát')
+    args = parser.parse_args()
+
+    if args.check_index or args.create_index:
+        try:
+            exists = get_sensor_data_source().ensure_index(create=args.create_index)
+        except Exception as e:
+            print(f"Lỗi khi kiểm tra index: {str(e)}", file=sys.stderr)
+            return 1
+        return 0 if exists else 1
+
+    metrics_sink.inline = args.metrics
+    metrics_sink.path = args.metrics_file
+
+    if not args.serve and not args.socket:
+        if args.all_sensors:
+            predict_all_sensors()
+        else:
+            predict_temperature(args.sensor_id)
+        return 0
+
+    # Chế độ thường trú: mô hình được tải một lần và chỉ tải lại khi file thay đổi
+    prediction_memo.ttl = args.memo_ttl
+    prediction_memo.maxsize = args.memo_size
+    cache = ModelCache()
+    cache.get()
+
+    try:
+        if args.socket:
+            serve_socket(cache, args.socket)
+        else:
+            serve_stdio(cache)
+    except KeyboardInterrupt:
+        pass
+    return 0
 
 if __name__ == "__main__":
-    predict_temperature()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+YoloHome AI - Benchmark tiền xử lý dữ liệu
+==========================================
+So sánh thời gian và bộ nhớ đỉnh của SensorDataProcessor.preprocess_data
+(bản NumPy một lượt) với cách làm cũ dựa trên DataFrame (sao chép, sort,
+lọc hai lần, pd.get_dummies + pd.concat, cột trung gian, fit lại scaler
+cho từng cột).
+
+Bộ nhớ đỉnh được đo bằng tracemalloc (gồm cả bộ nhớ NumPy/pandas cấp phát);
+"phụ trội" là phần bộ nhớ đỉnh vượt quá kích thước của chính DataFrame kết quả.
+
+Ví dụ:
+    python benchmark_preprocess.py --rows 10000000
+    python benchmark_preprocess.py --rows 1000000 --repeat 3 --output bench_preprocess.json
+"""
+
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import MinMaxScaler
+
+from data_processor import SensorDataProcessor, FEATURES_TO_SCALE
+
+def legacy_preprocess(raw_data):
+    """Cách tiền xử lý cũ (trước khi gộp thành một lượt NumPy), giữ lại để so sánh"""
+    scaler_temp = MinMaxScaler()
+    df = raw_data.copy()
+    df['recorded_time'] = pd.to_datetime(df['recorded_time'])
+    df = df.sort_values('recorded_time')
+    if df['temperature'].isna().any():
+        df['temperature'] = df['temperature'].interpolate(method='linear')
+    df = df[(df['temperature'] >= -20) & (df['temperature'] <= 60)]
+
+    df['hour'] = df['recorded_time'].dt.hour
+    df['minute'] = df['recorded_time'].dt.minute
+    df['day_of_week'] = df['recorded_time'].dt.dayofweek
+    conditions = [
+        (df['hour'] >= 5) & (df['hour'] < 12),
+        (df['hour'] >= 12) & (df['hour'] < 17),
+        (df['hour'] >= 17) & (df['hour'] < 21),
+        (df['hour'] >= 21) | (df['hour'] < 5)
+    ]
+    categories = ['morning', 'afternoon', 'evening', 'night']
+    df['time_of_day'] = pd.Categorical(
+        np.select(conditions, categories, default='night'),
+        categories=categories,
+        ordered=True
+    )
+    time_dummies = pd.get_dummies(df['time_of_day'], prefix='time')
+    df = pd.concat([df, time_dummies], axis=1)
+
+    for lag in [1, 2, 3]:
+        df[f'temp_lag_{lag}'] = df['temperature'].shift(lag)
+    df['temp_diff_1'] = df['temperature'].diff()
+    df['temp_diff_2'] = df['temp_diff_1'].diff()
+    df = df.dropna()
+
+    df['temp_diff'] = df['temperature'].diff().abs()
+    df['temp_unchanged'] = (df['temp_diff'] < 0.01).astype(int)
+    df['temp_dup_count'] = df['temp_unchanged'].groupby(
+        (df['temp_unchanged'] != df['temp_unchanged'].shift()).cumsum()
+    ).cumsum()
+    df = df[(df['temp_dup_count'] <= 3)]
+
+    for feature in FEATURES_TO_SCALE:
+        df[f'{feature}_scaled'] = scaler_temp.fit_transform(df[[feature]])
+    return df.drop(['temp_diff', 'temp_unchanged', 'temp_dup_count'], axis=1)
+
+def fused_preprocess(raw_data, compact=False):
+    processor = SensorDataProcessor(compact=compact)
+    processor.raw_data = raw_data
+    processor.preprocess_data()
+    return processor.processed_data
+
+def compact_preprocess(raw_data):
+    return fused_preprocess(raw_data, compact=True)
+
+def make_raw_data(n_rows, seed=42):
+    """Chuỗi DHT20 giả lập 1 phút/lần: dao động ngày, nhiễu, giá trị lặp, NaN và outlier"""
+    rng = np.random.RandomState(seed)
+    times = pd.date_range('2024-01-01', periods=n_rows, freq='1min')
+    hours = (np.arange(n_rows) / 60.0) % 24
+    temps = np.round(26 + 4 * np.sin((hours - 6) * np.pi / 12) + rng.normal(0, 0.3, n_rows), 1)
+    temps[rng.randint(0, n_rows, n_rows // 1000)] = np.nan
+    temps[rng.randint(0, n_rows, n_rows // 10000)] = 85.0
+    return pd.DataFrame({'recorded_time': times, 'temperature': temps})
+
+def measure(func, raw_data):
+    """(giây, MB bộ nhớ đỉnh, MB của kết quả, số hàng kết quả) cho một lần chạy"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(raw_data)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result_mb = result.memory_usage(index=True).sum() / 1024 / 1024
+    return elapsed, peak / 1024 / 1024, result_mb, len(result)
+
+def main():
+    parser = argparse.ArgumentParser(description='YoloHome AI - Benchmark tiền xử lý dữ liệu')
+    parser.add_argument('--rows', type=int, default=10_000_000,
+                      help='Số bản ghi giả lập')
+    parser.add_argument('--repeat', type=int, default=1,
+                      help='Số lần đo mỗi cách (lấy giá trị tốt nhất)')
+    parser.add_argument('--output', type=str, default=None,
+                      help='Ghi kết quả (JSON) ra file')
+    args = parser.parse_args()
+
+    import logging
+    logging.getLogger("data_processor").setLevel(logging.WARNING)
+
+    print(f"Tạo {args.rows} bản ghi giả lập...")
+    raw_data = make_raw_data(args.rows)
+
+    results = {'rows': args.rows}
+    for name, func in [('legacy', legacy_preprocess), ('fused', fused_preprocess),
+                       ('compact', compact_preprocess)]:
+        runs = [measure(func, raw_data) for _ in range(args.repeat)]
+        peak_mb = min(run[1] for run in runs)
+        results[name] = {
+            'seconds': min(run[0] for run in runs),
+            'peak_mb': peak_mb,
+            'result_mb': runs[0][2],
+            'overhead_mb': peak_mb - runs[0][2],
+            'output_rows': runs[0][3]
+        }
+        print(f"{name:<8} {results[name]['seconds']:>8.2f} s   đỉnh {peak_mb:>8.1f} MB   "
+              f"phụ trội {results[name]['overhead_mb']:>8.1f} MB   ({results[name]['output_rows']} hàng)")
+
+    legacy, fused = results['legacy'], results['fused']
+    print(f"Nhanh hơn {legacy['seconds'] / fused['seconds']:.1f} lần, "
+          f"bộ nhớ đỉnh thấp hơn {legacy['peak_mb'] / fused['peak_mb']:.1f} lần, "
+          f"phụ trội thấp hơn {legacy['overhead_mb'] / max(fused['overhead_mb'], 1e-9):.1f} lần")
+    compact = results['compact']
+    print(f"Chế độ compact: kết quả {compact['result_mb']:.1f} MB thay vì {fused['result_mb']:.1f} MB, "
+          f"bộ nhớ đỉnh thấp hơn bản cũ {legacy['peak_mb'] / compact['peak_mb']:.1f} lần")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Đã lưu kết quả benchmark vào {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
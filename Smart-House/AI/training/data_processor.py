@@ -5,12 +5,20 @@ Module xử lý và chuẩn bị dữ liệu cảm biến cho quá trình huấn
 """
 
 import os
+import csv
+import math
+import json
 import logging
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from itertools import repeat
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.preprocessing import MinMaxScaler
 
+from frame_store import save_frame, load_frame, append_frame
+
 # Cấu hình logging
 logging.basicConfig(
     level=logging.INFO,
@@ -23,62 +31,876 @@ logging.basicConfig(
 
 logger = logging.getLogger("data_processor")
 
+# Các mốc dự báo mặc định (phút) cho mô hình dự báo trực tiếp nhiều mốc
+DEFAULT_HORIZONS = [15, 30, 45, 60]
+
+# Đặc trưng của mô hình nhiều mốc: giá trị chưa scale để predict.py có thể
+# tính lại trực tiếp từ các lần đọc mới nhất trong database
+MULTI_HORIZON_FEATURES = [
+    'temperature', 'temp_lag_1', 'temp_lag_2', 'temp_lag_3',
+    'temp_diff_1', 'temp_diff_2',
+    'hour', 'day_of_week',
+    'time_morning', 'time_afternoon', 'time_evening', 'time_night'
+]
+
+# Cột cần đọc từ CSV (cột khác bị bỏ qua ngay khi parse)
+CSV_COLUMNS = ['recorded_time', 'temperature']
+CSV_DTYPES = {'temperature': 'float64', 'value': 'float64'}
+
+# Dữ liệu dạng dài nhiều sensor: mỗi dòng một lần đọc (thời gian, sensor, biến, giá trị)
+LONG_FORMAT_COLUMNS = ['recorded_time', 'sensor_id', 'variable', 'value']
+
+# Tiền tố tên đặc trưng (temp_lag_1, humid_diff_1, ...) và khoảng giá trị hợp lệ
+# theo biến; biến khác dùng chính tên biến làm tiền tố và không lọc outlier
+VARIABLE_PREFIXES = {'temperature': 'temp', 'humidity': 'humid'}
+VALUE_RANGES = {'temperature': (-20, 60), 'humidity': (0, 100)}
+
+# Số dòng mỗi chunk khi đọc CSV theo luồng
+CSV_CHUNKSIZE = 100_000
+
+# Chỉ tìm đuôi file bằng seek khi file lớn hơn ngưỡng này (byte)
+TAIL_SEEK_MIN_BYTES = 4 * 1024 * 1024
+
+# Số vị trí lấy mẫu để đoán file có được sắp xếp theo thời gian hay không
+SORTED_PROBES = 16
+
+# Số bản ghi mỗi lần fetchmany từ server-side cursor
+DB_FETCH_SIZE = 50_000
+
+# Nhiệt độ trong cửa sổ filter_hours tính từ bản ghi mới nhất; cửa sổ được
+# lọc ngay trong WHERE để PostgreSQL dùng index (sensor_id, recorded_time)
+DB_WINDOW_QUERY = """
+    SELECT sd.recorded_time, sd.svalue AS temperature
+    FROM sensor_data sd
+    JOIN sensor s ON sd.sensor_id = s.sensor_id
+    WHERE s.sensor_type = 'Temperature'
+      AND sd.recorded_time >= (
+          SELECT MAX(sd2.recorded_time)
+          FROM sensor_data sd2
+          JOIN sensor s2 ON sd2.sensor_id = s2.sensor_id
+          WHERE s2.sensor_type = 'Temperature'
+      ) - %(window_hours)s * INTERVAL '1 hour'
+    ORDER BY sd.recorded_time
+"""
+
+DB_ALL_QUERY = """
+    SELECT sd.recorded_time, sd.svalue AS temperature
+    FROM sensor_data sd
+    JOIN sensor s ON sd.sensor_id = s.sensor_id
+    WHERE s.sensor_type = 'Temperature'
+    ORDER BY sd.recorded_time
+"""
+
+def parse_times(values, time_format=None):
+    """
+    Chuyển cột thời gian dạng chuỗi sang datetime64.
+
+    Dùng định dạng cố định (nhanh hơn nhiều so với đoán từng dòng) nếu có,
+    quay về pd.to_datetime thông thường khi định dạng không khớp.
+    """
+    if time_format:
+        try:
+            return pd.to_datetime(values, format=time_format)
+        except (ValueError, TypeError):
+            pass
+    return pd.to_datetime(values)
+
+def guess_time_format(sample):
+    """Đoán định dạng strftime từ một giá trị thời gian mẫu, None nếu không đoán được"""
+    try:
+        from pandas.tseries.api import guess_datetime_format
+    except ImportError:
+        return None
+    return guess_datetime_format(str(sample)) if sample is not None else None
+
+# Các đặc trưng được MinMax-scale (thành cột <tên>_scaled)
+FEATURES_TO_SCALE = ['temperature', 'temp_lag_1', 'temp_lag_2', 'temp_lag_3',
+                     'temp_diff_1', 'temp_diff_2']
+
+# Độ dài tối đa của một chuỗi giá trị không đổi được giữ lại
+MAX_DUP_RUN = 3
+
+# Cách gộp các lần đọc trong một bucket thời gian khi resample
+RESAMPLE_AGGREGATIONS = ['mean', 'min', 'max', 'last']
+
+# Số bucket trống liên tiếp tối đa được giữ lại (rồi nội suy); khoảng trống
+# dài hơn không tạo bucket nào
+RESAMPLE_MAX_GAP = 4
+
+# Khối đặc trưng thống kê trượt: cửa sổ thời gian mặc định và các thống kê
+# (tên cột <tiền tố>_<thống kê>_<cửa sổ>, ví dụ temp_mean_15m, temp_slope_6h)
+ROLLING_WINDOWS = ['15min', '1h', '6h']
+ROLLING_STATS = ['mean', 'std', 'min', 'max', 'slope']
+
+# Buổi trong ngày theo giờ (0-23): sáng 5-11, chiều 12-16, tối 17-20, đêm còn lại
+TIME_OF_DAY = ['morning', 'afternoon', 'evening', 'night']
+HOUR_TO_TIME_OF_DAY = np.array([3] * 5 + [0] * 7 + [1] * 5 + [2] * 4 + [3] * 3, dtype=np.int8)
+
+def datetime_values(values):
+    """Mảng datetime64 theo giờ địa phương (bỏ múi giờ nếu có) của một cột thời gian"""
+    index = pd.DatetimeIndex(pd.to_datetime(values))
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.to_numpy()
+
+def time_feature_columns(values, int_dtype=np.int32):
+    """
+    Tính hour, minute, day_of_week, time_of_day và one-hot time_* trực tiếp
+    trên mảng datetime64 (không tạo DataFrame trung gian).
+    """
+    times = datetime_values(values)
+    minutes = times.astype('datetime64[m]').astype(np.int64)
+    days = np.floor_divide(minutes, 24 * 60)
+    minute_of_day = minutes - days * 24 * 60
+    hour = (minute_of_day // 60).astype(int_dtype)
+    # 1970-01-01 là thứ Năm (dayofweek = 3)
+    day_of_week = ((days + 3) % 7).astype(int_dtype)
+    codes = HOUR_TO_TIME_OF_DAY[hour]
+
+    columns = {
+        'hour': hour,
+        'minute': (minute_of_day % 60).astype(int_dtype),
+        'day_of_week': day_of_week,
+        'time_of_day': pd.Categorical.from_codes(codes, categories=TIME_OF_DAY, ordered=True)
+    }
+    for code, name in enumerate(TIME_OF_DAY):
+        columns[f'time_{name}'] = codes == code
+    return columns
+
+def interpolate_forward(values, missing):
+    """
+    Nội suy tuyến tính theo vị trí như Series.interpolate('linear'):
+    NaN ở đầu giữ nguyên, NaN ở cuối lấy giá trị hợp lệ cuối cùng.
+    """
+    known = np.flatnonzero(~missing)
+    if len(known) == 0:
+        return values
+    values = values.copy()
+    positions = np.flatnonzero(missing)
+    fill = positions > known[0]
+    values[positions[fill]] = np.interp(positions[fill], known, values[known])
+    return values
+
+def run_lengths(flags):
+    """Với mảng 0/1: số 1 liên tiếp tính đến từng vị trí (0 tại các vị trí 0)"""
+    counts = np.cumsum(flags)
+    resets = np.maximum.accumulate(np.where(flags == 0, counts, 0))
+    return counts - resets
+
+# Kiểu dữ liệu ở chế độ compact: nhiệt độ float32, đặc trưng thời gian int8,
+# cờ one-hot bool (time_of_day vẫn là category với mã int8)
+COMPACT_FLOAT = np.float32
+COMPACT_INT = np.int8
+COMPACT_INT_COLUMNS = ['hour', 'minute', 'day_of_week']
+
+def compact_frame(df):
+    """
+    Chuyển một frame đã xử lý (ví dụ đọc lại từ CSV) sang kiểu compact:
+    cột nhiệt độ/độ ẩm/đặc trưng/mục tiêu float64 -> float32, cột thời gian -> int8,
+    cờ time_* -> bool. Các cột khác giữ nguyên.
+    """
+    dtypes = {}
+    for col, dtype in df.dtypes.items():
+        if col in COMPACT_INT_COLUMNS:
+            dtypes[col] = COMPACT_INT
+        elif col.startswith('time_') and col != 'time_of_day':
+            dtypes[col] = bool
+        elif col.startswith(('temp', 'humid', 'target_')) and pd.api.types.is_float_dtype(dtype):
+            dtypes[col] = COMPACT_FLOAT
+    return df.astype(dtypes, copy=False)
+
+def frame_memory_report(df):
+    """
+    Bộ nhớ (MB) của frame và của cùng frame ở kiểu mặc định (float64, int32),
+    để báo cáo phần tiết kiệm được của chế độ compact.
+    """
+    actual = df.memory_usage(index=True).sum()
+    baseline = actual
+    for col, dtype in df.dtypes.items():
+        if dtype == COMPACT_FLOAT:
+            baseline += len(df) * (8 - 4)
+        elif dtype == COMPACT_INT:
+            baseline += len(df) * (4 - 1)
+    actual_mb = actual / 1024 / 1024
+    baseline_mb = baseline / 1024 / 1024
+    return {'actual_mb': actual_mb, 'default_mb': baseline_mb, 'saved_mb': baseline_mb - actual_mb}
+
+def is_long_format(df):
+    """DataFrame có dạng dài (recorded_time, sensor_id, variable, value)?"""
+    return df is not None and all(col in df.columns for col in LONG_FORMAT_COLUMNS)
+
+def variable_prefix(variable):
+    return VARIABLE_PREFIXES.get(variable, variable)
+
+def variable_features(variable):
+    """Các đặc trưng số của một biến (cùng thứ tự FEATURES_TO_SCALE cho temperature)"""
+    prefix = variable_prefix(variable)
+    return [variable] + [f'{prefix}_lag_{lag}' for lag in [1, 2, 3]] + [f'{prefix}_diff_1', f'{prefix}_diff_2']
+
+def ordered_variables(variables):
+    """temperature, humidity trước, các biến khác theo thứ tự chữ cái"""
+    known = [v for v in VARIABLE_PREFIXES if v in variables]
+    return known + sorted(v for v in variables if v not in VARIABLE_PREFIXES)
+
+def group_positions(codes):
+    """Vị trí của từng hàng trong nhóm (0, 1, 2, ...) trên mảng mã nhóm đã sắp xếp"""
+    if len(codes) == 0:
+        return np.arange(0)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    sizes = np.diff(np.append(starts, len(codes)))
+    return np.arange(len(codes)) - np.repeat(starts, sizes)
+
+def interpolate_grouped(values, missing, codes):
+    """
+    interpolate_forward trong từng nhóm (mảng đã sắp xếp theo nhóm): không nội
+    suy qua ranh giới sensor. NaN ở đầu nhóm giữ nguyên, NaN ở cuối nhóm lấy
+    giá trị hợp lệ cuối cùng của nhóm.
+    """
+    known = np.flatnonzero(~missing)
+    positions = np.flatnonzero(missing)
+    if len(known) == 0 or len(positions) == 0:
+        return values
+    values = values.copy()
+    after = np.searchsorted(known, positions)
+    prev = known[np.maximum(after - 1, 0)]
+    nxt = known[np.minimum(after, len(known) - 1)]
+    has_prev = (after > 0) & (codes[prev] == codes[positions])
+    has_next = (after < len(known)) & (codes[nxt] == codes[positions])
+
+    filled = np.full(len(positions), np.nan)
+    both = has_prev & has_next
+    left, right = prev[both], nxt[both]
+    filled[both] = values[left] + (values[right] - values[left]) * (positions[both] - left) / (right - left)
+    only_prev = has_prev & ~has_next
+    filled[only_prev] = values[prev[only_prev]]
+    values[positions] = filled
+    return values
+
+def pivot_readings(readings):
+    """
+    Pivot dữ liệu dạng dài thành mảng rộng sắp xếp theo (sensor_id, recorded_time).
+
+    Sắp xếp bằng một argsort trên khoá int64 gộp (mã sensor, thời gian), rồi
+    gom giá trị từng biến bằng np.bincount (trung bình khi một sensor có nhiều
+    lần đọc cùng thời điểm, bỏ qua NaN) thay cho groupby().mean().unstack().
+
+    Args:
+        readings: DataFrame LONG_FORMAT_COLUMNS, variable là Categorical
+
+    Returns:
+        (mã sensor, sensor_id, thời gian datetime64, {mã biến: mảng giá trị})
+        cho mỗi hàng (sensor_id, recorded_time)
+    """
+    codes, sensors = pd.factorize(readings['sensor_id'], sort=True)
+    times = datetime_values(readings['recorded_time'])
+    ticks = times.view(np.int64)
+    if len(ticks) == 0:
+        return codes, np.asarray(sensors)[codes], times, {}
+
+    t_min = int(ticks.min())
+    span = int(ticks.max()) - t_min + 1
+    if len(sensors) * span < 2 ** 62:
+        key = codes.astype(np.int64) * span + (ticks - t_min)
+        order = np.argsort(key, kind='stable')
+        key = key[order]
+        new_row = np.r_[True, key[1:] != key[:-1]]
+    else:
+        order = np.lexsort((ticks, codes))
+        new_row = np.r_[True, (codes[order][1:] != codes[order][:-1]) | (ticks[order][1:] != ticks[order][:-1])]
+    row_id = np.cumsum(new_row) - 1
+    n_rows = int(row_id[-1]) + 1
+
+    var_codes = readings['variable'].cat.codes.to_numpy()[order]
+    value = readings['value'].to_numpy(dtype=np.float64)[order]
+    present = ~np.isnan(value)
+    columns = {}
+    for code in range(len(readings['variable'].cat.categories)):
+        mask = (var_codes == code) & present
+        counts = np.bincount(row_id[mask], minlength=n_rows)
+        sums = np.bincount(row_id[mask], weights=value[mask], minlength=n_rows)
+        columns[code] = np.divide(sums, counts, out=np.full(n_rows, np.nan), where=counts > 0)
+
+    first = order[new_row]
+    return codes[first], np.asarray(sensors)[codes[first]], times[first], columns
+
+def build_sensor_features(readings, variables, compact=False, resample=None, rolling_windows=None):
+    """
+    Đặc trưng chưa scale cho một hoặc nhiều sensor từ dữ liệu dạng dài
+    (hàm cấp module để chạy được trong ProcessPoolExecutor).
+
+    Dữ liệu được pivot thành một hàng cho mỗi (sensor_id, recorded_time), mỗi
+    biến một cột (pivot_readings). Nội suy, lọc outlier, trễ, chênh lệch và
+    đếm chuỗi không đổi được tính theo nhóm trên mảng đã sắp xếp: ranh giới
+    sensor ngắt mọi chuỗi nên giá trị của sensor này không lọt vào đặc trưng
+    của sensor khác.
+
+    Args:
+        readings: DataFrame LONG_FORMAT_COLUMNS, variable là Categorical với
+            categories = variables
+        variables: Danh sách biến (biến không có trong readings để NaN)
+        compact: Dùng float32/int8/bool như SensorDataProcessor(compact=True)
+        resample: Tham số resample_long (freq, how, max_gap, open_from) để gộp
+            mỗi chuỗi (sensor, biến) vào bucket trước khi tạo đặc trưng
+        rolling_windows: Cửa sổ cho khối thống kê trượt của từng biến (None: không tạo)
+    """
+    if resample is not None:
+        readings = resample_long(readings, *resample)
+    codes, sensor_ids, times, columns = pivot_readings(readings)
+    n_groups = codes.max() + 1 if len(codes) else 0
+
+    # Xử lý giá trị thiếu và outlier cho từng biến; chỉ loại hàng theo các
+    # biến mà sensor đó có đo (sensor chỉ đo nhiệt độ vẫn được giữ)
+    keep = np.ones(len(codes), dtype=bool)
+    values = {}
+    for code, variable in enumerate(variables):
+        series = columns.get(code, np.full(len(codes), np.nan))
+        missing = np.isnan(series)
+        reported = np.bincount(codes, weights=~missing, minlength=n_groups) > 0
+        if missing.any():
+            series = interpolate_grouped(series, missing, codes)
+        low, high = VALUE_RANGES.get(variable, (-np.inf, np.inf))
+        keep &= ((series >= low) & (series <= high)) | ~reported[codes]
+        values[variable] = series
+
+    rows = np.flatnonzero(keep)
+    codes = codes[rows]
+    # Đặc trưng trễ cần 3 giá trị trước trong cùng sensor
+    valid = np.flatnonzero(group_positions(codes) >= 3)
+
+    # Chuỗi giá trị không đổi của biến chính, đếm lại từ đầu ở mỗi sensor
+    primary = values['temperature' if 'temperature' in values else variables[0]][rows]
+    unchanged = np.zeros(len(valid), dtype=np.int8)
+    if len(valid) > 1:
+        same_sensor = codes[valid[1:]] == codes[valid[:-1]]
+        unchanged[1:] = same_sensor & (np.abs(np.diff(primary[valid])) < 0.01)
+    final = valid[run_lengths(unchanged) <= MAX_DUP_RUN]
+
+    series_times = times[rows]
+    times = series_times[final]
+    columns = {
+        'recorded_time': times,
+        'sensor_id': sensor_ids[rows[final]]
+    }
+    float_dtype = COMPACT_FLOAT if compact else np.float64
+    lagged = {}
+    for variable in variables:
+        series = values[variable][rows].astype(float_dtype, copy=False)
+        columns[variable] = series[final]
+        names = variable_features(variable)
+        for lag, name in zip([1, 2, 3], names[1:4]):
+            lagged[name] = series[final - lag]
+        lagged[names[4]] = columns[variable] - lagged[names[1]]
+        lagged[names[5]] = lagged[names[4]] - (lagged[names[1]] - lagged[names[2]])
+        if rolling_windows:
+            rolling = rolling_features(series_times, values[variable][rows], rolling_windows,
+                                       codes, variable_prefix(variable))
+            for name, feature in rolling.items():
+                lagged[name] = feature[final].astype(float_dtype, copy=False)
+    columns.update(time_feature_columns(times, COMPACT_INT if compact else np.int32))
+    columns.update(lagged)
+    return pd.DataFrame(columns, copy=False)
+
+def resample_buckets(codes, times, values, freq, how='mean', max_gap=RESAMPLE_MAX_GAP,
+                     open_from=None, previous=None):
+    """
+    Gộp chuỗi đã sắp xếp theo (codes, times) vào các bucket thời gian cố định
+    (ví dụ '15min'), độc lập trong từng nhóm codes, bằng ufunc.reduceat một lượt.
+
+    Giá trị NaN bị bỏ qua khi gộp. Khoảng trống tối đa max_gap bucket trong cùng
+    nhóm được giữ thành bucket NaN (bước nội suy sau đó điền vào); khoảng trống
+    dài hơn không tạo bucket nào để không bịa dữ liệu.
+
+    Args:
+        codes: Mã nhóm của từng hàng (toàn 0 cho một chuỗi)
+        times: Mảng datetime64 đã sắp xếp trong từng nhóm
+        values: Mảng float64
+        freq: Độ dài bucket (chuỗi pandas như '15min' hoặc Timedelta)
+        how: Một trong RESAMPLE_AGGREGATIONS
+        max_gap: Số bucket trống liên tiếp tối đa được điền NaN
+        open_from: Bỏ bucket chứa thời điểm này và các bucket sau (bucket còn mở)
+        previous: Bucket cuối của lần xử lý trước (chỉ dùng với một nhóm), để
+            điền khoảng trống giữa hai lần xử lý tăng dần
+
+    Returns:
+        (codes, thời điểm đầu bucket datetime64, giá trị) của từng bucket
+    """
+    if how not in RESAMPLE_AGGREGATIONS:
+        raise ValueError(f"Cách gộp không hợp lệ: {how} (chọn trong {RESAMPLE_AGGREGATIONS})")
+    unit = np.datetime_data(times.dtype)[0]
+    step = int(pd.Timedelta(freq) / pd.Timedelta(1, unit=unit))
+
+    present = ~np.isnan(values)
+    codes, values = codes[present], values[present]
+    buckets = np.floor_divide(times.view(np.int64)[present], step)
+    if open_from is not None:
+        closed = buckets < np.floor_divide(np.datetime64(open_from, unit).astype(np.int64), step)
+        codes, buckets, values = codes[closed], buckets[closed], values[closed]
+    n = len(values)
+    if n == 0:
+        return codes, np.array([], dtype=f'datetime64[{unit}]'), values
+
+    starts = np.flatnonzero(np.r_[True, (codes[1:] != codes[:-1]) | (buckets[1:] != buckets[:-1])])
+    ends = np.append(starts[1:], n)
+    if how == 'mean':
+        agg = np.add.reduceat(values, starts) / (ends - starts)
+    elif how == 'min':
+        agg = np.minimum.reduceat(values, starts)
+    elif how == 'max':
+        agg = np.maximum.reduceat(values, starts)
+    else:
+        agg = values[ends - 1]
+    out_codes, out_buckets = codes[starts], buckets[starts]
+
+    # Bucket trống ngay sau mỗi bucket trong cùng nhóm; chỉ điền khoảng trống ngắn
+    missing = np.zeros(len(starts), dtype=np.int64)
+    missing[:-1] = np.where(out_codes[1:] == out_codes[:-1], np.diff(out_buckets) - 1, 0)
+    if max_gap is not None:
+        missing[missing > max_gap] = 0
+    repeats = missing + 1
+    source = np.repeat(np.arange(len(starts)), repeats)
+    offset = np.arange(len(source)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    result_codes = out_codes[source]
+    result_buckets = out_buckets[source] + offset
+    result_values = np.where(offset == 0, agg[source], np.nan)
+
+    if previous is not None:
+        lead = int(out_buckets[0] - np.floor_divide(np.datetime64(previous, unit).astype(np.int64), step) - 1)
+        if 0 < lead and (max_gap is None or lead <= max_gap):
+            result_codes = np.r_[np.full(lead, out_codes[0]), result_codes]
+            result_buckets = np.r_[np.arange(out_buckets[0] - lead, out_buckets[0]), result_buckets]
+            result_values = np.r_[np.full(lead, np.nan), result_values]
+    return result_codes, (result_buckets * step).astype(f'datetime64[{unit}]'), result_values
+
+def resample_long(readings, freq, how='mean', max_gap=RESAMPLE_MAX_GAP, open_from=None):
+    """
+    resample_buckets cho dữ liệu dạng dài: mỗi (sensor_id, variable) một chuỗi.
+    Giá trị ngoài VALUE_RANGES được bỏ trước khi gộp để outlier không lẫn vào
+    trung bình của bucket.
+    """
+    readings = readings[readings['variable'].cat.codes.to_numpy() >= 0]
+    variables = list(readings['variable'].cat.categories)
+    codes, sensors = pd.factorize(readings['sensor_id'], sort=True)
+    var_codes = readings['variable'].cat.codes.to_numpy().astype(np.int64)
+    times = datetime_values(readings['recorded_time'])
+    values = readings['value'].to_numpy(dtype=np.float64)
+
+    lows = np.array([VALUE_RANGES.get(v, (-np.inf, np.inf))[0] for v in variables])
+    highs = np.array([VALUE_RANGES.get(v, (-np.inf, np.inf))[1] for v in variables])
+    values = np.where((values >= lows[var_codes]) & (values <= highs[var_codes]), values, np.nan)
+
+    order = np.lexsort((times, codes, var_codes))
+    groups = var_codes[order] * max(len(sensors), 1) + codes[order]
+    groups, bucket_times, agg = resample_buckets(groups, times[order], values[order], freq, how,
+                                                 max_gap, open_from)
+    return pd.DataFrame({
+        'recorded_time': bucket_times,
+        'sensor_id': np.asarray(sensors)[groups % max(len(sensors), 1)],
+        'variable': pd.Categorical.from_codes(groups // max(len(sensors), 1), categories=variables),
+        'value': agg
+    })
+
+def sensor_batches(codes, n_batches):
+    """
+    Chia chỉ số hàng thành n_batches lô gồm các sensor nguyên vẹn, số hàng mỗi
+    lô xấp xỉ bằng nhau.
+    """
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes)
+    # Sensor thuộc lô theo vị trí hàng đầu tiên của nó trong thứ tự đã sắp xếp
+    first_row = np.cumsum(counts) - counts
+    batch_of_sensor = first_row * n_batches // max(len(codes), 1)
+    bounds = np.searchsorted(batch_of_sensor, np.arange(n_batches + 1))
+    row_bounds = np.append(first_row, len(codes))[bounds]
+    return [order[start:end] for start, end in zip(row_bounds[:-1], row_bounds[1:]) if end > start]
+
+def horizon_target(times, temps, current, h, max_gap_minutes):
+    """
+    Nhiệt độ nội suy tại current + h phút trên chuỗi (times, temps) đã sắp xếp
+    (thời gian tính bằng giây); NaN khi rơi ra ngoài chuỗi hoặc vào khoảng trống
+    dài hơn max_gap_minutes.
+    """
+    target_time = current + h * 60
+    values = np.interp(target_time, times, temps)
+    # Khoảng thời gian giữa hai lần đọc bao quanh mốc dự báo
+    right = np.clip(np.searchsorted(times, target_time, side='left'), 0, len(times) - 1)
+    left = np.clip(right - 1, 0, len(times) - 1)
+    exact = times[right] == target_time
+    gap = np.where(exact, 0, times[right] - times[left])
+    valid = (target_time <= times[-1]) & (gap <= max_gap_minutes * 60)
+    return np.where(valid, values, np.nan)
+
+def window_label(window):
+    """Nhãn cửa sổ trong tên cột: '15min' -> '15m', '1h' -> '1h'"""
+    minutes = pd.Timedelta(window) / pd.Timedelta(minutes=1)
+    if minutes >= 60 and minutes % 60 == 0:
+        return f'{int(minutes // 60)}h'
+    return f'{minutes:g}m'
+
+def rolling_feature_names(windows=ROLLING_WINDOWS, prefix='temp'):
+    return [f'{prefix}_{stat}_{window_label(window)}' for window in windows for stat in ROLLING_STATS]
+
+def window_stats(count, su, suu, sv, svv, suv):
+    """
+    mean, std (ddof=0) và slope (đơn vị/giây) của một cửa sổ từ các tổng:
+    số phần tử, Σu, Σu², Σv, Σv², Σuv (mảng) với u là thời gian tương đối so
+    với lần đọc hiện tại. RollingState.update dùng cùng công thức cho số vô hướng.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sv / count
+        std = np.sqrt(np.maximum(svv / count - mean * mean, 0.0))
+        denom = count * suu - su * su
+        slope = np.where(denom > 0, (count * suv - su * sv) / np.where(denom > 0, denom, 1.0), 0.0)
+    return mean, std, slope
+
+def window_extreme(values, starts, ufunc):
+    """
+    ufunc (np.fmax / np.fmin) trên đoạn [starts[i], i] cho mọi i.
+
+    Bảng nhân đôi: mức k giữ cực trị của 2^k phần tử kết thúc tại mỗi vị trí,
+    đoạn độ dài L được phủ bởi hai khối 2^k với k = floor(log2 L). Chi phí
+    O(n log w) với w là số phần tử lớn nhất trong một cửa sổ, hoàn toàn vector hoá.
+    """
+    n = len(values)
+    lengths = np.arange(n) - starts + 1
+    levels = np.floor(np.log2(np.maximum(lengths, 1))).astype(np.int64)
+    result = np.empty(n, dtype=np.float64)
+    table = values.astype(np.float64)
+    for k in range(int(levels.max()) + 1 if n else 0):
+        if k > 0:
+            half = 1 << (k - 1)
+            table = np.concatenate([table[:half], ufunc(table[half:], table[:-half])])
+        rows = np.flatnonzero(levels == k)
+        result[rows] = ufunc(table[rows], table[starts[rows] + (1 << k) - 1])
+    return result
+
+def rolling_features(times, values, windows=ROLLING_WINDOWS, codes=None, prefix='temp'):
+    """
+    Thống kê trượt theo thời gian trên cửa sổ (t - w, t] cho mọi hàng của chuỗi
+    đã sắp xếp: mean, std, min, max và slope (đơn vị/giờ, hồi quy tuyến tính
+    theo thời gian). codes (mã sensor, đã sắp xếp theo nhóm) ngắt cửa sổ ở
+    ranh giới sensor; NaN bị bỏ qua.
+
+    mean/std/slope lấy từ hiệu của tổng tích luỹ nên mỗi cửa sổ tốn O(n) bất kể
+    độ rộng. Tổng theo thời gian là số nguyên (giây, hoặc phút nếu có nguy cơ
+    tràn int64) tính tương đối so với lần đọc hiện tại, nên không mất chính xác
+    khi chuỗi dài; giá trị được trừ trung bình toàn chuỗi trước khi cộng dồn.
+
+    Returns:
+        {tên cột: mảng float64}
+    """
+    n = len(values)
+    names = rolling_feature_names(windows, prefix)
+    if n == 0:
+        return {name: np.zeros(0) for name in names}
+    codes = np.zeros(n, dtype=np.int64) if codes is None else np.asarray(codes, dtype=np.int64)
+    group_start = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    first = np.repeat(group_start, np.diff(np.append(group_start, n)))
+
+    # Thời gian số nguyên tính từ lần đọc đầu của mỗi nhóm
+    unit = np.datetime_data(times.dtype)[0]
+    ticks = times.view(np.int64)
+    per_second = max(int(pd.Timedelta(seconds=1) / pd.Timedelta(1, unit=unit)), 1)
+    t = (ticks - ticks[first]) // per_second
+    seconds_per_unit = 1
+    if n * int(t.max()) ** 2 >= 2 ** 62:
+        t //= 60
+        seconds_per_unit = 60
+
+    valid = ~np.isnan(values)
+    center = float(values[valid].mean()) if valid.any() else 0.0
+    v = np.where(valid, values - center, 0.0)
+    tv = np.where(valid, t, 0)
+
+    def prefix_sum(a):
+        out = np.zeros(n + 1, dtype=a.dtype)
+        np.cumsum(a, out=out[1:])
+        return out
+
+    count_p = prefix_sum(valid.astype(np.int64))
+    t_p, tt_p = prefix_sum(tv), prefix_sum(tv * tv)
+    v_p, vv_p, tv_p = prefix_sum(v), prefix_sum(v * v), prefix_sum(tv * v)
+
+    columns = {}
+    end = np.arange(1, n + 1)
+    span = int(t.max()) + 1
+    for window in windows:
+        width = int(pd.Timedelta(window).total_seconds()) // seconds_per_unit
+        # Khoá (nhóm, thời gian) cách nhau hơn một cửa sổ giữa các nhóm
+        key = codes * (span + width + 1) + t
+        starts = np.searchsorted(key, key - width, side='right')
+
+        count = (count_p[end] - count_p[starts]).astype(np.float64)
+        st = t_p[end] - t_p[starts]
+        stt = tt_p[end] - tt_p[starts]
+        # Σu, Σu² với u = t_j - t_i: số nguyên chính xác
+        su = st - (count_p[end] - count_p[starts]) * t
+        suu = stt - 2 * t * st + (count_p[end] - count_p[starts]) * t * t
+        sv = v_p[end] - v_p[starts]
+        suv = (tv_p[end] - tv_p[starts]) - t * sv
+        mean, std, slope = window_stats(count, su.astype(np.float64), suu.astype(np.float64),
+                                        sv, vv_p[end] - vv_p[starts], suv)
+        label = window_label(window)
+        empty = count == 0
+        columns[f'{prefix}_mean_{label}'] = np.where(empty, np.nan, mean + center)
+        columns[f'{prefix}_std_{label}'] = np.where(empty, np.nan, std)
+        columns[f'{prefix}_min_{label}'] = window_extreme(values, starts, np.fmin)
+        columns[f'{prefix}_max_{label}'] = window_extreme(values, starts, np.fmax)
+        columns[f'{prefix}_slope_{label}'] = np.where(empty, np.nan, slope * 3600 / seconds_per_unit)
+    return {name: columns[name] for name in names}
+
+class RollingState:
+    """
+    Trạng thái thống kê trượt của một chuỗi để tính đặc trưng cho từng lần đọc
+    mới (tiền xử lý tăng dần hoặc suy luận) mà không tính lại cả chuỗi; cho
+    cùng giá trị với rolling_features, chỉ khác nhau do làm tròn (std/slope của
+    cửa sổ rất ít lần đọc có thể lệch cỡ 1e-6 vì tổng tích luỹ toàn chuỗi của
+    rolling_features).
+
+    Mỗi cửa sổ giữ các lần đọc trong cửa sổ cùng tổng chạy (mean/std/slope) và
+    hai deque đơn điệu cho min/max: O(1) khấu hao cho mỗi lần đọc. Giống
+    rolling_features, giá trị được trừ một giá trị tham chiếu (center) trước khi
+    cộng dồn để Σv² không triệt tiêu khi tính std (nhiệt độ ~20 °C). Tổng chạy
+    được tính lại từ nội dung cửa sổ (với gốc thời gian và center mới) sau mỗi
+    vòng cửa sổ để sai số cộng/trừ không tích luỹ.
+    """
+
+    def __init__(self, windows=ROLLING_WINDOWS, prefix='temp'):
+        self.windows = list(windows)
+        self.prefix = prefix
+        self.widths = [pd.Timedelta(window).total_seconds() for window in self.windows]
+        self.labels = [window_label(window) for window in self.windows]
+        self.anchor = None
+        self.center = None
+        self.items = [deque() for _ in self.windows]
+        # Số phần tử, Σt, Σt², Σv, Σv², Σtv của từng cửa sổ (v = giá trị - center)
+        self.sums = [[0.0] * 6 for _ in self.windows]
+        self.max_q = [deque() for _ in self.windows]
+        self.min_q = [deque() for _ in self.windows]
+        self.since_resync = 0
+
+    def update(self, time, value):
+        """Thêm một lần đọc (theo thứ tự thời gian), trả về {tên cột: giá trị} tại lần đọc đó"""
+        now = pd.Timestamp(time).value / 1e9
+        if self.anchor is None:
+            self.anchor = now
+        t = now - self.anchor
+        value = float(value)
+        if self.center is None:
+            self.center = value
+        v = value - self.center
+        row = (1.0, t, t * t, v, v * v, t * v)
+        features = {}
+        for k, width in enumerate(self.widths):
+            items, sums, max_q, min_q = self.items[k], self.sums[k], self.max_q[k], self.min_q[k]
+            items.append((t, value))
+            for i in range(6):
+                sums[i] += row[i]
+            while items[0][0] <= t - width:
+                old_t, old_value = items.popleft()
+                old_v = old_value - self.center
+                old = (1.0, old_t, old_t * old_t, old_v, old_v * old_v, old_t * old_v)
+                for i in range(6):
+                    sums[i] -= old[i]
+            while max_q and max_q[-1][1] <= value:
+                max_q.pop()
+            max_q.append((t, value))
+            while max_q[0][0] <= t - width:
+                max_q.popleft()
+            while min_q and min_q[-1][1] >= value:
+                min_q.pop()
+            min_q.append((t, value))
+            while min_q[0][0] <= t - width:
+                min_q.popleft()
+
+            # Cùng công thức với window_stats, u = t_j - t
+            count, st, stt, sv, svv, stv = sums
+            su, suu, suv = st - count * t, stt - 2 * t * st + count * t * t, stv - t * sv
+            mean = sv / count
+            denom = count * suu - su * su
+            label = self.labels[k]
+            features[f'{self.prefix}_mean_{label}'] = mean + self.center
+            features[f'{self.prefix}_std_{label}'] = math.sqrt(max(svv / count - mean * mean, 0.0))
+            features[f'{self.prefix}_min_{label}'] = min_q[0][1]
+            features[f'{self.prefix}_max_{label}'] = max_q[0][1]
+            features[f'{self.prefix}_slope_{label}'] = (count * suv - su * sv) / denom * 3600 if denom > 0 else 0.0
+
+        self.since_resync += 1
+        if self.since_resync > max(len(items) for items in self.items):
+            self.resync()
+        return features
+
+    def resync(self):
+        """
+        Đặt gốc thời gian về lần đọc cũ nhất còn giữ, center về giá trị của lần
+        đọc mới nhất (gần giá trị của các cửa sổ sắp tới) và tính lại tổng chạy
+        """
+        oldest = min(items[0][0] for items in self.items if items)
+        self.anchor += oldest
+        self.center = self.items[0][-1][1]
+        for k, items in enumerate(self.items):
+            shifted = deque((t - oldest, v) for t, v in items)
+            self.items[k] = shifted
+            self.max_q[k] = deque((t - oldest, v) for t, v in self.max_q[k])
+            self.min_q[k] = deque((t - oldest, v) for t, v in self.min_q[k])
+            values = np.array(shifted, dtype=np.float64).reshape(-1, 2)
+            ts, vs = values[:, 0], values[:, 1] - self.center
+            self.sums[k] = [float(len(ts)), ts.sum(), (ts * ts).sum(), vs.sum(), (vs * vs).sum(), (ts * vs).sum()]
+        self.since_resync = 0
+
+    def to_dict(self):
+        """Trạng thái dạng JSON: các lần đọc trong cửa sổ lớn nhất"""
+        largest = int(np.argmax(self.widths))
+        readings = [[(pd.Timestamp(self.anchor + t, unit='s')).isoformat(), v] for t, v in self.items[largest]]
+        return {'windows': self.windows, 'prefix': self.prefix, 'readings': readings}
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data['windows'], data['prefix'])
+        for time, value in data['readings']:
+            state.update(time, value)
+        return state
+
+    @classmethod
+    def from_series(cls, times, values, windows=ROLLING_WINDOWS, prefix='temp'):
+        """Trạng thái sau lần đọc cuối của chuỗi (chỉ phát lại phần nằm trong cửa sổ lớn nhất)"""
+        state = cls(windows, prefix)
+        if len(times):
+            times = datetime_values(times)
+            start = np.searchsorted(times, times[-1] - pd.Timedelta(max(windows, key=pd.Timedelta)), side='right')
+            for time, value in zip(times[start:], values[start:]):
+                state.update(time, value)
+        return state
+
+class CsvTimeIndex:
+    """
+    Đọc nhanh thời gian ở các vị trí byte bất kỳ của file CSV
+    (dòng đầu là header, mỗi bản ghi nằm trên một dòng).
+    """
+
+    def __init__(self, path, time_col='recorded_time'):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.f = open(path, 'rb')
+        self.header = next(csv.reader([self.f.readline().decode('utf-8-sig')]))
+        self.data_start = self.f.tell()
+        self.time_idx = self.header.index(time_col)
+
+    def close(self):
+        self.f.close()
+
+    def line_time(self, line):
+        fields = next(csv.reader([line.decode('utf-8')]), None)
+        if not fields or len(fields) <= self.time_idx:
+            return None
+        try:
+            return pd.Timestamp(fields[self.time_idx])
+        except ValueError:
+            return None
+
+    def time_after(self, offset):
+        """(vị trí đầu dòng, thời gian) của dòng đầu tiên bắt đầu sau offset"""
+        self.f.seek(offset)
+        if offset > self.data_start:
+            self.f.readline()  # Bỏ phần dòng bị cắt
+        while True:
+            start = self.f.tell()
+            line = self.f.readline()
+            if not line:
+                return start, None
+            if line.strip():
+                return start, self.line_time(line)
+
+    def first_time(self):
+        return self.time_after(self.data_start)[1]
+
+    def last_time(self, block=64 * 1024):
+        """Thời gian của dòng không rỗng cuối cùng, đọc ngược từ cuối file"""
+        end = self.size
+        tail = b''
+        while end > self.data_start:
+            start = max(self.data_start, end - block)
+            self.f.seek(start)
+            tail = self.f.read(end - start) + tail
+            lines = [line for line in tail.splitlines() if line.strip()]
+            if len(lines) > 1 or start == self.data_start:
+                return self.line_time(lines[-1]) if lines else None
+            end = start
+        return None
+
+    def looks_sorted(self, probes=SORTED_PROBES):
+        """Lấy mẫu thời gian ở các vị trí cách đều và kiểm tra không giảm"""
+        step = max((self.size - self.data_start) // probes, 1)
+        times = [self.first_time()]
+        times += [self.time_after(self.data_start + i * step)[1] for i in range(1, probes)]
+        times.append(self.last_time())
+        times = [t for t in times if t is not None]
+        return len(times) > 1 and all(a <= b for a, b in zip(times, times[1:]))
+
+    def seek_time(self, min_time, block=64 * 1024):
+        """
+        Tìm kiếm nhị phân theo byte: trả về vị trí đầu dòng mà mọi dòng
+        trước đó đều cũ hơn min_time (giả định file đã sắp xếp theo thời gian).
+        """
+        lo, hi = self.data_start, self.size
+        while hi - lo > block:
+            mid = (lo + hi) // 2
+            _, t = self.time_after(mid)
+            if t is None or t >= min_time:
+                hi = mid
+            else:
+                lo = mid
+        return self.time_after(lo)[0]
+
 class SensorDataProcessor:
     
-    def __init__(self, data_path=None, db_config=None, filter_hours=24):
+    def __init__(self, data_path=None, db_config=None, filter_hours=24, compact=False, n_jobs=1,
+                 resample=None, resample_how='mean', max_gap=RESAMPLE_MAX_GAP, rolling_windows=None):
         
         self.data_path = data_path
         self.db_config = db_config
         self.filter_hours = filter_hours
+        # compact=True: frame đã xử lý dùng float32/int8/bool thay vì float64/int32
+        self.compact = compact
+        # Số tiến trình xử lý song song các sensor của dữ liệu dạng dài (-1: mọi CPU)
+        self.n_jobs = n_jobs
+        # Resample trước khi tạo đặc trưng (ví dụ '15min'); None: dùng từng lần đọc
+        self.resample = resample
+        self.resample_how = resample_how
+        self.max_gap = max_gap
+        # Cửa sổ của khối thống kê trượt (ví dụ ROLLING_WINDOWS); None: không tạo
+        self.rolling_windows = list(rolling_windows) if rolling_windows else None
+        self.memory_report = None
         self.scaler_temp = MinMaxScaler()
         self.raw_data = None
         self.processed_data = None
+        # Trạng thái cuối chuỗi dùng cho tiền xử lý tăng dần (xem preprocess_incremental)
+        self.state = None
         
-    def load_data(self):
+    def load_data(self, usecols=None, time_sorted=None, chunksize=CSV_CHUNKSIZE):
+        """
+        Tải dữ liệu từ CSV (data_path) hoặc PostgreSQL (db_config).
+
+        CSV được đọc theo chunk, chỉ giữ các bản ghi trong cửa sổ filter_hours
+        gần nhất nên bộ nhớ tỉ lệ với cửa sổ chứ không phải kích thước file.
+
+        Args:
+            usecols: Cột cần đọc (mặc định CSV_COLUMNS có trong header)
+            time_sorted: File đã sắp xếp theo thời gian? None = tự đoán bằng
+                cách lấy mẫu; True cho phép seek thẳng đến đuôi file
+            chunksize: Số dòng mỗi chunk
+        """
         if self.data_path and os.path.exists(self.data_path):
             logger.info(f"Đang tải dữ liệu từ CSV: {self.data_path}")
-            self.raw_data = pd.read_csv(self.data_path)
+            self.raw_data = self.load_csv_window(usecols, time_sorted, chunksize)
             logger.info(f"Đã tải dữ liệu: {len(self.raw_data)} bản ghi")
-            # Lọc dữ liệu chỉ lấy filter_hours gần nhất nếu có cột thời gian
-            if 'recorded_time' in self.raw_data.columns:
-                self.raw_data['recorded_time'] = pd.to_datetime(self.raw_data['recorded_time'])
-                max_time = self.raw_data['recorded_time'].max()
-                min_time = max_time - pd.Timedelta(hours=self.filter_hours)
-                self.raw_data = self.raw_data[self.raw_data['recorded_time'] >= min_time]
-                logger.info(f"Đã lọc dữ liệu {self.filter_hours} giờ gần nhất: {len(self.raw_data)} bản ghi")
-                # Kiểm tra số lượng bản ghi sau khi lọc
-                if len(self.raw_data) < 10:
-                    logger.warning(f"Dữ liệu sau khi lọc còn quá ít ({len(self.raw_data)} bản ghi). Tiếp tục pipeline nhưng cần kiểm tra chất lượng dữ liệu đầu vào.")
+            # Kiểm tra số lượng bản ghi sau khi lọc
+            if 'recorded_time' in self.raw_data.columns and len(self.raw_data) < 10:
+                logger.warning(f"Dữ liệu sau khi lọc còn quá ít ({len(self.raw_data)} bản ghi). Tiếp tục pipeline nhưng cần kiểm tra chất lượng dữ liệu đầu vào.")
             return True
             
         elif self.db_config:
             try:
-                # Tham số kết nối sẽ lấy từ db_config
-                import psycopg2
-                from psycopg2 import sql
-                
-                logger.info("Đang kết nối đến cơ sở dữ liệu PostgreSQL")
-                conn = psycopg2.connect(
-                    user=self.db_config['user'],
-                    password=self.db_config['password'],
-                    host=self.db_config['host'],
-                    port=self.db_config['port'],
-                    database=self.db_config['database']
-                )
-                
-                # Ví dụ truy vấn để lấy dữ liệu nhiệt độ và độ ẩm
-                query = """
-                SELECT s.recorded_time, sd1.svalue as temperature 
-                FROM sensor_data sd1
-                JOIN sensor s1 ON sd1.sensor_id = s1.sensor_id
-                WHERE s1.sensor_type = 'Temperature'
-                ORDER BY sd1.recorded_time DESC
-                LIMIT 10000;
-                """
-                
-                logger.info("Đang thực thi truy vấn")
-                self.raw_data = pd.read_sql_query(query, conn)
-                conn.close()
+                self.raw_data = self.load_db_window()
                 logger.info(f"Đã tải dữ liệu: {len(self.raw_data)} bản ghi")
                 return True
                 
@@ -89,6 +911,126 @@ class SensorDataProcessor:
             logger.error("Không có nguồn dữ liệu được cung cấp")
             return False
     
+    def load_csv_window(self, usecols=None, time_sorted=None, chunksize=CSV_CHUNKSIZE):
+        """
+        Đọc CSV theo chunk và chỉ giữ filter_hours gần nhất (tính từ bản ghi mới nhất).
+
+        Với file lớn đã sắp xếp theo thời gian, đọc thời gian ở cuối file rồi
+        tìm kiếm nhị phân theo byte để bắt đầu đọc ngay tại đầu cửa sổ.
+        """
+        with open(self.data_path, 'r', encoding='utf-8-sig') as f:
+            header = next(csv.reader([f.readline()]), [])
+        default_columns = LONG_FORMAT_COLUMNS if all(col in header for col in LONG_FORMAT_COLUMNS) else CSV_COLUMNS
+        columns = [col for col in (usecols or default_columns) if col in header]
+        if not columns:
+            columns = header
+        dtypes = {col: dtype for col, dtype in CSV_DTYPES.items() if col in columns}
+
+        if 'recorded_time' not in columns:
+            return pd.read_csv(self.data_path, usecols=columns, dtype=dtypes)
+        window = pd.Timedelta(hours=self.filter_hours) if self.filter_hours else None
+
+        # Bắt đầu đọc từ đầu cửa sổ nếu file đủ lớn và đã sắp xếp theo thời gian
+        start_offset = None
+        if window is not None and os.path.getsize(self.data_path) >= TAIL_SEEK_MIN_BYTES:
+            index = CsvTimeIndex(self.data_path)
+            try:
+                if time_sorted is None:
+                    time_sorted = index.looks_sorted()
+                if time_sorted:
+                    last_time = index.last_time()
+                    if last_time is not None:
+                        start_offset = index.seek_time(last_time - window)
+                        logger.info(f"File đã sắp xếp theo thời gian, bắt đầu đọc tại byte {start_offset}/{index.size}")
+            finally:
+                index.close()
+
+        kept = []
+        max_time = None
+        time_format = None
+        n_read = 0
+        with open(self.data_path, 'rb') as f:
+            if start_offset is not None:
+                f.seek(start_offset)
+                reader = pd.read_csv(f, names=header, header=None, usecols=columns,
+                                     dtype=dtypes, chunksize=chunksize, encoding='utf-8')
+            else:
+                reader = pd.read_csv(f, usecols=columns, dtype=dtypes,
+                                     chunksize=chunksize, encoding='utf-8-sig')
+            for chunk in reader:
+                n_read += len(chunk)
+                if time_format is None and len(chunk):
+                    time_format = guess_time_format(chunk['recorded_time'].iloc[0])
+                chunk['recorded_time'] = parse_times(chunk['recorded_time'], time_format)
+                chunk = chunk[columns]
+                if window is None:
+                    kept.append(chunk)
+                    continue
+
+                chunk_max = chunk['recorded_time'].max()
+                if pd.notna(chunk_max) and (max_time is None or chunk_max > max_time):
+                    max_time = chunk_max
+                    # Cửa sổ dịch chuyển: bỏ các phần đã giữ nay nằm ngoài cửa sổ
+                    kept = [part[part['recorded_time'] >= max_time - window] for part in kept]
+                if max_time is not None:
+                    chunk = chunk[chunk['recorded_time'] >= max_time - window]
+                if len(chunk):
+                    kept.append(chunk)
+
+        data = pd.concat(kept, ignore_index=True) if kept else pd.DataFrame(columns=columns)
+        logger.info(f"Đã đọc {n_read} dòng CSV theo chunk, giữ {len(data)} bản ghi")
+        if window is not None:
+            logger.info(f"Đã lọc dữ liệu {self.filter_hours} giờ gần nhất: {len(data)} bản ghi")
+        return data
+
+    def load_db_window(self, fetch_size=DB_FETCH_SIZE):
+        """
+        Đọc nhiệt độ trong cửa sổ filter_hours từ PostgreSQL qua server-side
+        cursor (named cursor + fetchmany), không giới hạn số bản ghi.
+
+        Mỗi lô được chuyển ngay thành mảng NumPy theo cột nên bộ nhớ chỉ gồm
+        dữ liệu trong cửa sổ cộng với một lô tuple đang xử lý.
+        """
+        # Tham số kết nối sẽ lấy từ db_config
+        import psycopg2
+
+        logger.info("Đang kết nối đến cơ sở dữ liệu PostgreSQL")
+        conn = psycopg2.connect(
+            user=self.db_config['user'],
+            password=self.db_config['password'],
+            host=self.db_config['host'],
+            port=self.db_config['port'],
+            database=self.db_config['database']
+        )
+        time_parts = []
+        temp_parts = []
+        try:
+            # Named cursor: kết quả nằm trên server, client kéo từng lô
+            with conn.cursor(name='sensor_window') as cursor:
+                cursor.itersize = fetch_size
+                logger.info("Đang thực thi truy vấn")
+                if self.filter_hours:
+                    cursor.execute(DB_WINDOW_QUERY, {'window_hours': self.filter_hours})
+                else:
+                    cursor.execute(DB_ALL_QUERY)
+                while True:
+                    rows = cursor.fetchmany(fetch_size)
+                    if not rows:
+                        break
+                    times, temps = zip(*rows)
+                    time_parts.append(np.array(times, dtype='datetime64[us]'))
+                    temp_parts.append(np.array(temps, dtype=np.float64))
+            conn.rollback()
+        finally:
+            conn.close()
+
+        data = pd.DataFrame({
+            'recorded_time': np.concatenate(time_parts) if time_parts else np.array([], dtype='datetime64[us]'),
+            'temperature': np.concatenate(temp_parts) if temp_parts else np.array([], dtype=np.float64)
+        })
+        logger.info(f"Đã đọc {len(data)} bản ghi trong {len(time_parts)} lô từ server-side cursor")
+        return data
+
     def preprocess_data(self):
         """
         Tiền xử lý dữ liệu cảm biến:
@@ -98,93 +1040,398 @@ class SensorDataProcessor:
         4. Thêm đặc trưng trễ (lag features)
         5. Loại bỏ giá trị trùng lặp
         6. Scale đặc trưng
+
+        Mọi bước được tính trên mảng NumPy trong một lượt (không sao chép
+        DataFrame trung gian); DataFrame kết quả chỉ được tạo một lần ở cuối.
+        Mỗi đặc trưng có MinMaxScaler riêng trong self.scalers.
         """
         if self.raw_data is None:
             logger.error("Chưa tải dữ liệu. Hãy gọi load_data() trước.")
             return False
+        if is_long_format(self.raw_data):
+            return self.preprocess_multi_sensor()
             
         logger.info("Bắt đầu tiền xử lý dữ liệu")
+        raw = self.raw_data
+        open_from = None
+        if self.resample and 'recorded_time' in raw.columns:
+            raw, open_from = self.resample_raw(raw)
+        temps = raw['temperature'].to_numpy(dtype=np.float64)
         
-        # Tạo bản sao để tránh thay đổi dữ liệu gốc
-        df = self.raw_data.copy()
-        
-        # Đảm bảo timestamp ở định dạng datetime
-        if 'recorded_time' in df.columns:
-            df['recorded_time'] = pd.to_datetime(df['recorded_time'])
-            # Sắp xếp theo timestamp
-            df = df.sort_values('recorded_time')
+        # Đảm bảo timestamp ở định dạng datetime và sắp xếp theo timestamp
+        all_times = None
+        order = None
+        if 'recorded_time' in raw.columns:
+            all_times = datetime_values(raw['recorded_time'])
+            if len(all_times) > 1 and not (all_times[1:] >= all_times[:-1]).all():
+                order = np.argsort(all_times, kind='stable')
+                temps = temps[order]
         else:
             logger.warning("Không tìm thấy cột timestamp")
             
         # Xử lý giá trị thiếu với nội suy tuyến tính
-        if df['temperature'].isna().any():
+        missing = np.isnan(temps)
+        if missing.any():
             logger.info("Xử lý giá trị thiếu bằng nội suy tuyến tính")
-            df['temperature'] = df['temperature'].interpolate(method='linear')
+            temps = interpolate_forward(temps, missing)
             
         # Loại bỏ các outlier rõ ràng (giá trị nằm ngoài khả năng)
         logger.info("Loại bỏ outlier")
-        df = df[(df['temperature'] >= -20) & (df['temperature'] <= 60)]
-        
-        # Thêm đặc trưng thời gian
-        if 'recorded_time' in df.columns:
-            logger.info("Thêm đặc trưng thời gian")
-            df['hour'] = df['recorded_time'].dt.hour
-            df['minute'] = df['recorded_time'].dt.minute
-            df['day_of_week'] = df['recorded_time'].dt.dayofweek
-            
-            # Tạo chuyên mục thời gian trong ngày
-            conditions = [
-                (df['hour'] >= 5) & (df['hour'] < 12),
-                (df['hour'] >= 12) & (df['hour'] < 17),
-                (df['hour'] >= 17) & (df['hour'] < 21),
-                (df['hour'] >= 21) | (df['hour'] < 5)
-            ]
-            categories = ['morning', 'afternoon', 'evening', 'night']
-            df['time_of_day'] = pd.Categorical(
-                np.select(conditions, categories, default='night'),
-                categories=categories,
-                ordered=True
-            )
-            
-            # One-hot encode cho time of day
-            time_dummies = pd.get_dummies(df['time_of_day'], prefix='time')
-            df = pd.concat([df, time_dummies], axis=1)
-        
-        # Thêm đặc trưng trễ (t-1, t-2)
+        rows = np.flatnonzero((temps >= -20) & (temps <= 60))
+        temps = temps[rows]
+        if order is not None:
+            rows = order[rows]
+        times = all_times[rows] if all_times is not None else None
+        other_cols = [col for col in raw.columns if col not in ('recorded_time', 'temperature')]
+
+        # Đặc trưng trễ cần 3 giá trị trước: bỏ 3 hàng đầu (tương đương dropna)
+        n = len(temps)
+        valid = np.arange(3, n) if n > 3 else np.arange(0)
+        for col in other_cols:
+            # Giữ hành vi dropna() cho các cột khác trong raw_data
+            valid = valid[pd.notna(raw[col].to_numpy()[rows[valid]])]
+
+        # Loại bỏ các giá trị trùng lặp liên tiếp (nhiều hơn 3 lần) trước khi
+        # tạo đặc trưng, để chỉ cấp phát mảng cho các hàng được giữ lại
+        logger.info("Loại bỏ giá trị trùng lặp quá mức")
+        unchanged = np.zeros(len(valid), dtype=np.int8)
+        if len(valid) > 1:
+            unchanged[1:] = np.abs(np.diff(temps[valid])) < 0.01
+        dup_count = run_lengths(unchanged)
+        run_state = (unchanged[-1], dup_count[-1]) if len(valid) else (0, 0)
+        final = valid[dup_count <= MAX_DUP_RUN]
+        del unchanged, dup_count, valid
+
+        # Đặc trưng trễ và chênh lệch lấy thẳng từ chuỗi nhiệt độ theo chỉ số
         logger.info("Tạo đặc trưng trễ")
+        rolling = {}
+        if self.rolling_windows and times is not None:
+            logger.info(f"Tạo đặc trưng thống kê trượt cho các cửa sổ {self.rolling_windows}")
+            rolling = rolling_features(times, temps, self.rolling_windows)
+            rolling_state = RollingState.from_series(times, temps, self.rolling_windows)
+        if self.compact:
+            temps = temps.astype(COMPACT_FLOAT)
+        features = {'temperature': temps[final]}
         for lag in [1, 2, 3]:
-            df[f'temp_lag_{lag}'] = df['temperature'].shift(lag)
-            
-        # Thêm đặc trưng chênh lệch
-        df['temp_diff_1'] = df['temperature'].diff()
-        df['temp_diff_2'] = df['temp_diff_1'].diff()
-        
-        # Loại bỏ các hàng có giá trị NaN (từ việc tạo đặc trưng trễ)
-        df = df.dropna()
-        
-        # Loại bỏ các giá trị trùng lặp liên tiếp (nhiều hơn 3 lần)
-        logger.info("Loại bỏ giá trị trùng lặp quá mức")
-        df['temp_diff'] = df['temperature'].diff().abs()
-        df['temp_unchanged'] = (df['temp_diff'] < 0.01).astype(int)
-        df['temp_dup_count'] = df['temp_unchanged'].groupby(
-            (df['temp_unchanged'] != df['temp_unchanged'].shift()).cumsum()
-        ).cumsum()
-        df = df[(df['temp_dup_count'] <= 3)]
-        
-        # Scale các đặc trưng số
-        features_to_scale = ['temperature', 'temp_lag_1', 'temp_lag_2', 'temp_lag_3',
-                           'temp_diff_1', 'temp_diff_2']
+            features[f'temp_lag_{lag}'] = temps[final - lag]
+        diff_1 = features['temperature'] - features['temp_lag_1']
+        diff_2 = features['temp_lag_1'] - features['temp_lag_2']
+        np.subtract(diff_1, diff_2, out=diff_2)
+        features['temp_diff_1'] = diff_1
+        features['temp_diff_2'] = diff_2
+
+        out_rows = rows[final]
+        columns = {}
+        if times is not None:
+            logger.info("Thêm đặc trưng thời gian")
+            columns['recorded_time'] = times[final]
+        columns['temperature'] = features['temperature']
+        for col in other_cols:
+            columns[col] = raw[col].to_numpy()[out_rows]
+        if times is not None:
+            int_dtype = COMPACT_INT if self.compact else np.int32
+            columns.update(time_feature_columns(columns['recorded_time'], int_dtype))
+        for name in FEATURES_TO_SCALE[1:]:
+            columns[name] = features[name]
+        for name, values in rolling.items():
+            columns[name] = values[final].astype(temps.dtype, copy=False)
+        del rolling
+
+        # Scale các đặc trưng số, mỗi cột một scaler riêng
         logger.info("Scaling đặc trưng")
-        for feature in features_to_scale:
-            if feature.startswith('temp'):
-                df[f'{feature}_scaled'] = self.scaler_temp.fit_transform(df[[feature]])
-        # Loại bỏ các cột tính toán trung gian
-        df = df.drop(['temp_diff', 'temp_unchanged', 'temp_dup_count'], axis=1)
-        
+        self.scalers = {}
+        for feature in FEATURES_TO_SCALE:
+            values = features[feature]
+            if len(values) == 0:
+                columns[f'{feature}_scaled'] = values.copy()
+                continue
+            scaler = MinMaxScaler().fit(values.reshape(-1, 1))
+            # Giống scaler.transform nhưng chỉ cấp phát một mảng kết quả
+            # (float Python giữ nguyên float32 ở chế độ compact)
+            scaled = np.multiply(values, float(scaler.scale_[0]))
+            scaled += float(scaler.min_[0])
+            columns[f'{feature}_scaled'] = scaled
+            self.scalers[feature] = scaler
+        # scaler_temp là scaler của mục tiêu (temperature), dùng để đổi ngược dự đoán
+        self.scaler_temp = self.scalers.get('temperature', self.scaler_temp)
+
+        df = pd.DataFrame(columns, index=raw.index[out_rows], copy=False)
         self.processed_data = df
+        self.report_memory()
+        if times is not None and len(df):
+            tail = slice(max(n - 3, 0), n)
+            self.state = {
+                'last_time': pd.Timestamp(times[tail][-1]).isoformat(),
+                'last_temperatures': [float(t) for t in temps[tail]],
+                'last_unchanged': int(run_state[0]),
+                'run_length': int(run_state[1]),
+                'scaler': {feature: [float(self.scalers[feature].data_min_[0]),
+                                     float(self.scalers[feature].data_max_[0])]
+                           for feature in FEATURES_TO_SCALE}
+            }
+            if self.resample:
+                self.state['resample'] = self.resample_state(times[tail][-1], open_from)
+            if self.rolling_windows:
+                self.state['rolling'] = rolling_state.to_dict()
         logger.info(f"Hoàn tất tiền xử lý. Kích thước dữ liệu: {df.shape}")
         return True
-        
+
+    def preprocess_multi_sensor(self, n_jobs=None):
+        """
+        Tiền xử lý dữ liệu dạng dài nhiều sensor, nhiều biến
+        (recorded_time, sensor_id, variable, value).
+
+        Mỗi sensor được xử lý độc lập (xem build_sensor_features): các lô sensor
+        chạy song song trên ProcessPoolExecutor với n_jobs > 1. Kết quả có một
+        hàng cho mỗi (sensor_id, recorded_time) với cột temperature, humidity,
+        temp_lag_*, humid_lag_*, temp_diff_*, humid_diff_*; mỗi đặc trưng được
+        scale bằng một MinMaxScaler chung cho mọi sensor. Tiền xử lý tăng dần
+        chưa hỗ trợ dữ liệu nhiều sensor nên state được để None.
+
+        Args:
+            n_jobs: Số tiến trình (mặc định self.n_jobs, -1: mọi CPU)
+        """
+        logger.info("Bắt đầu tiền xử lý dữ liệu nhiều sensor")
+        readings = self.raw_data[LONG_FORMAT_COLUMNS].dropna(subset=['sensor_id', 'recorded_time'])
+        # Tên biến viết thường (chỉ đổi trên các giá trị khác nhau), lưu dạng Categorical
+        var_codes, names = pd.factorize(readings['variable'])
+        names = [str(name).lower() for name in names]
+        variables = ordered_variables(set(names))
+        to_variable = np.array([variables.index(name) for name in names] + [-1], dtype=np.int16)
+        readings = readings.assign(
+            recorded_time=datetime_values(readings['recorded_time']),
+            variable=pd.Categorical.from_codes(to_variable[var_codes], categories=variables),
+            value=readings['value'].to_numpy(dtype=np.float64)
+        )
+        codes, sensors = pd.factorize(readings['sensor_id'], sort=True)
+        resample = None
+        if self.resample and len(readings):
+            # Bucket chứa bản ghi mới nhất (của mọi sensor) còn mở
+            open_from = pd.Timestamp(readings['recorded_time'].max()).floor(self.resample)
+            resample = (self.resample, self.resample_how, self.max_gap, open_from)
+            logger.info(f"Resample mỗi chuỗi (sensor, biến) theo {self.resample} ({self.resample_how})")
+
+        n_jobs = n_jobs or self.n_jobs or 1
+        if n_jobs < 0:
+            n_jobs = os.cpu_count() or 1
+        n_jobs = max(min(n_jobs, len(sensors)), 1)
+        logger.info(f"{len(sensors)} sensor, biến {variables}, {n_jobs} tiến trình")
+        if n_jobs > 1:
+            batches = [readings.iloc[rows] for rows in sensor_batches(codes, n_jobs)]
+            with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+                parts = list(pool.map(build_sensor_features, batches, repeat(variables),
+                                      repeat(self.compact), repeat(resample),
+                                      repeat(self.rolling_windows)))
+            df = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+        else:
+            df = build_sensor_features(readings, variables, self.compact, resample, self.rolling_windows)
+
+        # Scale các đặc trưng số, mỗi cột một scaler riêng (bỏ qua NaN khi fit)
+        logger.info("Scaling đặc trưng")
+        self.scalers = {}
+        for variable in variables:
+            for feature in variable_features(variable):
+                values = df[feature].to_numpy()
+                if not np.isfinite(values).any():
+                    df[f'{feature}_scaled'] = values.copy()
+                    continue
+                scaler = MinMaxScaler().fit(values.reshape(-1, 1))
+                scaled = np.multiply(values, float(scaler.scale_[0]))
+                scaled += float(scaler.min_[0])
+                df[f'{feature}_scaled'] = scaled
+                self.scalers[feature] = scaler
+        self.scaler_temp = self.scalers.get('temperature', self.scaler_temp)
+
+        self.processed_data = df
+        self.state = None
+        self.report_memory()
+        logger.info(f"Hoàn tất tiền xử lý {len(sensors)} sensor. Kích thước dữ liệu: {df.shape}")
+        return True
+
+    def resample_raw(self, raw, previous=None):
+        """
+        Gộp chuỗi nhiệt độ (recorded_time, temperature) vào các bucket
+        self.resample theo self.resample_how, chỉ giữ các bucket đã đóng
+        (bucket chứa bản ghi mới nhất còn có thể nhận thêm dữ liệu).
+
+        Returns:
+            (DataFrame recorded_time = đầu bucket, temperature; thời điểm đầu bucket còn mở)
+        """
+        times = datetime_values(raw['recorded_time'])
+        temps = raw['temperature'].to_numpy(dtype=np.float64)
+        if len(times) == 0:
+            return pd.DataFrame({'recorded_time': times, 'temperature': temps}), None
+        order = np.argsort(times, kind='stable')
+        times, temps = times[order], temps[order]
+        # Outlier bị bỏ trước khi gộp để không lẫn vào giá trị của bucket
+        low, high = VALUE_RANGES['temperature']
+        temps = np.where((temps >= low) & (temps <= high), temps, np.nan)
+        open_from = pd.Timestamp(times[-1]).floor(self.resample)
+        _, buckets, values = resample_buckets(np.zeros(len(times), dtype=np.int8), times, temps,
+                                              self.resample, self.resample_how, self.max_gap,
+                                              open_from=open_from, previous=previous)
+        logger.info(f"Resample {self.resample} ({self.resample_how}): {len(raw)} bản ghi -> {len(buckets)} bucket")
+        return pd.DataFrame({'recorded_time': buckets, 'temperature': values}), open_from
+
+    def resample_state(self, last_bucket, open_from):
+        """Cấu hình resample và bucket cuối đã xử lý, lưu trong state cho lần tăng dần sau"""
+        return {
+            'freq': str(self.resample),
+            'how': self.resample_how,
+            'last_bucket': pd.Timestamp(last_bucket).isoformat(),
+            'open_from': pd.Timestamp(open_from).isoformat()
+        }
+
+    def add_time_features(self, df):
+        """Thêm giờ, phút, thứ trong tuần và one-hot buổi trong ngày từ recorded_time"""
+        for name, values in time_feature_columns(df['recorded_time']).items():
+            df[name] = values
+        return df
+
+    def preprocess_incremental(self, new_data=None):
+        """
+        Tiền xử lý tăng dần: chỉ xử lý các bản ghi mới hơn state['last_time']
+        trong O(số bản ghi mới) rồi nối vào processed_data.
+
+        Dùng trạng thái cuối chuỗi đã lưu (3 nhiệt độ cuối, độ dài chuỗi giá trị
+        không đổi hiện tại, min/max của scaler) thay vì tính lại toàn bộ dữ liệu.
+        Các giá trị mới được scale bằng min/max đã lưu (có thể nằm ngoài [0, 1]);
+        chạy lại preprocess_data() để fit lại scaler khi cần. Giá trị thiếu ở cuối
+        lần xử lý trước đã được điền bằng giá trị cuối nên không được nội suy lại.
+
+        Args:
+            new_data: DataFrame (recorded_time, temperature); mặc định raw_data
+
+        Returns:
+            DataFrame các hàng đã xử lý mới (có thể rỗng), None nếu chưa có state
+        """
+        if self.state is None:
+            logger.error("Chưa có trạng thái tiền xử lý. Hãy gọi preprocess_data() hoặc load_state() trước.")
+            return None
+        if is_long_format(self.raw_data if new_data is None else new_data):
+            logger.error("Tiền xử lý tăng dần chưa hỗ trợ dữ liệu nhiều sensor. Hãy gọi preprocess_data().")
+            return None
+        df = (self.raw_data if new_data is None else new_data)[['recorded_time', 'temperature']].copy()
+        df['recorded_time'] = pd.to_datetime(df['recorded_time'])
+        resample_state = self.state.get('resample')
+        if bool(self.resample) != bool(resample_state) or (
+                resample_state and (resample_state['freq'] != str(self.resample)
+                                    or resample_state['how'] != self.resample_how)):
+            logger.error("Cấu hình resample khác lần tiền xử lý trước. Hãy gọi preprocess_data().")
+            return None
+        rolling_state = self.state.get('rolling')
+        if (self.rolling_windows or None) != (rolling_state['windows'] if rolling_state else None):
+            logger.error("Cửa sổ thống kê trượt khác lần tiền xử lý trước. Hãy gọi preprocess_data().")
+            return None
+        if resample_state:
+            # Đọc lại từ đầu bucket còn mở của lần trước rồi gộp các bucket mới đã đóng
+            df = df[df['recorded_time'] >= pd.Timestamp(resample_state['open_from'])]
+            df, open_from = self.resample_raw(df, previous=resample_state['last_bucket'])
+        else:
+            last_time = pd.Timestamp(self.state['last_time'])
+            df = df[df['recorded_time'] > last_time].sort_values('recorded_time')
+        if df.empty:
+            logger.info("Không có bản ghi mới để tiền xử lý")
+            return df
+
+        # Nối ngữ cảnh (3 nhiệt độ cuối) để nội suy, tính trễ và chênh lệch liền mạch
+        context = np.asarray(self.state['last_temperatures'], dtype=np.float64)
+        n_ctx = len(context)
+        temps = pd.Series(np.concatenate([context, df['temperature'].to_numpy(dtype=np.float64)]))
+        if temps.isna().any():
+            temps = temps.interpolate(method='linear')
+        df['temperature'] = temps.to_numpy()[n_ctx:]
+
+        # Loại bỏ outlier trước khi tạo trễ (giống preprocess_data)
+        keep = ((df['temperature'] >= -20) & (df['temperature'] <= 60)).to_numpy()
+        df = df[keep]
+        if df.empty:
+            return df
+        temps = np.concatenate([context, df['temperature'].to_numpy()])
+        new_tail = df.tail(3)
+
+        df = self.add_time_features(df)
+        if rolling_state:
+            # Tiếp tục cửa sổ trượt từ trạng thái đã lưu, O(1) khấu hao mỗi bản ghi mới
+            rolling = RollingState.from_dict(rolling_state)
+            rows = [rolling.update(t, v) for t, v in zip(df['recorded_time'], df['temperature'])]
+            for name in rolling_feature_names(rolling.windows):
+                df[name] = [row[name] for row in rows]
+            self.state['rolling'] = rolling.to_dict()
+        for lag in [1, 2, 3]:
+            df[f'temp_lag_{lag}'] = temps[n_ctx - lag:len(temps) - lag] if n_ctx >= lag else np.nan
+        diff_1 = np.diff(temps)
+        df['temp_diff_1'] = diff_1[n_ctx - 1:] if n_ctx >= 1 else np.nan
+        df['temp_diff_2'] = np.diff(diff_1)[n_ctx - 2:] if n_ctx >= 2 else np.nan
+        df = df.dropna()
+
+        # Đếm chuỗi giá trị không đổi, tiếp nối chuỗi đang dở từ lần trước
+        unchanged = (np.abs(df['temp_diff_1'].to_numpy()) < 0.01).astype(int)
+        groups = np.cumsum(np.r_[1, unchanged[1:] != unchanged[:-1]]) if len(unchanged) else unchanged
+        dup_count = pd.Series(unchanged).groupby(groups).cumsum().to_numpy().copy()
+        if len(unchanged) and unchanged[0] == 1 and self.state['last_unchanged'] == 1:
+            dup_count[groups == 1] += self.state['run_length']
+        if len(unchanged):
+            self.state['last_unchanged'] = int(unchanged[-1])
+            self.state['run_length'] = int(dup_count[-1])
+        df = df[dup_count <= MAX_DUP_RUN]
+
+        # Scale bằng min/max đã lưu (tương đương MinMaxScaler.transform)
+        for feature in FEATURES_TO_SCALE:
+            low, high = self.state['scaler'][feature]
+            scale = (high - low) if high > low else 1.0
+            df[f'{feature}_scaled'] = (df[feature] - low) / scale
+
+        self.state['last_time'] = new_tail['recorded_time'].iloc[-1].isoformat()
+        if resample_state:
+            self.state['resample'] = self.resample_state(new_tail['recorded_time'].iloc[-1], open_from)
+        self.state['last_temperatures'] = (list(context) + [float(t) for t in new_tail['temperature']])[-3:]
+
+        if self.processed_data is not None:
+            # Cột không tính được cho hàng mới (ví dụ target_*) để NaN
+            df = df.reindex(columns=self.processed_data.columns)
+        if self.compact:
+            df = compact_frame(df)
+        if self.processed_data is not None:
+            self.processed_data = pd.concat([self.processed_data, df], ignore_index=True)
+        else:
+            self.processed_data = df
+        logger.info(f"Tiền xử lý tăng dần: thêm {len(df)} hàng, tổng {len(self.processed_data)}")
+        return df
+
+    def report_memory(self):
+        """Ghi log bộ nhớ của processed_data và phần tiết kiệm được ở chế độ compact"""
+        if self.processed_data is None:
+            return None
+        self.memory_report = frame_memory_report(self.processed_data)
+        if self.compact:
+            logger.info(f"Bộ nhớ dữ liệu đã xử lý: {self.memory_report['actual_mb']:.1f} MB "
+                        f"(kiểu mặc định: {self.memory_report['default_mb']:.1f} MB, "
+                        f"tiết kiệm {self.memory_report['saved_mb']:.1f} MB)")
+        else:
+            logger.info(f"Bộ nhớ dữ liệu đã xử lý: {self.memory_report['actual_mb']:.1f} MB")
+        return self.memory_report
+
+    def save_state(self, path='preprocess_state.json'):
+        """Lưu trạng thái tiền xử lý tăng dần ra file JSON"""
+        if self.state is None:
+            logger.error("Không có trạng thái tiền xử lý để lưu")
+            return False
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=2)
+        logger.info(f"Đã lưu trạng thái tiền xử lý vào {path}")
+        return True
+
+    def load_state(self, path='preprocess_state.json'):
+        """Đọc trạng thái tiền xử lý tăng dần đã lưu"""
+        if not os.path.exists(path):
+            logger.warning(f"Không tìm thấy trạng thái tiền xử lý: {path}")
+            return False
+        with open(path, 'r', encoding='utf-8') as f:
+            self.state = json.load(f)
+        logger.info(f"Đã tải trạng thái tiền xử lý từ {path} (bản ghi cuối: {self.state['last_time']})")
+        return True
+
     def get_train_test_data(self, test_size=0.2, random_state=42):
         """
         Chia dữ liệu đã xử lý thành tập huấn luyện và kiểm tra.
@@ -214,12 +1461,25 @@ class SensorDataProcessor:
             'time_morning', 'time_afternoon', 'time_evening', 'time_night'
         ]
         
+        if self.rolling_windows:
+            feature_cols += rolling_feature_names(self.rolling_windows, 'temp')
+            feature_cols += rolling_feature_names(self.rolling_windows, 'humid')
+        
         # Chỉ sử dụng các cột đặc trưng có trong DataFrame
         available_features = [col for col in feature_cols if col in self.processed_data.columns]
         logger.info(f"Sử dụng {len(available_features)} đặc trưng: {available_features}")
         
-        X = self.processed_data[available_features]
-        y_temp = self.processed_data['temperature_scaled']
+        data = self.processed_data
+        if 'sensor_id' in data.columns:
+            # Nhiều sensor: sensor không đo một biến có đặc trưng NaN
+            data = data.dropna(subset=available_features + ['temperature_scaled'])
+            logger.info(f"Dữ liệu {data['sensor_id'].nunique()} sensor: {len(data)} mẫu có đủ đặc trưng")
+        X = data[available_features]
+        y_temp = data['temperature_scaled']
+        if self.compact:
+            # Chọn cột không đổi kiểu: X giữ float32/int8/bool qua train_test_split
+            logger.info(f"Chế độ compact: X chiếm {X.memory_usage(index=False).sum() / 1024 / 1024:.1f} MB, "
+                        f"kiểu {sorted(set(str(dtype) for dtype in X.dtypes))}")
         
         X_train, X_test, y_train_temp, y_test_temp = train_test_split(
             X, y_temp, test_size=test_size, random_state=random_state
@@ -229,16 +1489,121 @@ class SensorDataProcessor:
         
         return X_train, X_test, y_train_temp, y_test_temp
     
-    def save_processed_data(self, output_path='processed_sensor_data.csv'):
-        """Lưu dữ liệu đã xử lý vào file CSV."""
+    def add_horizon_targets(self, horizons=None, max_gap_minutes=60):
+        """
+        Thêm cột mục tiêu target_{h}m = nhiệt độ tại thời điểm t + h phút.
+
+        Giá trị được nội suy tuyến tính theo thời gian trên chuỗi thô (đã sắp xếp),
+        nên dùng được cả với dữ liệu theo giờ lẫn theo phút. Mốc rơi ra ngoài
+        chuỗi hoặc vào khoảng trống dài hơn max_gap_minutes được để NaN.
+
+        Args:
+            horizons: Danh sách số phút cần dự báo (mặc định DEFAULT_HORIZONS)
+            max_gap_minutes: Khoảng cách tối đa giữa hai lần đọc bao quanh mốc
+
+        Returns:
+            Danh sách tên cột mục tiêu đã thêm
+        """
+        if self.processed_data is None:
+            logger.error("Chưa có dữ liệu đã xử lý. Hãy gọi preprocess_data() trước.")
+            return None
+
+        horizons = list(horizons or DEFAULT_HORIZONS)
+        current = self.processed_data['recorded_time'].values.astype('datetime64[s]').astype(np.int64)
+        if 'sensor_id' in self.processed_data.columns:
+            # Nhiều sensor: nội suy trên chuỗi đã xử lý của chính sensor đó
+            targets = {h: np.full(len(current), np.nan) for h in horizons}
+            for _, rows in self.processed_data.groupby('sensor_id', sort=False).indices.items():
+                series = self.processed_data.iloc[rows]
+                valid = np.flatnonzero(series['temperature'].notna().to_numpy())
+                if len(valid) == 0:
+                    continue
+                order = valid[np.argsort(current[rows][valid], kind='stable')]
+                times = current[rows][order]
+                temps = series['temperature'].to_numpy(dtype=np.float64)[order]
+                for h in horizons:
+                    targets[h][rows] = horizon_target(times, temps, current[rows], h, max_gap_minutes)
+        else:
+            # Không có dữ liệu thô (ví dụ đọc từ dữ liệu đã xử lý): dùng chuỗi đã xử lý
+            source = self.raw_data if self.raw_data is not None else self.processed_data
+            series = source[['recorded_time', 'temperature']].dropna().copy()
+            series['recorded_time'] = pd.to_datetime(series['recorded_time'])
+            series = series.sort_values('recorded_time')
+
+            times = series['recorded_time'].values.astype('datetime64[s]').astype(np.int64)
+            temps = series['temperature'].values.astype(np.float64)
+            targets = {h: horizon_target(times, temps, current, h, max_gap_minutes) for h in horizons}
+
+        target_cols = []
+        for h in horizons:
+            col = f'target_{h}m'
+            target = targets[h]
+            self.processed_data[col] = target.astype(COMPACT_FLOAT) if self.compact else target
+            target_cols.append(col)
+
+        logger.info(f"Đã thêm mục tiêu dự báo cho các mốc {horizons} phút")
+        return target_cols
+
+    def get_multi_horizon_data(self, horizons=None, test_size=0.2, random_state=42, max_gap_minutes=60):
+        """
+        Chuẩn bị dữ liệu cho mô hình dự báo trực tiếp nhiều mốc: một hàng đặc
+        trưng (lag, diff, thời gian - chưa scale) -> vector nhiệt độ tại mọi mốc.
+
+        Returns:
+            X_train, X_test, Y_train, Y_test (Y là DataFrame, mỗi cột một mốc)
+        """
+        from sklearn.model_selection import train_test_split
+
+        target_cols = self.add_horizon_targets(horizons, max_gap_minutes)
+        if target_cols is None:
+            return None
+
+        data = self.processed_data.dropna(subset=target_cols)
+        available_features = [col for col in MULTI_HORIZON_FEATURES if col in data.columns]
+        logger.info(f"Sử dụng {len(available_features)} đặc trưng: {available_features}")
+        logger.info(f"Số mẫu có đủ mục tiêu cho mọi mốc: {len(data)}")
+
+        X = data[available_features]
+        Y = data[target_cols]
+        X_train, X_test, Y_train, Y_test = train_test_split(
+            X, Y, test_size=test_size, random_state=random_state
+        )
+
+        logger.info(f"Kích thước tập huấn luyện: {X_train.shape[0]}, tập kiểm tra: {X_test.shape[0]}")
+        return X_train, X_test, Y_train, Y_test
+
+    def save_processed_data(self, output_path='processed_sensor_data.csv', fmt=None):
+        """
+        Lưu dữ liệu đã xử lý. Định dạng theo đuôi output_path hoặc fmt
+        ('csv', 'parquet', 'feather', 'npy', 'auto'); các định dạng cột giữ nguyên kiểu dữ liệu.
+
+        Returns:
+            Đường dẫn đã ghi, False nếu không có dữ liệu
+        """
         if self.processed_data is not None:
             logger.info(f"Lưu dữ liệu đã xử lý vào {output_path}")
-            self.processed_data.to_csv(output_path, index=False)
-            return True
+            return save_frame(self.processed_data, output_path, fmt)
         else:
             logger.error("Không có dữ liệu đã xử lý để lưu")
             return False
 
+    def load_processed_data(self, path, mmap=True):
+        """
+        Đọc dữ liệu đã xử lý đã lưu bằng save_processed_data. Với .npy/.feather
+        các cột được memory-map (không parse lại, không sao chép).
+        """
+        if not os.path.exists(path):
+            logger.error(f"Không tìm thấy dữ liệu đã xử lý: {path}")
+            return False
+        df = load_frame(path, mmap=mmap)
+        self.processed_data = compact_frame(df) if self.compact else df
+        return True
+
+    def append_processed_data(self, rows, output_path='processed_sensor_data.csv'):
+        """Nối các hàng đã xử lý mới vào dữ liệu đã lưu (CSV nối trực tiếp, không ghi lại toàn bộ)."""
+        append_frame(rows, output_path)
+        return True
+
 if __name__ == "__main__":
     # Ví dụ
     processor = SensorDataProcessor(data_path="sensor_data.csv", filter_hours=24)
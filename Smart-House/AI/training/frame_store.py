@@ -0,0 +1,189 @@
+"""
+YoloHome AI Module - Frame Store
+================================
+Lưu / đọc DataFrame đã xử lý ở dạng cột nhị phân thay vì CSV, giữ nguyên kiểu
+dữ liệu (float32, int8, bool, category, datetime64) và không phải parse lại văn bản.
+
+Định dạng theo đuôi đường dẫn:
+    .parquet            Parquet (cần pyarrow)
+    .feather / .arrow   Feather không nén, mở bằng memory-map (cần pyarrow); cột
+                        số không có giá trị thiếu dùng lại vùng nhớ đã map, các
+                        cột khác (bool, chuỗi, category, có NaN) bị sao chép
+    .npy                Thư mục, mỗi cột một file .npy + _meta.json, đọc bằng
+                        np.load(mmap_mode='r') - không cần thư viện ngoài
+    .csv                CSV như trước
+"""
+
+import os
+import json
+import shutil
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger("frame_store")
+
+FORMAT_EXTENSIONS = {
+    'parquet': '.parquet',
+    'feather': '.feather',
+    'npy': '.npy',
+    'csv': '.csv'
+}
+
+META_FILE = '_meta.json'
+INDEX_FILE = '_index.npy'
+
+def pyarrow_available():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def resolve_format(fmt='auto'):
+    """'auto' -> feather nếu có pyarrow, ngược lại thư mục .npy"""
+    if fmt == 'auto':
+        return 'feather' if pyarrow_available() else 'npy'
+    if fmt in ('parquet', 'feather') and not pyarrow_available():
+        logger.warning(f"Không có pyarrow, dùng định dạng npy thay cho {fmt}")
+        return 'npy'
+    return fmt
+
+def store_path(base_path, fmt='auto'):
+    """Đường dẫn lưu cho một định dạng, ví dụ output/processed_sensor_data -> .feather"""
+    fmt = resolve_format(fmt)
+    return os.path.splitext(base_path)[0] + FORMAT_EXTENSIONS[fmt]
+
+def detect_format(path):
+    if os.path.isdir(path):
+        return 'npy'
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.arrow':
+        return 'feather'
+    for fmt, fmt_ext in FORMAT_EXTENSIONS.items():
+        if ext == fmt_ext:
+            return fmt
+    return 'csv'
+
+def save_npy_dir(df, path):
+    """Ghi mỗi cột thành một file .npy trong thư mục path (ghi thư mục tạm rồi đổi tên)"""
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    columns = []
+    for i, (name, series) in enumerate(df.items()):
+        file_name = f'{i:03d}.npy'
+        entry = {'name': name, 'file': file_name}
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            entry['categories'] = [str(c) for c in series.cat.categories]
+            entry['ordered'] = bool(series.cat.ordered)
+            values = series.cat.codes.to_numpy()
+        elif series.dtype == object or pd.api.types.is_string_dtype(series.dtype):
+            # Chuỗi độ dài cố định để vẫn memory-map được
+            values = series.to_numpy().astype(str)
+        else:
+            values = series.to_numpy()
+        np.save(os.path.join(tmp_path, file_name), values, allow_pickle=False)
+        columns.append(entry)
+
+    meta = {'rows': len(df), 'columns': columns, 'index': None}
+    if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+        np.save(os.path.join(tmp_path, INDEX_FILE), df.index.to_numpy(), allow_pickle=False)
+        meta['index'] = INDEX_FILE
+    with open(os.path.join(tmp_path, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+def load_npy_dir(path, mmap=True):
+    """Đọc thư mục .npy; với mmap=True các cột số là memory-map chỉ đọc (không sao chép)"""
+    with open(os.path.join(path, META_FILE), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    mmap_mode = 'r' if mmap else None
+
+    columns = {}
+    for entry in meta['columns']:
+        values = np.load(os.path.join(path, entry['file']), mmap_mode=mmap_mode, allow_pickle=False)
+        if 'categories' in entry:
+            values = pd.Categorical.from_codes(np.asarray(values), categories=entry['categories'],
+                                               ordered=entry['ordered'])
+        columns[entry['name']] = values
+
+    index = None
+    if meta['index']:
+        index = np.load(os.path.join(path, meta['index']), mmap_mode=mmap_mode, allow_pickle=False)
+    return pd.DataFrame(columns, index=index, copy=False)
+
+def save_frame(df, path, fmt=None):
+    """
+    Lưu DataFrame theo định dạng fmt (mặc định đoán theo đuôi của path).
+
+    Returns:
+        Đường dẫn thực sự đã ghi
+    """
+    fmt = resolve_format(fmt or detect_format(path))
+    if detect_format(path) != fmt:
+        path = os.path.splitext(path)[0] + FORMAT_EXTENSIONS[fmt]
+    output_dir = os.path.dirname(path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    if fmt == 'csv':
+        df.to_csv(path, index=False)
+    elif fmt == 'npy':
+        save_npy_dir(df, path)
+    elif fmt == 'parquet':
+        df.to_parquet(path, index=not isinstance(df.index, pd.RangeIndex))
+    elif fmt == 'feather':
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        table = pa.Table.from_pandas(df, preserve_index=not isinstance(df.index, pd.RangeIndex))
+        # Không nén để có thể memory-map khi đọc
+        feather.write_feather(table, path, compression='uncompressed')
+    logger.info(f"Đã lưu {len(df)} hàng ({fmt}) vào {path}")
+    return path
+
+def load_frame(path, mmap=True):
+    """
+    Đọc DataFrame đã lưu bằng save_frame; định dạng đoán theo đường dẫn.
+
+    mmap=True chỉ tránh sao chép với .npy và các cột số không có null của
+    .feather; parquet luôn được giải mã vào bộ nhớ.
+    """
+    fmt = detect_format(path)
+    if fmt == 'npy':
+        df = load_npy_dir(path, mmap=mmap)
+    elif fmt == 'feather':
+        import pyarrow.feather as feather
+        # split_blocks: mỗi cột một block, không gộp (sao chép) các cột cùng kiểu;
+        # cột số không có null khi đó trỏ thẳng vào vùng nhớ đã map
+        df = feather.read_table(path, memory_map=mmap).to_pandas(split_blocks=mmap)
+    elif fmt == 'parquet':
+        df = pd.read_parquet(path, memory_map=mmap)
+    else:
+        df = pd.read_csv(path)
+        if 'recorded_time' in df.columns:
+            df['recorded_time'] = pd.to_datetime(df['recorded_time'])
+    logger.info(f"Đã đọc {len(df)} hàng ({fmt}) từ {path}")
+    return df
+
+def append_frame(rows, path):
+    """
+    Nối thêm hàng vào dữ liệu đã lưu. CSV được nối trực tiếp; định dạng cột
+    được ghi lại (đọc + nối + ghi) vì không hỗ trợ nối tại chỗ.
+    """
+    if rows is None or len(rows) == 0:
+        return path
+    if not os.path.exists(path):
+        return save_frame(rows, path)
+    if detect_format(path) == 'csv':
+        rows.to_csv(path, mode='a', header=False, index=False)
+        logger.info(f"Đã nối {len(rows)} hàng vào {path}")
+        return path
+    existing = load_frame(path, mmap=False)
+    rows = rows.reindex(columns=existing.columns).astype(existing.dtypes.to_dict(), copy=False)
+    return save_frame(pd.concat([existing, rows], ignore_index=True), path)
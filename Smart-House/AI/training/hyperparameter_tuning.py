@@ -6,13 +6,19 @@ Module tối ưu hyperparameter cho các mô hình dự đoán nhiệt độ và
 
 import os
 import json
+import hashlib
+import sqlite3
 import logging
 import numpy as np
 import pandas as pd
-from time import time
+from time import time, perf_counter
+from joblib import Parallel, delayed
+from sklearn.base import clone
 from sklearn.tree import DecisionTreeRegressor
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
-from sklearn.model_selection import GridSearchCV, RandomizedSearchCV
+from sklearn.model_selection import ParameterGrid, ParameterSampler, check_cv, cross_validate
+
+from shared_matrix import shared_training_data, fold_indices, split_cpu_budget, with_inner_jobs, refit_best
 
 # Cấu hình logging
 logging.basicConfig(
@@ -26,14 +32,262 @@ logging.basicConfig(
 
 logger = logging.getLogger("hyperparameter_tuning")
 
+CV_CACHE_FILE = 'cv_cache.sqlite'
+
+# Thăm dò chi phí: fit thử trên PROBE_ROWS hàng; tham số có chi phí tỉ lệ thuận
+# (số cây) được thăm dò ở PROBE_ESTIMATORS rồi nhân theo tỉ lệ
+PROBE_ROWS = 2000
+PROBE_POINTS = 5
+PROBE_ESTIMATORS = 10
+LINEAR_COST_PARAMS = ('n_estimators',)
+FOLD_FIELDS = ['test_score', 'train_score', 'fit_time', 'score_time']
+
+def to_python(value):
+    """Đổi kiểu numpy (np.int64, np.float64...) sang kiểu Python để so khoá và lưu JSON"""
+    return value.item() if isinstance(value, np.generic) else value
+
+def dataset_fingerprint(X, y):
+    """Dấu vân tay của tập dữ liệu: hash nội dung, tên cột và kích thước của X, y"""
+    digest = hashlib.sha1()
+    for data in (X, y):
+        if isinstance(data, (pd.DataFrame, pd.Series)):
+            digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+            names = data.columns if isinstance(data, pd.DataFrame) else [data.name]
+            digest.update(json.dumps([str(name) for name in names]).encode())
+        else:
+            array = np.ascontiguousarray(data)
+            digest.update(array.tobytes())
+            digest.update(str(array.dtype).encode())
+        digest.update(str(np.shape(data)).encode())
+    return digest.hexdigest()
+
+class CVScoreCache:
+    """
+    Cache điểm cross-validation trên đĩa (SQLite), dùng chung giữa grid search,
+    random search và các lần chạy lại.
+
+    Khoá gồm dấu vân tay dữ liệu, loại mô hình, toàn bộ tham số của estimator,
+    cách chia fold và hàm đánh giá; giá trị là điểm và thời gian fit từng fold.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cv_scores ("
+                "key TEXT PRIMARY KEY, model_type TEXT, params TEXT, result TEXT)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    @staticmethod
+    def make_key(fingerprint, model_type, params, cv, scoring):
+        payload = json.dumps({
+            'data': fingerprint,
+            'model': model_type,
+            'params': {name: to_python(value) for name, value in params.items()},
+            'cv': repr(cv),
+            'scoring': scoring
+        }, sort_keys=True, default=repr)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        with self._connect() as conn:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT key, result FROM cv_scores WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update((key, json.loads(result)) for key, result in rows)
+        return found
+
+    def put(self, key, model_type, params, result):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cv_scores VALUES (?, ?, ?, ?)",
+                (key, model_type, json.dumps({k: to_python(v) for k, v in params.items()}, default=repr),
+                 json.dumps(result))
+            )
+
+class CachedSearchResult:
+    """Kết quả tìm kiếm với các thuộc tính giống GridSearchCV / RandomizedSearchCV"""
+
+    def __init__(self, cv_results, best_index, best_estimator):
+        self.cv_results_ = cv_results
+        self.best_index_ = best_index
+        self.best_params_ = cv_results['params'][best_index]
+        self.best_score_ = cv_results['mean_test_score'][best_index]
+        self.best_estimator_ = best_estimator
+
+def fold_scores(model, params, X, y, splits, scoring, threshold=None, inner_jobs=1):
+    """
+    Cross-validation một cấu hình trên các fold tính sẵn (splits); fold lỗi
+    cho điểm NaN (lưu thành null). inner_jobs là n_jobs của estimator.
+
+    threshold: điểm trung bình của cấu hình tốt nhất hiện tại. Khi đặt (chỉ
+    dùng với điểm neg_*, luôn <= 0), dừng ngay sau fold mà tổng điểm đã thấp
+    hơn threshold * số fold - các fold còn lại dù đạt 0 cũng không vượt được;
+    kết quả khi đó có 'pruned': True.
+    """
+    result = {name: [] for name in FOLD_FIELDS}
+    # Không cắt sớm: chạy một lần cho mọi fold
+    batches = [splits] if threshold is None else [[split] for split in splits]
+    for batch in batches:
+        try:
+            scores = cross_validate(
+                with_inner_jobs(clone(model).set_params(**params), inner_jobs), X, y, cv=batch, scoring=scoring,
+                n_jobs=1, return_train_score=True, error_score=np.nan
+            )
+        except (ValueError, RuntimeError) as e:
+            # Mọi fold đều lỗi hoặc không clone được (ví dụ tham số không hợp lệ / đã bị bỏ)
+            logger.warning(f"Bỏ cấu hình {params}: {str(e).strip().splitlines()[-1]}")
+            return {'test_score': [None] * len(splits), 'train_score': [None] * len(splits),
+                    'fit_time': [0.0] * len(splits), 'score_time': [0.0] * len(splits)}
+        for name in FOLD_FIELDS:
+            result[name].extend(None if np.isnan(v) else float(v) for v in scores[name])
+        done = [v for v in result['test_score'] if v is not None]
+        if threshold is not None and len(done) < len(splits) and sum(done) < threshold * len(splits):
+            result['pruned'] = True
+            break
+    return result
+
+def canonical_params(params):
+    """
+    Đưa cấu hình về dạng chuẩn để bỏ các tổ hợp tương đương:
+    max_features='auto' (đã bị scikit-learn bỏ, với mô hình hồi quy nghĩa là
+    mọi đặc trưng) thành None; criterion='friedman_mse' (bí danh của
+    'squared_error' với cây hồi quy) thành 'squared_error';
+    min_samples_split < 2 * min_samples_leaf tương đương 2 * min_samples_leaf
+    vì nút ít mẫu hơn không thể tách được.
+    """
+    params = {name: to_python(value) for name, value in params.items()}
+    if params.get('max_features') == 'auto':
+        params['max_features'] = None
+    if params.get('criterion') == 'friedman_mse':
+        params['criterion'] = 'squared_error'
+    split, leaf = params.get('min_samples_split'), params.get('min_samples_leaf')
+    if isinstance(split, int) and isinstance(leaf, int):
+        params['min_samples_split'] = max(split, 2 * leaf)
+    return params
+
+def probe_points(values):
+    """Các giá trị cần fit thử: mọi giá trị không phải số và tối đa PROBE_POINTS giá trị số trải đều"""
+    numeric = sorted({v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool)})
+    others = [v for v in dict.fromkeys(values) if v not in numeric or isinstance(v, bool)]
+    if len(numeric) > PROBE_POINTS:
+        numeric = [numeric[i] for i in np.linspace(0, len(numeric) - 1, PROBE_POINTS).round().astype(int)]
+    return numeric, others
+
+def estimate_costs(model, candidates, X, y, probe_rows=PROBE_ROWS, random_state=42):
+    """
+    Ước lượng chi phí tương đối của từng cấu hình từ các lần fit thử nhỏ.
+
+    Lấy một cấu hình gốc chạy được, đổi lần lượt từng tham số sang từng giá trị
+    (giá trị số ở giữa các điểm thăm dò được nội suy) và đo thời gian fit trên
+    probe_rows hàng. Chi phí một cấu hình là thời gian gốc nhân tỉ lệ của từng
+    tham số; n_estimators được nhân tuyến tính thay vì thăm dò.
+
+    Returns:
+        (mảng chi phí ước lượng (giây, trên mẫu thăm dò) theo thứ tự candidates,
+         tập (tham số, giá trị) không hợp lệ)
+    """
+    rows = np.random.RandomState(random_state).permutation(len(X))[:probe_rows]
+    X_probe = X.iloc[rows] if hasattr(X, 'iloc') else X[rows]
+    y_probe = y.iloc[rows] if hasattr(y, 'iloc') else y[rows]
+
+    def fit_time(params):
+        estimator = clone(model).set_params(**params)
+        best = None
+        for _ in range(2):
+            start = perf_counter()
+            estimator.fit(X_probe, y_probe)
+            elapsed = perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    start = perf_counter()
+    names = sorted({name for params in candidates for name in params})
+    base, base_time = None, None
+    for params in candidates:
+        base = {name: (PROBE_ESTIMATORS if name in LINEAR_COST_PARAMS else value) for name, value in params.items()}
+        try:
+            base_time = fit_time(base)
+            break
+        except (ValueError, TypeError):
+            continue
+    if base_time is None:
+        return np.ones(len(candidates)), set()
+
+    invalid = set()
+    ratios = {}
+    n_probes = 1
+    for name in names:
+        if name in LINEAR_COST_PARAMS or name not in base:
+            continue
+        values = [params[name] for params in candidates if name in params]
+        numeric, others = probe_points(values)
+        measured = {}
+        for value in numeric + others:
+            if value == base[name] and type(value) is type(base[name]):
+                measured[value] = 1.0
+                continue
+            try:
+                measured[value] = fit_time(dict(base, **{name: value})) / base_time
+                n_probes += 1
+            except (ValueError, TypeError):
+                invalid.add((name, value))
+        ratios[name] = (measured, [v for v in numeric if v in measured])
+
+    def ratio(name, value):
+        measured, numeric = ratios[name]
+        if value in measured:
+            return measured[value]
+        if numeric and isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(np.interp(value, numeric, [measured[v] for v in numeric]))
+        return 1.0
+
+    costs = np.empty(len(candidates))
+    for i, params in enumerate(candidates):
+        cost = base_time
+        for name, value in params.items():
+            if name in LINEAR_COST_PARAMS and isinstance(value, (int, float)):
+                cost *= value / PROBE_ESTIMATORS
+            elif name in ratios:
+                cost *= ratio(name, value)
+        costs[i] = cost
+    logger.info(f"Thăm dò chi phí: {n_probes} lần fit trên {len(rows)} hàng trong {perf_counter() - start:.2f} giây")
+    return costs, invalid
+
 class ModelTuner:
     """Lớp tối ưu hyperparameter cho các mô hình dự đoán."""
     
-    def __init__(self, output_dir='.'):        
+    def __init__(self, output_dir='.', use_cache=True, cache_path=None, n_jobs=-1,
+                 prune=True, early_cutoff=False):
+        """
+        Args:
+            output_dir: Thư mục lưu tuning_results.json (và cache mặc định)
+            use_cache: Ghi nhớ điểm cross-validation trên đĩa để grid, random
+                và các lần chạy sau bỏ qua cấu hình đã đánh giá
+            cache_path: Đường dẫn file cache (mặc định output_dir/cv_cache.sqlite)
+            n_jobs: Tổng số CPU cho tìm kiếm (-1: mọi CPU), chia giữa các cấu
+                hình chạy song song và n_jobs của estimator
+            prune: Bỏ cấu hình không hợp lệ / tương đương và chạy cấu hình rẻ
+                trước theo chi phí ước lượng từ các lần fit thử
+            early_cutoff: Dừng cross-validation của cấu hình khi điểm các fold
+                đã chạy cho thấy nó không thể vượt cấu hình tốt nhất (chỉ với
+                scoring neg_*); cấu hình bị dừng không được lưu vào cache
+        """
         self.output_dir = output_dir
         self.tuning_results = {}
+        self.n_jobs = n_jobs
+        self.prune = prune
+        self.early_cutoff = early_cutoff
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
+        self.cache = CVScoreCache(cache_path or os.path.join(output_dir, CV_CACHE_FILE)) if use_cache else None
 
     def define_param_grids(self):
         param_grids = {
@@ -107,17 +361,8 @@ class ModelTuner:
             logger.error(f"Không tìm thấy grid tham số cho {model_type}")
             return None
         param_grid = param_grids[model_type]
-        grid_search = GridSearchCV(
-            estimator=model,
-            param_grid=param_grid,
-            cv=cv,
-            scoring=scoring,
-            n_jobs=-1,
-            verbose=1,
-            return_train_score=True
-        )
         start_time = time()
-        grid_search.fit(X_train, y_train)
+        grid_search = self.search(model, model_type, list(ParameterGrid(param_grid)), X_train, y_train, cv, scoring)
         end_time = time()
         total_time = end_time - start_time
         logger.info(f"Grid search hoàn thành trong {total_time:.2f} giây")
@@ -126,7 +371,8 @@ class ModelTuner:
         self.tuning_results[f"{model_type}_grid"] = {
             'best_params': grid_search.best_params_,
             'best_score': float(grid_search.best_score_),
-            'execution_time': float(total_time)
+            'execution_time': float(total_time),
+            'n_evaluated': grid_search.n_evaluated_
         }
         self.save_results()
         return grid_search
@@ -139,19 +385,10 @@ class ModelTuner:
             logger.error(f"Không tìm thấy phân phối tham số cho {model_type}")
             return None
         param_dist = param_distributions[model_type]
-        random_search = RandomizedSearchCV(
-            estimator=model,
-            param_distributions=param_dist,
-            n_iter=n_iter,
-            cv=cv,
-            scoring=scoring,
-            n_jobs=-1,
-            verbose=1,
-            random_state=42,
-            return_train_score=True
-        )
+        # Cùng các lần rút như RandomizedSearchCV(random_state=42)
+        candidates = list(ParameterSampler(param_dist, n_iter=n_iter, random_state=42))
         start_time = time()
-        random_search.fit(X_train, y_train)
+        random_search = self.search(model, model_type, candidates, X_train, y_train, cv, scoring)
         end_time = time()
         total_time = end_time - start_time
         logger.info(f"Random search hoàn thành trong {total_time:.2f} giây")
@@ -160,11 +397,110 @@ class ModelTuner:
         self.tuning_results[f"{model_type}_random"] = {
             'best_params': random_search.best_params_,
             'best_score': float(random_search.best_score_),
-            'execution_time': float(total_time)
+            'execution_time': float(total_time),
+            'n_evaluated': random_search.n_evaluated_
         }
         self.save_results()
         return random_search
 
+    def search(self, model, model_type, candidates, X_train, y_train, cv, scoring):
+        """
+        Đánh giá các cấu hình bằng cross-validation, lấy điểm từ cache khi có,
+        rồi fit lại cấu hình tốt nhất trên toàn bộ dữ liệu.
+
+        Returns:
+            CachedSearchResult (best_params_, best_score_, best_estimator_, cv_results_)
+        """
+        cv = check_cv(cv, y_train, classifier=False)
+        n_requested = len(candidates)
+        if self.prune:
+            candidates = [canonical_params(params) for params in candidates]
+        else:
+            candidates = [{name: to_python(value) for name, value in params.items()} for params in candidates]
+        # Cấu hình trùng nhau (random search có thể rút lại, tổ hợp tương đương) chỉ giữ một
+        candidates = list({json.dumps(params, sort_keys=True, default=repr): params for params in candidates}.values())
+        # Ma trận float32 dùng chung và chỉ số fold tính một lần cho mọi cấu hình
+        with shared_training_data(X_train, y_train) as (X_shared, y_shared):
+            splits = fold_indices(cv, X_shared, y_shared)
+            costs = np.ones(len(candidates))
+            if self.prune:
+                costs, invalid = estimate_costs(model, candidates, X_shared, y_shared)
+                valid = [i for i, params in enumerate(candidates)
+                         if not any((name, value) in invalid for name, value in params.items())]
+                candidates, costs = [candidates[i] for i in valid], costs[valid]
+                if invalid:
+                    logger.info(f"Giá trị tham số không hợp lệ: {sorted(invalid, key=repr)}")
+            if len(candidates) < n_requested:
+                logger.info(f"Bỏ {n_requested - len(candidates)} / {n_requested} cấu hình trùng, tương đương hoặc không hợp lệ")
+            if not candidates:
+                raise ValueError(f"Không có cấu hình hợp lệ nào cho {model_type}")
+
+            if self.cache is not None:
+                fingerprint = dataset_fingerprint(X_train, y_train)
+                base_params = model.get_params()
+                keys = [CVScoreCache.make_key(fingerprint, model_type, dict(base_params, **params), cv, scoring)
+                        for params in candidates]
+                results = self.cache.get_many(set(keys))
+            else:
+                keys = [json.dumps(params, sort_keys=True, default=repr) for params in candidates]
+                results = {}
+
+            # Chạy cấu hình rẻ trước: cấu hình tốt sớm có mặt để cắt sớm cấu hình đắt
+            missing = {keys[i]: candidates[i] for i in np.argsort(costs, kind='stable') if keys[i] not in results}
+            logger.info(f"{len(candidates)} cấu hình: {len(candidates) - len(missing)} đã có trong cache, "
+                        f"đánh giá {len(missing)} cấu hình x {len(splits)} fold")
+
+            def mean_score(result):
+                test = [np.nan if v is None else v for v in result['test_score']]
+                return np.nan if result.get('pruned') else float(np.mean(test))
+
+            cutoff = self.early_cutoff and isinstance(scoring, str) and scoring.startswith('neg_')
+            known = [score for score in map(mean_score, results.values()) if not np.isnan(score)]
+            incumbent = {'score': max(known) if known else None}
+            outer, inner = split_cpu_budget(len(missing), self.n_jobs, 'n_jobs' in model.get_params())
+            # Ngưỡng được đọc lúc giao việc nên các cấu hình sau dùng cấu hình tốt nhất mới nhất
+            outputs = Parallel(n_jobs=outer, return_as='generator')(
+                delayed(fold_scores)(model, params, X_shared, y_shared, splits, scoring,
+                                     incumbent['score'] if cutoff else None, inner)
+                for params in missing.values()
+            )
+            n_pruned = 0
+            for (key, params), result in zip(missing.items(), outputs):
+                results[key] = result
+                if result.get('pruned'):
+                    n_pruned += 1
+                    continue
+                score = mean_score(result)
+                if not np.isnan(score) and (incumbent['score'] is None or score > incumbent['score']):
+                    incumbent['score'] = score
+                # Ghi ngay từng cấu hình để lần chạy bị ngắt vẫn giữ được phần đã tính
+                if self.cache is not None:
+                    self.cache.put(key, model_type, dict(model.get_params(), **params), result)
+            if n_pruned:
+                logger.info(f"Dừng sớm {n_pruned} cấu hình không thể vượt cấu hình tốt nhất")
+
+        cv_results = {'params': candidates, 'mean_test_score': [], 'std_test_score': [],
+                      'mean_train_score': [], 'mean_fit_time': [], 'split_test_scores': [],
+                      'estimated_cost': [float(c) for c in costs], 'pruned': []}
+        for key in keys:
+            result = results[key]
+            test = np.array([np.nan if v is None else v for v in result['test_score']])
+            train = np.array([np.nan if v is None else v for v in result['train_score']])
+            cv_results['pruned'].append(bool(result.get('pruned')))
+            cv_results['mean_test_score'].append(mean_score(result))
+            cv_results['std_test_score'].append(float(np.std(test)))
+            cv_results['mean_train_score'].append(float(np.mean(train)))
+            cv_results['mean_fit_time'].append(float(np.mean(result['fit_time'])))
+            cv_results['split_test_scores'].append(result['test_score'])
+        mean_scores = np.array(cv_results['mean_test_score'])
+        if np.isnan(mean_scores).all():
+            raise ValueError(f"Không có cấu hình nào của {model_type} huấn luyện thành công")
+        best_index = int(np.nanargmax(mean_scores))
+        best_estimator = refit_best(model, candidates[best_index], X_train, y_train, self.n_jobs)
+        result = CachedSearchResult(cv_results, best_index, best_estimator)
+        result.n_evaluated_ = len(missing)
+        return result
+
     def save_results(self):
         result_path = os.path.join(self.output_dir, 'tuning_results.json')
         with open(result_path, 'w', encoding='utf-8') as f:
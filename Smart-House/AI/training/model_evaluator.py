@@ -62,6 +62,22 @@ class ModelEvaluator:
                 'predictions': y_pred_temp,
                 'actuals': y_test_temp
             }
+            # Mô hình nhiều mốc: thêm chỉ số riêng cho từng mốc dự báo
+            if np.ndim(y_pred_temp) == 2:
+                outputs = getattr(y_test_temp, 'columns', range(y_pred_temp.shape[1]))
+                actuals = np.asarray(y_test_temp)
+                per_output = {}
+                for i, name in enumerate(outputs):
+                    mse = mean_squared_error(actuals[:, i], y_pred_temp[:, i])
+                    per_output[str(name)] = {
+                        'mse': mse,
+                        'rmse': np.sqrt(mse),
+                        'mae': mean_absolute_error(actuals[:, i], y_pred_temp[:, i]),
+                        'r2': r2_score(actuals[:, i], y_pred_temp[:, i])
+                    }
+                    logger.info(f"  {name} - RMSE: {per_output[str(name)]['rmse']:.4f}, "
+                               f"R²: {per_output[str(name)]['r2']:.4f}")
+                results['temperature']['per_output'] = per_output
         else:
             logger.warning("Không thể đánh giá mô hình nhiệt độ: model hoặc dữ liệu thiếu")
         self.results = results
@@ -87,8 +103,9 @@ class ModelEvaluator:
         
         # Biểu đồ nhiệt độ
         if 'temperature' in self.results:
-            temp_actual = self.results['temperature']['actuals']
-            temp_predicted = self.results['temperature']['predictions']
+            # Mô hình nhiều mốc: gộp mọi mốc vào cùng một biểu đồ
+            temp_actual = np.asarray(self.results['temperature']['actuals']).ravel()
+            temp_predicted = np.asarray(self.results['temperature']['predictions']).ravel()
             # Reset index để đảm bảo index liên tục
             if isinstance(temp_actual, (pd.Series, np.ndarray)):
                 temp_actual = pd.Series(temp_actual).reset_index(drop=True)
@@ -113,8 +130,8 @@ class ModelEvaluator:
         
         # Biểu đồ lỗi nhiệt độ
         if 'temperature' in self.results:
-            temp_actual = self.results['temperature']['actuals']
-            temp_predicted = self.results['temperature']['predictions']
+            temp_actual = np.asarray(self.results['temperature']['actuals']).ravel()
+            temp_predicted = np.asarray(self.results['temperature']['predictions']).ravel()
             temp_errors = temp_predicted - temp_actual
             plt.hist(temp_errors, bins=30, alpha=0.7, color='red')
             plt.axvline(x=0, color='k', linestyle='--')
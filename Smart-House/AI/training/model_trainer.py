@@ -1,11 +1,16 @@
 
 import os
+import math
+import time
 import pickle
 import logging
 import numpy as np
+from sklearn.base import clone
 from sklearn.tree import DecisionTreeRegressor
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import GridSearchCV
+from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+from sklearn.model_selection import GridSearchCV, ParameterGrid, cross_val_score
+
+from shared_matrix import shared_training_data, fold_indices, split_cpu_budget, with_inner_jobs, refit_best
 
 # Cấu hình logging
 logging.basicConfig(
@@ -19,17 +24,190 @@ logging.basicConfig(
 
 logger = logging.getLogger("model_trainer")
 
+# Successive halving: mỗi vòng giữ 1/HALVING_FACTOR cấu hình tốt nhất và tăng
+# tài nguyên (số mẫu hoặc số cây) lên HALVING_FACTOR lần
+HALVING_FACTOR = 3
+MIN_RESOURCES = {'n_samples': 500, 'n_estimators': 25}
+
+def subsample(data, rows):
+    return data.iloc[rows] if hasattr(data, 'iloc') else data[rows]
+
+def successive_halving_search(estimator, param_grid, X, y, cv=5, resource='n_samples',
+                              factor=HALVING_FACTOR, min_resources=None, time_budget=None,
+                              scoring='neg_mean_squared_error', n_jobs=-1, random_state=42, refit=True):
+    """
+    Tìm kiếm successive halving với giới hạn thời gian.
+
+    Mọi cấu hình được đánh giá (cross-validation) với ít tài nguyên ở vòng đầu:
+    một phần dữ liệu (resource='n_samples') hoặc ít cây (resource='n_estimators').
+    Sau mỗi vòng chỉ giữ 1/factor cấu hình tốt nhất và tăng tài nguyên factor
+    lần, vòng cuối dùng toàn bộ dữ liệu / số cây lớn nhất. Cấu hình lỗi (điểm
+    NaN) bị loại ngay ở vòng đầu.
+
+    Khi hết time_budget (giây) tìm kiếm dừng trước cấu hình kế tiếp và chọn cấu
+    hình tốt nhất của vòng xa nhất đã có kết quả. Lần fit lại trên toàn bộ dữ
+    liệu sau cùng không tính vào ngân sách.
+
+    Chỉ số fold của mỗi vòng được tính một lần cho mọi cấu hình; CPU được chia
+    giữa các fold (song song ngoài) và n_jobs của estimator (song song trong).
+
+    Returns:
+        dict: best_params, best_score, best_estimator (None khi refit=False),
+        history (mỗi lần đánh giá một dòng), budget_exhausted, elapsed
+    """
+    start = time.perf_counter()
+    deadline = start + time_budget if time_budget else None
+    candidates = list(ParameterGrid(param_grid))
+
+    if resource == 'n_samples':
+        max_resources = len(X)
+        order = np.random.RandomState(random_state).permutation(len(X))
+    else:
+        max_resources = max(param_grid.get(resource, [getattr(estimator, resource)]))
+        # Tài nguyên do thuật toán phân bổ nên bỏ khỏi lưới tham số
+        candidates = list(ParameterGrid({k: v for k, v in param_grid.items() if k != resource}))
+    min_resources = min(min_resources or MIN_RESOURCES.get(resource, 1), max_resources)
+
+    # Số vòng bị giới hạn bởi cả số cấu hình lẫn khoảng tài nguyên [min, max];
+    # vòng cuối có thể còn nhiều hơn một cấu hình
+    n_rounds = 1 + min(
+        math.ceil(math.log(len(candidates), factor)) if len(candidates) > 1 else 0,
+        int(math.log(max_resources / min_resources, factor) + 1e-9)
+    )
+    history = []
+    survivors = candidates
+    best = None
+    budget_exhausted = False
+    for round_idx in range(n_rounds):
+        n_resources = max(min_resources, int(max_resources / factor ** (n_rounds - 1 - round_idx)))
+        logger.info(f"Vòng {round_idx + 1}/{n_rounds}: {len(survivors)} cấu hình, {resource}={n_resources}")
+        if resource == 'n_samples':
+            X_round, y_round = subsample(X, order[:n_resources]), subsample(y, order[:n_resources])
+        else:
+            X_round, y_round = X, y
+        folds = fold_indices(cv, X_round, y_round)
+        outer, inner = split_cpu_budget(len(folds), n_jobs, 'n_jobs' in estimator.get_params())
+
+        scored = []
+        for params in survivors:
+            if deadline is not None and time.perf_counter() > deadline and (scored or history):
+                budget_exhausted = True
+                break
+            model = with_inner_jobs(clone(estimator).set_params(**params), inner)
+            if resource != 'n_samples':
+                model.set_params(**{resource: n_resources})
+            try:
+                score = float(np.mean(cross_val_score(model, X_round, y_round, cv=folds, scoring=scoring, n_jobs=outer)))
+            except ValueError as e:
+                logger.warning(f"Bỏ cấu hình {params}: {str(e).strip().splitlines()[-1]}")
+                score = float('nan')
+            history.append({'round': round_idx, 'n_resources': n_resources, 'params': params, 'score': score})
+            if not np.isnan(score):
+                scored.append((score, params))
+
+        if scored:
+            scored.sort(key=lambda item: item[0], reverse=True)
+            best = scored[0]
+        if budget_exhausted:
+            logger.warning(f"Hết ngân sách thời gian {time_budget:.0f} s ở vòng {round_idx + 1}/{n_rounds}")
+            break
+        survivors = [params for _, params in scored[:max(1, math.ceil(len(scored) / factor))]]
+
+    if best is None:
+        raise ValueError("Không có cấu hình nào huấn luyện thành công")
+    best_score, best_params = best
+    if resource != 'n_samples':
+        best_params = dict(best_params, **{resource: max_resources})
+    best_estimator = refit_best(estimator, best_params, X, y, n_jobs) if refit else None
+    elapsed = time.perf_counter() - start
+    logger.info(f"Successive halving: {len(history)} lần đánh giá trong {elapsed:.1f} s "
+                f"(grid đầy đủ: {len(list(ParameterGrid(param_grid)))} cấu hình)")
+    return {
+        'best_params': best_params,
+        'best_score': best_score,
+        'best_estimator': best_estimator,
+        'history': history,
+        'budget_exhausted': budget_exhausted,
+        'elapsed': elapsed
+    }
+
+def export_forest_arrays(model, output_path, feature_names=None, horizons=None):
+    """
+    Làm phẳng DecisionTreeRegressor / RandomForestRegressor thành các bảng nút
+    và lưu thành file .npz không nén (có thể memory-map khi suy luận).
+
+    Các cây được nối liền nhau; chỉ số con trái/phải là chỉ số toàn cục.
+    Nút lá có left == right == -1 và feature == 0.
+
+    Args:
+        model: Mô hình cây đã huấn luyện
+        output_path: Đường dẫn file .npz đầu ra
+        feature_names: Tên các đặc trưng theo đúng thứ tự cột
+        horizons: Các mốc dự báo (phút) nếu là mô hình nhiều đầu ra
+
+    Returns:
+        True nếu xuất thành công, False nếu loại mô hình không được hỗ trợ
+    """
+    if isinstance(model, RandomForestRegressor):
+        trees = [estimator.tree_ for estimator in model.estimators_]
+    elif isinstance(model, DecisionTreeRegressor):
+        trees = [model.tree_]
+    else:
+        logger.warning(f"Không hỗ trợ xuất bảng nút cho mô hình {type(model).__name__}")
+        return False
+
+    roots = np.zeros(len(trees), dtype=np.int32)
+    features, thresholds, lefts, rights, values = [], [], [], [], []
+    offset = 0
+    for i, tree in enumerate(trees):
+        roots[i] = offset
+        is_leaf = tree.children_left == -1
+        features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        thresholds.append(tree.threshold.astype(np.float64))
+        lefts.append(np.where(is_leaf, -1, tree.children_left + offset).astype(np.int32))
+        rights.append(np.where(is_leaf, -1, tree.children_right + offset).astype(np.int32))
+        # value có dạng (n_nodes, n_outputs, 1) với bài toán hồi quy
+        values.append(tree.value[:, :, 0].astype(np.float64))
+        offset += tree.node_count
+
+    if feature_names is None:
+        feature_names = getattr(model, 'feature_names_in_', [])
+    if horizons is None:
+        horizons = getattr(model, 'forecast_horizons_', None) or []
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    # np.savez (không nén) để từng mảng có thể được mmap trực tiếp từ file
+    np.savez(
+        output_path,
+        roots=roots,
+        feature=np.concatenate(features),
+        threshold=np.concatenate(thresholds),
+        left=np.concatenate(lefts),
+        right=np.concatenate(rights),
+        value=np.concatenate(values),
+        max_depth=np.int32(max(tree.max_depth for tree in trees)),
+        feature_names=np.array(list(feature_names), dtype=str),
+        horizons=np.array(list(horizons), dtype=np.int32)
+    )
+    logger.info(f"Đã xuất {len(trees)} cây ({offset} nút) vào {output_path}")
+    return True
+
 class TemperatureModelTrainer:
     """Lớp huấn luyện mô hình cho dự đoán nhiệt độ."""
     
-    def __init__(self, model_type='decision_tree'):
+    def __init__(self, model_type='decision_tree', horizons=None):
         """
         Khởi tạo trainer với loại mô hình được chỉ định.
         
         Args:
             model_type: Loại mô hình ('decision_tree' hoặc 'random_forest')
+            horizons: Các mốc dự báo (phút) khi huấn luyện một mô hình nhiều đầu ra
+                dự báo trực tiếp mọi mốc; None cho mô hình một đầu ra
         """
         self.model_type = model_type
+        self.horizons = list(horizons) if horizons else None
         self.temp_model = None
         self.feature_names = None
         self.best_params_temp = None
@@ -39,26 +217,39 @@ class TemperatureModelTrainer:
         Tạo mô hình dựa trên loại được chỉ định.
         
         Args:
-            model_type: Loại mô hình ('decision_tree' hoặc 'random_forest')
+            model_type: Loại mô hình ('decision_tree', 'random_forest' hoặc 'gradient_boosting')
             
         Returns:
             Model scikit-learn
         """
         if model_type == 'random_forest':
             return RandomForestRegressor(random_state=42)
+        elif model_type == 'gradient_boosting':
+            return GradientBoostingRegressor(random_state=42)
         else:  # Mặc định: decision_tree
             return DecisionTreeRegressor(max_depth=10, min_samples_leaf=2, max_features='sqrt', random_state=42)
     
-    def train_models(self, X_train, X_test, y_train_temp, y_test_temp, cv=5):
+    def train_models(self, X_train, X_test, y_train_temp, y_test_temp, cv=5, search='grid', time_budget=None,
+                     n_jobs=-1):
         """
         
         Args:
             X_train: Đặc trưng huấn luyện
             X_test: Đặc trưng kiểm tra
             y_train_temp: Giá trị nhiệt độ mục tiêu cho huấn luyện
+                (DataFrame nhiều cột - mỗi cột một mốc - với mô hình nhiều mốc)
             y_test_temp: Giá trị nhiệt độ mục tiêu cho kiểm tra
             cv: Số fold cho cross-validation
+            search: 'grid' (GridSearchCV toàn bộ lưới) hoặc 'halving' (successive
+                halving - tài nguyên là số mẫu với cây quyết định, số cây với
+                random forest)
+            time_budget: Ngân sách thời gian tìm kiếm (giây); khi đặt, tìm kiếm
+                luôn dùng successive halving để có thể dừng sớm
+            n_jobs: Tổng số CPU cho tìm kiếm (-1: mọi CPU), chia giữa các fit
+                song song và n_jobs của estimator
         """
+        if self.horizons and getattr(y_train_temp, 'ndim', 1) != 2:
+            raise ValueError("Mô hình nhiều mốc cần y_train_temp dạng DataFrame, mỗi cột một mốc")
         logger.info("Bắt đầu huấn luyện mô hình")
         self.feature_names = X_train.columns.tolist()
         
@@ -69,7 +260,15 @@ class TemperatureModelTrainer:
                 'max_depth': [None, 10, 20, 30],
                 'min_samples_split': [2, 5, 10],
                 'min_samples_leaf': [1, 2, 4],
-                'max_features': ['auto', 'sqrt']
+                # None thay cho 'auto' (đã bị scikit-learn bỏ, cùng nghĩa: mọi đặc trưng)
+                'max_features': [None, 'sqrt']
+            }
+        elif self.model_type == 'gradient_boosting':
+            param_grid = {
+                'n_estimators': [100, 200, 300],
+                'learning_rate': [0.05, 0.1],
+                'max_depth': [3, 5],
+                'min_samples_leaf': [10, 20]
             }
         else:  # Decision Tree
             param_grid = {
@@ -81,20 +280,45 @@ class TemperatureModelTrainer:
         # Mô hình nhiệt độ
         logger.info("Huấn luyện mô hình nhiệt độ")
         temp_base_model = self._create_model(self.model_type)
-        temp_grid = GridSearchCV(
-            temp_base_model,
-            param_grid,
-            cv=cv,
-            scoring='neg_mean_squared_error',
-            n_jobs=-1,
-            verbose=1
-        )
-        temp_grid.fit(X_train, y_train_temp)
-        
+        if time_budget and search == 'grid':
+            logger.info("Có ngân sách thời gian: dùng successive halving thay cho grid search")
+            search = 'halving'
+
+        # Tìm kiếm trên ma trận float32 dùng chung; fit lại cuối cùng trên DataFrame gốc
+        with shared_training_data(X_train, y_train_temp) as (X_shared, y_shared):
+            if search == 'halving':
+                resource = 'n_estimators' if self.model_type in ('random_forest', 'gradient_boosting') else 'n_samples'
+                result = successive_halving_search(
+                    temp_base_model,
+                    param_grid,
+                    X_shared,
+                    y_shared,
+                    cv=cv,
+                    resource=resource,
+                    time_budget=time_budget,
+                    n_jobs=n_jobs,
+                    refit=False
+                )
+                self.best_params_temp = result['best_params']
+            else:
+                folds = fold_indices(cv, X_shared, y_shared)
+                outer, inner = split_cpu_budget(len(ParameterGrid(param_grid)) * len(folds), n_jobs,
+                                                'n_jobs' in temp_base_model.get_params())
+                temp_grid = GridSearchCV(
+                    with_inner_jobs(clone(temp_base_model), inner),
+                    param_grid,
+                    cv=folds,
+                    scoring='neg_mean_squared_error',
+                    n_jobs=outer,
+                    verbose=1,
+                    refit=False
+                )
+                temp_grid.fit(X_shared, y_shared)
+                self.best_params_temp = temp_grid.best_params_
+
         # Lấy mô hình tốt nhất cho nhiệt độ
-        self.temp_model = temp_grid.best_estimator_
-        self.best_params_temp = temp_grid.best_params_
-        logger.info(f"Tham số tốt nhất cho mô hình nhiệt độ: {temp_grid.best_params_}")
+        self.temp_model = refit_best(temp_base_model, self.best_params_temp, X_train, y_train_temp, n_jobs)
+        logger.info(f"Tham số tốt nhất cho mô hình nhiệt độ: {self.best_params_temp}")
         
         return {
             'temp_best_params': self.best_params_temp
@@ -118,8 +342,15 @@ class TemperatureModelTrainer:
             logger.error("Chỉ hỗ trợ dự đoán nhiệt độ.")
             return None
     
-    def save_models(self, temp_model_path='temp_model.pkl'):
-        """Lưu mô hình đã huấn luyện vào đĩa."""
+    def save_models(self, temp_model_path='temp_model.pkl', export_arrays=True):
+        """
+        Lưu mô hình đã huấn luyện vào đĩa.
+
+        Args:
+            temp_model_path: Đường dẫn file .pkl
+            export_arrays: Đồng thời xuất bảng nút dạng .npz cùng tên để
+                predict.py suy luận không cần import scikit-learn
+        """
         if self.temp_model is None:
             logger.error("Mô hình chưa được huấn luyện. Hãy gọi train_models() trước.")
             return False
@@ -127,8 +358,20 @@ class TemperatureModelTrainer:
         if temp_dir and not os.path.exists(temp_dir):
             os.makedirs(temp_dir)
         import joblib
+        if self.horizons:
+            # Ghi lại các mốc dự báo để predict.py biết ý nghĩa từng đầu ra
+            self.temp_model.forecast_horizons_ = list(self.horizons)
         joblib.dump(self.temp_model, temp_model_path)
         logger.info(f"Đã lưu mô hình nhiệt độ vào {temp_model_path}")
+        if export_arrays:
+            arrays_path = os.path.splitext(temp_model_path)[0] + '.npz'
+            if not export_forest_arrays(self.temp_model, arrays_path, self.feature_names, self.horizons):
+                # Không có bảng nút: predict.py phục vụ mô hình qua model.predict của file .pkl.
+                # Xoá bảng nút cũ (của mô hình trước) để nó không được tải thay cho mô hình này
+                if os.path.exists(arrays_path):
+                    os.remove(arrays_path)
+                logger.info(f"Không xuất bảng nút cho {type(self.temp_model).__name__}; "
+                            f"predict.py sẽ dùng model.predict từ {temp_model_path}")
         return True
     
     def load_models(self, temp_model_path='temp_model.pkl'):
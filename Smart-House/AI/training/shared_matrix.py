@@ -0,0 +1,118 @@
+"""
+YoloHome AI Module - Shared Training Matrix
+==========================================
+Chuẩn bị dữ liệu huấn luyện cho cross-validation song song: đặc trưng được
+đổi một lần sang mảng float32 liền khối (kiểu mà cây quyết định dùng nội bộ,
+nên mỗi lần fit không phải chép / đổi kiểu lại) và, khi đủ lớn, ghi ra
+memmap để mọi tiến trình con cùng đọc một bản trên đĩa thay vì nhận bản sao
+pickle của DataFrame.
+
+Kèm theo là chỉ số các fold tính sẵn và bộ chia CPU giữa song song ngoài
+(các fit của cross-validation) và song song trong (n_jobs của estimator).
+"""
+
+import os
+import shutil
+import logging
+import tempfile
+import numpy as np
+from contextlib import contextmanager
+from sklearn.base import clone
+from sklearn.model_selection import check_cv
+
+logger = logging.getLogger("shared_matrix")
+
+# Mảng nhỏ hơn ngưỡng này giữ trong bộ nhớ (chép sang tiến trình con rẻ hơn tạo file)
+SHARED_MIN_NBYTES = 1 << 20
+
+def available_cpus():
+    """Số CPU tiến trình được phép dùng (tôn trọng taskset / cgroup affinity)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def split_cpu_budget(n_tasks, n_jobs=-1, inner_parallel=True):
+    """
+    Chia số CPU cho song song ngoài và song song trong.
+
+    Song song ngoài được ưu tiên (các fit độc lập, không phải đồng bộ); CPU
+    còn dư khi có ít việc hơn số CPU (ví dụ vòng cuối successive halving, lần
+    fit lại cuối cùng) được giao cho n_jobs của estimator, để tích hai mức
+    không vượt quá số CPU.
+
+    Args:
+        n_tasks: Số việc độc lập ở mức ngoài (cấu hình x fold...)
+        n_jobs: Tổng số CPU theo quy ước joblib (-1: mọi CPU, -2: trừ một...)
+        inner_parallel: Estimator có tham số n_jobs hay không
+
+    Returns:
+        (outer, inner)
+    """
+    cpus = available_cpus()
+    if n_jobs is None:
+        total = 1
+    elif n_jobs < 0:
+        total = max(cpus + 1 + n_jobs, 1)
+    else:
+        total = max(min(n_jobs, cpus), 1)
+    outer = max(min(total, n_tasks), 1)
+    inner = max(total // outer, 1) if inner_parallel else 1
+    return outer, inner
+
+def with_inner_jobs(estimator, inner):
+    """Đặt n_jobs của estimator (nếu có) cho song song trong"""
+    if 'n_jobs' in estimator.get_params():
+        estimator.set_params(n_jobs=inner)
+    return estimator
+
+def fold_indices(cv, X, y):
+    """Chỉ số (train, test) của các fold, tính một lần và dùng lại cho mọi cấu hình"""
+    cv = check_cv(cv, y, classifier=False)
+    return [(train.astype(np.int32), test.astype(np.int32)) for train, test in cv.split(X, y)]
+
+@contextmanager
+def shared_training_data(X, y, temp_folder=None, min_nbytes=SHARED_MIN_NBYTES):
+    """
+    Đổi X sang float32 liền khối (memmap chỉ đọc nếu lớn hơn min_nbytes) và y
+    sang mảng float64; file tạm bị xoá khi thoát khỏi khối with.
+
+    joblib gửi memmap sang tiến trình con bằng tên file nên các worker dùng
+    chung trang bộ nhớ của hệ điều hành thay vì mỗi worker một bản sao.
+
+    Yields:
+        (X_shared, y_shared)
+    """
+    X_array = np.ascontiguousarray(np.asarray(X, dtype=np.float32))
+    y_shared = np.asarray(y, dtype=np.float64)
+    if X_array.nbytes < min_nbytes:
+        yield X_array, y_shared
+        return
+
+    folder = tempfile.mkdtemp(prefix='yolohome_train_', dir=temp_folder)
+    try:
+        path = os.path.join(folder, 'X.f32')
+        writer = np.memmap(path, dtype=np.float32, mode='w+', shape=X_array.shape)
+        writer[:] = X_array
+        writer.flush()
+        del writer, X_array
+        X_shared = np.memmap(path, dtype=np.float32, mode='r', shape=np.shape(X))
+        logger.info(f"Ma trận huấn luyện {X_shared.shape} float32 ({X_shared.nbytes / 1e6:.1f} MB) dùng chung qua {path}")
+        yield X_shared, y_shared
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+def refit_best(estimator, params, X, y, n_jobs=-1):
+    """
+    Fit lại cấu hình tốt nhất trên dữ liệu gốc (giữ tên cột cho
+    feature_names_in_), dành mọi CPU cho n_jobs của estimator; n_jobs được
+    trả về giá trị ban đầu sau khi fit để mô hình lưu ra không mang theo số
+    CPU của máy huấn luyện.
+    """
+    model = clone(estimator).set_params(**params)
+    original = model.get_params().get('n_jobs')
+    with_inner_jobs(model, split_cpu_budget(1, n_jobs, 'n_jobs' in model.get_params())[1])
+    model.fit(X, y)
+    if 'n_jobs' in model.get_params():
+        model.set_params(n_jobs=original)
+    return model
@@ -8,17 +8,28 @@ Script chính để train model Decision Tree cho dự đoán nhiệt độ.
 import os
 import sys
 import json
+import shutil
 import argparse
+import tempfile
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from datetime import datetime
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 
 # Import các module xử lý dữ liệu và train model
-from data_processor import SensorDataProcessor
+from data_processor import SensorDataProcessor, RESAMPLE_AGGREGATIONS
+from frame_store import store_path, save_frame, load_frame
 from model_trainer import TemperatureModelTrainer
 from model_evaluator import ModelEvaluator
-from hyperparameter_tuning import ModelTuner
+from hyperparameter_tuning import ModelTuner, CV_CACHE_FILE
+from shared_matrix import split_cpu_budget
+
+MODEL_FAMILIES = ['decision_tree', 'random_forest', 'gradient_boosting']
+# Chỉ số chọn mô hình với --model-type all: True nếu giá trị cao hơn là tốt hơn
+SELECTION_METRICS = {'rmse': False, 'mse': False, 'mae': False, 'r2': True}
+SPLIT_PARTS = ['X_train', 'X_test', 'y_train', 'y_test']
 
 def generate_sample_data(days=14, readings_per_hour=12, output_file='sensor_data.csv'):
     """
@@ -91,7 +102,14 @@ def plot_data(df, output_dir='.'):
     
     plt.figure(figsize=(12, 8))
     # Biểu đồ nhiệt độ
-    plt.plot(df['recorded_time'], df['temperature'], 'r-')
+    if 'temperature' in df.columns:
+        plt.plot(df['recorded_time'], df['temperature'], 'r-')
+    else:
+        # Dữ liệu dạng dài: mỗi sensor một đường nhiệt độ
+        temps = df[df['variable'].astype(str).str.lower() == 'temperature']
+        for sensor_id, group in temps.groupby('sensor_id'):
+            plt.plot(group['recorded_time'], group['value'], label=str(sensor_id))
+        plt.legend()
     plt.xlabel('Thời gian')
     plt.ylabel('Nhiệt độ (°C)')
     plt.title('Dữ liệu nhiệt độ')
@@ -102,6 +120,169 @@ def plot_data(df, output_dir='.'):
     
     print(f"Đã lưu biểu đồ dữ liệu vào {os.path.join(output_dir, 'sensor_data.png')}")
 
+def preprocess(processor, args):
+    """
+    Tiền xử lý (toàn bộ hoặc tăng dần với --incremental) và lưu dữ liệu đã xử lý
+    vào output_dir theo --processed-format.
+    """
+    processed_data_file = store_path(os.path.join(args.output_dir, 'processed_sensor_data'), args.processed_format)
+    state_file = os.path.join(args.output_dir, 'preprocess_state.json')
+    new_rows = None
+    if args.incremental and os.path.exists(processed_data_file) and processor.load_state(state_file):
+        # Chỉ xử lý các bản ghi mới, nối vào file đã xử lý
+        processor.load_processed_data(processed_data_file)
+        new_rows = processor.preprocess_incremental()
+    if new_rows is not None:
+        if processed_data_file.endswith('.csv'):
+            processor.append_processed_data(new_rows, processed_data_file)
+        else:
+            # Định dạng cột không nối tại chỗ được: ghi lại toàn bộ dữ liệu đã nối
+            processor.save_processed_data(processed_data_file)
+        print(f"Đã nối {len(new_rows)} hàng mới vào '{processed_data_file}'")
+        # Huấn luyện trên cùng cửa sổ filter_hours như khi xử lý toàn bộ
+        latest = processor.processed_data['recorded_time'].max()
+        window_start = latest - pd.Timedelta(hours=processor.filter_hours)
+        processor.processed_data = processor.processed_data[processor.processed_data['recorded_time'] >= window_start]
+    else:
+        processor.preprocess_data()
+        processor.save_processed_data(processed_data_file)
+        print(f"Đã lưu dữ liệu đã xử lý vào '{processed_data_file}'")
+    if processor.state is not None:
+        # Dữ liệu nhiều sensor chưa hỗ trợ tiền xử lý tăng dần nên không có state
+        processor.save_state(state_file)
+    if args.compact and processor.memory_report:
+        print(f"Chế độ compact: {processor.memory_report['actual_mb']:.1f} MB, "
+              f"tiết kiệm {processor.memory_report['saved_mb']:.1f} MB so với kiểu mặc định")
+    return True
+
+def train_family(model_type, X_train, X_test, y_train_temp, y_test_temp, args, horizons,
+                 n_jobs, tuning_dir):
+    """
+    Huấn luyện một loại mô hình (tối ưu tham số nếu --tune) và đánh giá trên tập test.
+
+    Args:
+        n_jobs: Số CPU dành cho loại mô hình này
+        tuning_dir: Thư mục lưu tuning_results.json của ModelTuner
+
+    Returns:
+        (trainer, các chỉ số đánh giá mse / rmse / mae / r2, ModelEvaluator đã
+        đánh giá mô hình - dùng lại cho báo cáo mà không phải dự đoán lại)
+    """
+    trainer = TemperatureModelTrainer(model_type=model_type, horizons=horizons)
+    if args.tune:
+        # Cache điểm cross-validation dùng chung cho mọi loại mô hình (SQLite chịu được ghi đồng thời)
+        tuner = ModelTuner(output_dir=tuning_dir, use_cache=not args.no_cv_cache,
+                           cache_path=os.path.join(args.output_dir, CV_CACHE_FILE),
+                           n_jobs=n_jobs, early_cutoff=args.early_cutoff)
+        best_params_temp = None
+        if args.tune_method in ['grid', 'both']:
+            temp_grid = tuner.tune_model_grid(X_train, y_train_temp, model_type=model_type, cv=args.cv)
+            best_params_temp = temp_grid.best_params_
+        if args.tune_method in ['random', 'both']:
+            temp_random = tuner.tune_model_random(X_train, y_train_temp, model_type=model_type, cv=args.cv)
+            if not best_params_temp or temp_random.best_score_ > temp_grid.best_score_:
+                best_params_temp = temp_random.best_params_
+        print(f"Tham số tốt nhất cho mô hình {model_type}: {best_params_temp}")
+        trainer.temp_model = trainer._create_model(model_type)
+        trainer.temp_model.set_params(**best_params_temp)
+        trainer.temp_model.fit(X_train, y_train_temp)
+    else:
+        trainer.train_models(X_train, X_test, y_train_temp, y_test_temp, cv=args.cv,
+                             search=args.search, time_budget=args.time_budget, n_jobs=n_jobs)
+    evaluator = ModelEvaluator()
+    results = evaluator.evaluate_models(trainer.temp_model, X_test, y_test_temp)
+    metrics = {name: float(results['temperature'][name]) for name in SELECTION_METRICS}
+    return trainer, metrics, evaluator
+
+def train_family_from_store(model_type, split_dir, args, horizons, n_jobs):
+    """Chạy trong tiến trình con: đọc lần chia train/test dùng chung (memory-map) rồi gọi train_family"""
+    X_train, X_test, y_train_temp, y_test_temp = [
+        load_frame(os.path.join(split_dir, f'{part}.npy')) for part in SPLIT_PARTS
+    ]
+    if not horizons:
+        y_train_temp, y_test_temp = y_train_temp.iloc[:, 0], y_test_temp.iloc[:, 0]
+    return (model_type,) + train_family(model_type, X_train, X_test, y_train_temp, y_test_temp, args, horizons,
+                                        n_jobs, os.path.join(args.output_dir, model_type))
+
+def check_serving(trainer, X_sample):
+    """
+    Kiểm tra mô hình có phục vụ được bằng predict.py trước khi ghi ra output:
+    lưu vào thư mục tạm, tải lại bằng find_model_file / load_model_file như
+    predict.py và so predict_with_spread với dự đoán của mô hình vừa huấn luyện.
+
+    Đặc trưng mà predict.py không tự tạo được (ví dụ các cột *_scaled) chỉ được
+    cảnh báo: mô hình vẫn chạy được khi có đủ các cột đó.
+
+    Returns:
+        (True, None) nếu phục vụ được, ngược lại (False, thông báo lỗi)
+    """
+    model_dir = tempfile.mkdtemp(prefix='yolohome_serving_')
+    saved_path = list(sys.path)
+    try:
+        # predict.py (và psycopg2 mà nó cần) chỉ được import ở đây; lỗi import
+        # được trả về như mọi lỗi phục vụ khác
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import predict
+
+        served_features = predict.MULTI_HORIZON_FEATURES if trainer.horizons else predict.FEATURE_NAMES
+        missing = [str(name) for name in X_sample.columns if name not in served_features]
+        if missing:
+            print(f"Cảnh báo: predict.py không tự tạo được các đặc trưng {missing}")
+        trainer.save_models(temp_model_path=os.path.join(model_dir, 'temp_model.pkl'))
+        served = predict.load_model_file(predict.find_model_file(model_dir), check_features=False)
+        predictions, _ = predict.predict_with_spread(served, X_sample.to_numpy(dtype=np.float32))
+        expected = trainer.temp_model.predict(X_sample)
+        if np.shape(predictions) != np.shape(expected) or not np.allclose(predictions, expected, rtol=1e-5, atol=1e-6):
+            return False, "dự đoán của predict.py khác dự đoán của mô hình đã huấn luyện"
+        return True, None
+    except Exception as e:
+        return False, f"{type(e).__name__}: {e}"
+    finally:
+        sys.path[:] = saved_path
+        shutil.rmtree(model_dir, ignore_errors=True)
+
+def compare_models(families, X_train, X_test, y_train_temp, y_test_temp, args, horizons):
+    """
+    Huấn luyện đồng thời nhiều loại mô hình trên cùng một lần chia train/test và
+    chọn mô hình tốt nhất theo --select-metric.
+
+    CPU (--train-jobs) được chia giữa các loại mô hình chạy song song và tìm
+    kiếm bên trong mỗi loại; lần chia train/test được ghi một lần ra thư mục
+    .npy tạm để các tiến trình con memory-map thay vì nhận bản sao.
+
+    Returns:
+        (loại mô hình tốt nhất, trainer và ModelEvaluator của nó, chỉ số của mọi loại mô hình)
+    """
+    outer, inner = split_cpu_budget(len(families), args.train_jobs)
+    print(f"So sánh {', '.join(families)}: {outer} tiến trình, mỗi tiến trình {inner} CPU")
+    if outer > 1:
+        split_dir = tempfile.mkdtemp(prefix='yolohome_split_')
+        try:
+            for part, data in zip(SPLIT_PARTS, [X_train, X_test, y_train_temp, y_test_temp]):
+                frame = data if isinstance(data, pd.DataFrame) else data.to_frame()
+                save_frame(frame, os.path.join(split_dir, f'{part}.npy'))
+            with ProcessPoolExecutor(max_workers=outer) as pool:
+                outputs = list(pool.map(train_family_from_store, families, repeat(split_dir),
+                                        repeat(args), repeat(horizons), repeat(inner)))
+        finally:
+            shutil.rmtree(split_dir, ignore_errors=True)
+    else:
+        outputs = [(model_type,) + train_family(model_type, X_train, X_test, y_train_temp, y_test_temp, args,
+                                                horizons, inner, os.path.join(args.output_dir, model_type))
+                   for model_type in families]
+
+    higher_is_better = SELECTION_METRICS[args.select_metric]
+    all_metrics = {model_type: metrics for model_type, _, metrics, _ in outputs}
+    best_type, best_trainer, _, best_evaluator = max(
+        outputs, key=lambda item: item[2][args.select_metric] if higher_is_better else -item[2][args.select_metric]
+    )
+    print(f"\n{'Mô hình':<20}" + ''.join(f"{name.upper():>10}" for name in SELECTION_METRICS))
+    for model_type, metrics in all_metrics.items():
+        marker = ' *' if model_type == best_type else ''
+        print(f"{model_type:<20}" + ''.join(f"{metrics[name]:>10.4f}" for name in SELECTION_METRICS) + marker)
+    print(f"Chọn {best_type} theo {args.select_metric.upper()}")
+    return best_type, best_trainer, best_evaluator, all_metrics
+
 def main():
     parser = argparse.ArgumentParser(description='YoloHome AI - Train models dự đoán nhiệt độ')
     
@@ -112,6 +293,8 @@ def main():
                       help='Tạo dữ liệu mẫu nếu không có đường dẫn dữ liệu')
     parser.add_argument('--days', type=int, default=14,
                       help='Số ngày dữ liệu mẫu để tạo')
+    parser.add_argument('--processed-data', type=str, default=None,
+                      help='Huấn luyện từ dữ liệu đã xử lý có sẵn (.npy, .feather, .parquet, .csv), bỏ qua tiền xử lý')
     
     # Tham số đầu ra
     parser.add_argument('--output-dir', type=str, default='output',
@@ -119,8 +302,12 @@ def main():
     
     # Tham số huấn luyện
     parser.add_argument('--model-type', type=str, default='decision_tree',
-                      choices=['decision_tree', 'random_forest', 'gradient_boosting'],
-                      help='Loại mô hình để huấn luyện')
+                      choices=MODEL_FAMILIES + ['all'],
+                      help='Loại mô hình để huấn luyện (all: huấn luyện song song mọi loại và giữ mô hình tốt nhất; '
+                           'với --multi-horizon bỏ qua gradient_boosting)')
+    parser.add_argument('--select-metric', type=str, default='rmse',
+                      choices=list(SELECTION_METRICS),
+                      help='Chỉ số trên tập test dùng để chọn mô hình tốt nhất với --model-type all')
     parser.add_argument('--tune', action='store_true',
                       help='Thực hiện tối ưu hyperparameter')
     parser.add_argument('--tune-method', type=str, default='grid',
@@ -128,10 +315,47 @@ def main():
                       help='Phương pháp tối ưu hyperparameter')
     parser.add_argument('--cv', type=int, default=5,
                       help='Số lượng folds cho cross-validation')
+    parser.add_argument('--no-cv-cache', action='store_true',
+                      help='Không dùng cache điểm cross-validation (output-dir/cv_cache.sqlite) khi --tune')
+    parser.add_argument('--train-jobs', type=int, default=-1,
+                      help='Tổng số CPU cho tìm tham số / cross-validation, chia giữa các fit song song và n_jobs của mô hình (-1: mọi CPU)')
+    parser.add_argument('--early-cutoff', action='store_true',
+                      help='Khi --tune: dừng cross-validation của cấu hình không còn khả năng vượt cấu hình tốt nhất')
+    parser.add_argument('--search', type=str, default='grid',
+                      choices=['grid', 'halving'],
+                      help='Cách tìm tham số khi không --tune: grid (toàn bộ lưới) hoặc halving (successive halving)')
+    parser.add_argument('--time-budget', type=float, default=None,
+                      help='Ngân sách thời gian tìm tham số (giây); dừng sớm và dùng cấu hình tốt nhất đã tìm được')
     parser.add_argument('--test-size', type=float, default=0.2,
                       help='Tỷ lệ dữ liệu kiểm tra')
+    parser.add_argument('--compact', action='store_true',
+                      help='Lưu dữ liệu đã xử lý ở kiểu gọn (float32, int8, bool) để giảm bộ nhớ')
+    parser.add_argument('--incremental', action='store_true',
+                      help='Chỉ tiền xử lý các bản ghi mới và nối vào dữ liệu đã xử lý đã có')
+    parser.add_argument('--n-jobs', type=int, default=1,
+                      help='Số tiến trình tiền xử lý song song các sensor của dữ liệu dạng dài (recorded_time, sensor_id, variable, value); -1: mọi CPU')
+    parser.add_argument('--resample', type=str, default=None,
+                      help='Gộp dữ liệu vào các bucket thời gian cố định trước khi tạo đặc trưng (ví dụ 15min)')
+    parser.add_argument('--resample-how', type=str, default='mean',
+                      choices=RESAMPLE_AGGREGATIONS,
+                      help='Cách gộp các lần đọc trong một bucket')
+    parser.add_argument('--rolling-windows', type=str, default=None,
+                      help='Thêm đặc trưng thống kê trượt (mean, std, min, max, slope) cho các cửa sổ, ví dụ 15min,1h,6h')
+    parser.add_argument('--processed-format', type=str, default='csv',
+                      choices=['csv', 'auto', 'parquet', 'feather', 'npy'],
+                      help='Định dạng lưu dữ liệu đã xử lý (mặc định processed_sensor_data.csv như trước; '
+                           'auto: feather nếu có pyarrow, ngược lại thư mục .npy - đọc lại nhanh hơn với --processed-data)')
+    parser.add_argument('--multi-horizon', action='store_true',
+                      help='Huấn luyện một mô hình nhiều đầu ra dự báo trực tiếp mọi mốc từ đặc trưng lag và thời gian')
+    parser.add_argument('--horizons', type=str, default='15,30,45,60',
+                      help='Các mốc dự báo (phút, cách nhau bởi dấu phẩy) cho --multi-horizon')
     
     args = parser.parse_args()
+    horizons = [int(h) for h in args.horizons.split(',') if h.strip()] if args.multi_horizon else None
+    rolling_windows = [w.strip() for w in args.rolling_windows.split(',') if w.strip()] if args.rolling_windows else None
+    if horizons and args.model_type == 'gradient_boosting':
+        print("Lỗi: --multi-horizon chỉ hỗ trợ decision_tree và random_forest")
+        return 1
     
     print("YoloHome AI - Train Models")
     print("=========================")
@@ -140,7 +364,7 @@ def main():
     os.makedirs(args.output_dir, exist_ok=True)
     
     # Xử lý đường dẫn dữ liệu
-    if args.data is None:
+    if args.data is None and not args.processed_data:
         if args.generate_data:
             # Tạo dữ liệu mẫu
             data_file = os.path.join(args.output_dir, 'sensor_data.csv')
@@ -150,47 +374,47 @@ def main():
             print("Lỗi: Không có đường dẫn dữ liệu. Sử dụng --data hoặc --generate-data")
             return 1
     
-    # Vẽ biểu đồ dữ liệu
-    raw_data = pd.read_csv(args.data)
-    if 'recorded_time' in raw_data.columns:
-        # Chuyển đổi timestamp thành datetime nếu cần
-        raw_data['recorded_time'] = pd.to_datetime(raw_data['recorded_time'])
-    
-    # Vẽ và lưu biểu đồ
-    plot_data(raw_data, args.output_dir)
-    
     # Xử lý dữ liệu
     print("\nĐang xử lý dữ liệu...")
-    processor = SensorDataProcessor(data_path=args.data)
-    if processor.load_data():
-        processor.preprocess_data()
-        processed_data_file = os.path.join(args.output_dir, 'processed_sensor_data.csv')
-        processor.processed_data.to_csv(processed_data_file, index=False)
-        print(f"Đã lưu dữ liệu đã xử lý vào '{processed_data_file}'")
-        X_train, X_test, y_train_temp, y_test_temp = processor.get_train_test_data(args.test_size)
+    processor = SensorDataProcessor(data_path=args.data, compact=args.compact, n_jobs=args.n_jobs,
+                                    resample=args.resample, resample_how=args.resample_how,
+                                    rolling_windows=rolling_windows)
+    if args.processed_data:
+        # Dùng dữ liệu đã xử lý sẵn (memory-map với .npy/.feather), bỏ qua tiền xử lý
+        loaded = processor.load_processed_data(args.processed_data)
+    else:
+        loaded = processor.load_data()
+        if loaded:
+            # Vẽ biểu đồ từ cửa sổ dữ liệu đã tải thay vì đọc lại toàn bộ file CSV
+            plot_data(processor.raw_data, args.output_dir)
+            loaded = preprocess(processor, args)
+    if loaded:
+        if horizons:
+            X_train, X_test, y_train_temp, y_test_temp = processor.get_multi_horizon_data(horizons, args.test_size)
+            print(f"Dự báo trực tiếp các mốc {horizons} phút")
+        else:
+            X_train, X_test, y_train_temp, y_test_temp = processor.get_train_test_data(args.test_size)
         print(f"Kích thước tập train: {X_train.shape}, tập test: {X_test.shape}")
         # Huấn luyện mô hình nhiệt độ
-        trainer = TemperatureModelTrainer(model_type=args.model_type)
-        if args.tune:
-            tuner = ModelTuner(output_dir=args.output_dir)
-            best_params_temp = None
-            if args.tune_method in ['grid', 'both']:
-                temp_grid = tuner.tune_model_grid(X_train, y_train_temp, model_type=args.model_type, cv=args.cv)
-                best_params_temp = temp_grid.best_params_
-            if args.tune_method in ['random', 'both']:
-                temp_random = tuner.tune_model_random(X_train, y_train_temp, model_type=args.model_type, cv=args.cv)
-                if not best_params_temp or temp_random.best_score_ > temp_grid.best_score_:
-                    best_params_temp = temp_random.best_params_
-            print(f"Tham số tốt nhất cho mô hình nhiệt độ: {best_params_temp}")
-            trainer.temp_model = trainer._create_model(args.model_type)
-            trainer.temp_model.set_params(**best_params_temp)
-            trainer.temp_model.fit(X_train, y_train_temp)
+        if args.model_type == 'all':
+            # Gradient boosting không hỗ trợ nhiều đầu ra
+            families = [f for f in MODEL_FAMILIES if not (horizons and f == 'gradient_boosting')]
+            best_type, trainer, evaluator, all_metrics = compare_models(families, X_train, X_test, y_train_temp, y_test_temp,
+                                                             args, horizons)
         else:
-            trainer.train_models(X_train, X_test, y_train_temp, y_test_temp, cv=args.cv)
-        # Đánh giá mô hình
-        evaluator = ModelEvaluator()
-        results = evaluator.evaluate_models(trainer.temp_model, X_test, y_test_temp)
-        print("Kết quả đánh giá:", results)
+            trainer, metrics, evaluator = train_family(args.model_type, X_train, X_test, y_train_temp, y_test_temp,
+                                                       args, horizons, args.train_jobs, args.output_dir)
+        # Đánh giá mô hình: dùng lại kết quả train_family đã tính trên tập test
+        print("Kết quả đánh giá:", all_metrics[best_type] if args.model_type == 'all' else metrics)
+        # Chỉ ghi mô hình ra output khi predict.py tải và dự đoán được với nó
+        servable, error = check_serving(trainer, X_test.head(100))
+        if not servable:
+            print(f"Lỗi: predict.py không phục vụ được mô hình {type(trainer.temp_model).__name__} ({error}), không lưu mô hình")
+            return 1
+        if args.model_type == 'all':
+            with open(os.path.join(args.output_dir, 'model_selection.json'), 'w', encoding='utf-8') as f:
+                json.dump({'select_metric': args.select_metric, 'best_model': best_type, 'metrics': all_metrics},
+                          f, ensure_ascii=False, indent=2)
         # Lưu mô hình
         trainer.save_models(temp_model_path=os.path.join(args.output_dir, 'temp_model.pkl'))
         # Báo cáo đánh giá
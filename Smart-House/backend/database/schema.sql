@@ -48,6 +48,9 @@ CREATE TABLE sensor_data (
   FOREIGN KEY (sensor_id) REFERENCES sensor (sensor_id) ON DELETE CASCADE
 );
 
+-- Index for "latest readings of one sensor" queries (AI prediction)
+CREATE INDEX idx_sensor_data_sensor_time ON sensor_data (sensor_id, recorded_time DESC);
+
 -- Table Controllogs : Save device control history
 CREATE TABLE control_logs (
   log_id SERIAL PRIMARY KEY,
@@ -1,5 +1,6 @@
 // backend/services/predictionService.js
 const path = require('path');
+const readline = require('readline');
 const { spawn } = require('child_process');
 const logger = require('../utils/logger');
 const DeviceModel = require('../models/deviceModel');
@@ -11,6 +12,10 @@ class PredictionService {
     this.predictionInterval = null;
     this.isRunning = false;
     this.threshold = 30; // Temperature threshold in Celsius
+    this.worker = null; // Long-lived `predict.py --serve` process
+    this.pendingRequests = new Map();
+    this.nextRequestId = 1;
+    this.requestTimeoutMs = 60 * 1000;
   }
 
   // Start the prediction service
@@ -37,58 +42,137 @@ class PredictionService {
     if (!this.isRunning) return;
     
     clearInterval(this.predictionInterval);
+    this.stopWorker();
     this.isRunning = false;
     logger.info('Temperature prediction service stopped');
   }
 
-  // Run the Python prediction script
+  // Start the warm Python prediction process (model is loaded once)
+  ensureWorker() {
+    if (this.worker) return this.worker;
+
+    // Path to the Python script that runs the model
+    const scriptPath = path.join(__dirname, '../../AI/predict.py');
+    const worker = spawn('python', [scriptPath, '--serve']);
+    logger.info(`Started prediction worker (pid ${worker.pid})`);
+
+    // Each stdout line is one JSON response
+    const lines = readline.createInterface({ input: worker.stdout });
+    lines.on('line', (line) => {
+      if (!line.trim()) return;
+
+      let response;
+      try {
+        response = JSON.parse(line);
+      } catch (parseError) {
+        logger.error(`Error parsing prediction data: ${parseError.message}`);
+        return;
+      }
+
+      const pending = this.pendingRequests.get(response.id);
+      if (!pending) {
+        logger.warn(`Prediction worker sent an unexpected response: ${line}`);
+        return;
+      }
+
+      clearTimeout(pending.timer);
+      this.pendingRequests.delete(response.id);
+      delete response.id;
+      pending.resolve(response);
+    });
+
+    // Handle errors
+    worker.stderr.on('data', (data) => {
+      logger.error(`Prediction script error: ${data.toString()}`);
+    });
+
+    // Respawn lazily on the next request if the worker dies
+    worker.on('close', (code) => {
+      logger.error(`Prediction process exited with code ${code}`);
+      if (this.worker === worker) this.worker = null;
+      this.rejectPending(new Error(`Prediction process exited with code ${code}`));
+    });
+
+    worker.on('error', (error) => {
+      logger.error(`Error running prediction: ${error.message}`);
+    });
+
+    // Writing to a worker that has exited (EPIPE) emits 'error' on stdin;
+    // without a handler it would crash Node. Drop the worker so the next
+    // request respawns it
+    worker.stdin.on('error', (error) => {
+      logger.error(`Prediction worker stdin error: ${error.message}`);
+      if (this.worker === worker) this.worker = null;
+      worker.kill();
+      this.rejectPending(new Error(`Prediction worker stdin error: ${error.message}`));
+    });
+
+    this.worker = worker;
+    return worker;
+  }
+
+  // Stop the warm Python prediction process
+  stopWorker() {
+    if (!this.worker) return;
+
+    const worker = this.worker;
+    this.worker = null;
+    worker.stdin.end();
+    worker.kill();
+    this.rejectPending(new Error('Prediction worker stopped'));
+  }
+
+  rejectPending(error) {
+    for (const [id, pending] of this.pendingRequests) {
+      clearTimeout(pending.timer);
+      pending.reject(error);
+      this.pendingRequests.delete(id);
+    }
+  }
+
+  // Send one JSON-lines request to the warm worker
+  requestPrediction() {
+    const worker = this.ensureWorker();
+    const id = this.nextRequestId++;
+
+    return new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        this.pendingRequests.delete(id);
+        reject(new Error(`Prediction request ${id} timed out`));
+      }, this.requestTimeoutMs);
+
+      this.pendingRequests.set(id, { resolve, reject, timer });
+      worker.stdin.write(`${JSON.stringify({ id, action: 'predict' })}\n`);
+    });
+  }
+
+  // Run a prediction on the warm Python process
   async runPrediction() {
     try {
       logger.info('Running temperature prediction for next hour');
-      
-      // Path to the Python script that runs the model
-      const scriptPath = path.join(__dirname, '../../AI/predict.py');
-      
-      // Spawn a Python process
-      const pythonProcess = spawn('python', [scriptPath]);
-      
-      let predictionData = '';
-      
-      // Collect data from script
-      pythonProcess.stdout.on('data', (data) => {
-        predictionData += data.toString();
-      });
-      
-      // Handle completion
-      pythonProcess.on('close', async (code) => {
-        if (code !== 0) {
-          logger.error(`Prediction process exited with code ${code}`);
-          return;
-        }
-        
-        try {
-          // Parse the prediction result
-          const prediction = JSON.parse(predictionData);
-          logger.info(`Prediction result: ${JSON.stringify(prediction)}`);
-          
-          // Store the prediction
-          await predictionController.storePrediction(prediction);
-          
-          // Check if the maximum predicted temperature exceeds threshold
-          if (prediction.max_temperature > this.threshold && prediction.max_confidence > 0.7) {
-            logger.info(`Predicted maximum temperature (${prediction.max_temperature}°C) exceeds threshold (${this.threshold}°C) with confidence ${prediction.max_confidence}`);
-            await this.activateCooling();
-          }
-        } catch (parseError) {
-          logger.error(`Error parsing prediction data: ${parseError.message}`);
-        }
-      });
-      
-      // Handle errors
-      pythonProcess.stderr.on('data', (data) => {
-        logger.error(`Prediction script error: ${data.toString()}`);
-      });
-      
+
+      const prediction = await this.requestPrediction();
+      logger.info(`Prediction result: ${JSON.stringify(prediction)}`);
+
+      if (prediction.error) {
+        logger.error(`Prediction failed: ${prediction.error}`);
+        return;
+      }
+
+      // Readings have not changed since the last cycle: nothing new to store,
+      // but the cooling check below still runs on the cached prediction
+      if (prediction.cached) {
+        logger.info('Sensor readings unchanged since last prediction, skipping store');
+      } else {
+        // Store the prediction
+        await predictionController.storePrediction(prediction);
+      }
+
+      // Check if the maximum predicted temperature exceeds threshold
+      if (prediction.max_temperature > this.threshold && prediction.max_confidence > 0.7) {
+        logger.info(`Predicted maximum temperature (${prediction.max_temperature}°C) exceeds threshold (${this.threshold}°C) with confidence ${prediction.max_confidence}`);
+        await this.activateCooling();
+      }
     } catch (error) {
       logger.error(`Error running prediction: ${error.message}`);
     }